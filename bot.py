@@ -3,6 +3,9 @@ import asyncio
 import discord
 from discord.ext import commands
 
+from cogs import imaging, ledger, messages, metrics, webhooks
+from cogs.downloads import close_session
+from cogs.server import start_server, stop_server
 from config.settings import settings
 
 intents = discord.Intents.default()
@@ -15,14 +18,49 @@ async def on_ready():
     print(f"{bot.user} has logged in!")
 
 
+@bot.listen()
+async def on_message(message: discord.Message):
+    messages.observe(message, await bot.get_prefix(message))
+
+
+@bot.listen()
+async def on_message_edit(before: discord.Message, after: discord.Message):
+    # link embeds usually arrive as an edit
+    messages.observe(after, await bot.get_prefix(after))
+
+
+@bot.listen()
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    messages.forget(payload.message_id)
+
+
+@bot.before_invoke
+async def label_metrics(ctx: commands.Context):
+    # runs in the command's task, so everything it awaits is labelled with it
+    metrics.command.set(ctx.command.qualified_name)
+    ledger.current_ctx.set(ctx)
+    metrics.commands_total.inc(command=ctx.command.qualified_name)
+
+
 async def main():
     async with bot:
         await bot.load_extension("cogs.images")
         await bot.load_extension("cogs.vision")
         await bot.load_extension("cogs.video")
         await bot.load_extension("cogs.admin")
-        await bot.start(settings.discord_token)
+        if settings.http_port:
+            await webhooks.load_secret()
+            await start_server()
+        try:
+            await bot.start(settings.discord_token)
+        finally:
+            await stop_server()
+            await close_session()
+            ledger.close()
+            imaging.shutdown()
 
 
-settings.validate()
-asyncio.run(main())
+# guarded: image worker processes are spawned and re-import this module
+if __name__ == "__main__":
+    settings.validate()
+    asyncio.run(main())
@@ -5,11 +5,12 @@ import sys
 from io import BytesIO
 from urllib.parse import urlparse
 
-from cogs.utils import unwrap_output
+from cogs import ledger, registry
+from cogs.downloads import DownloadTooLarge, download
+from cogs.predictions import list_predictions
+from cogs.utils import MAX_OUTPUT_BYTES, GenerationError, reply_file, unwrap_output
 
 import discord
-import replicate
-import requests
 from discord.ext import commands
 
 
@@ -93,162 +94,102 @@ class Admin(commands.Cog):
 
     @commands.command()
     async def gimme(self, ctx: commands.Context, n: int = 0):
-        """Re-post the Nth most recent succeeded Replicate prediction.
+        """Re-post the Nth most recent output the bot posted in this server.
 
         Usage: /gimmi      (latest)
                /gimmi 0    (latest)
                /gimmi 1    (second latest)
+        Served from the local ledger by re-posting the existing Discord
+        attachment; falls back to Replicate's prediction list when the ledger
+        is empty.
         """
         try:
-            async with ctx.typing():
-                page = await asyncio.to_thread(replicate.predictions.list)
-                succeeded = [p for p in page if p.status == "succeeded" and p.output]
-                if n >= len(succeeded):
-                    await ctx.reply(f"Only {len(succeeded)} succeeded prediction(s) available.")
-                    return
-                prediction = succeeded[n]
-                if not prediction:
-                    await ctx.reply("No recent succeeded predictions found.")
-                    return
+            guild_id = ctx.guild.id if ctx.guild else None
+            post = await ledger.recent_post(guild_id, max(n, 0))
+            if post is not None and post["attachment_url"]:
+                prompt = post["prompt"]
+                header = f"`/{post['command']}` {prompt[:200]}\n" if prompt else ""
+                await ctx.reply(header + post["attachment_url"])
+                return
+            count = await ledger.count_posts(guild_id)
+            if count:
+                await ctx.reply(f"Only {count} output(s) available.")
+                return
+            await self._gimme_from_replicate(ctx, n)
+        except Exception as e:
+            await ctx.reply(f"❌ An error occurred: {e}")
 
-                url = unwrap_output(prediction.output)
-                response = await asyncio.to_thread(
-                    requests.get, url, timeout=(10, 120)
-                )
-                content_type = response.headers.get("Content-Type", "")
-                ext = os.path.splitext(urlparse(url).path)[1] or (
-                    ".mp4" if "video" in content_type else
-                    ".flac" if "audio" in content_type else
-                    ".jpg"
+    async def _gimme_from_replicate(self, ctx: commands.Context, n: int):
+        async with ctx.typing():
+            page = await list_predictions()
+            succeeded = [p for p in page if p.status == "succeeded" and p.output]
+            if n >= len(succeeded):
+                await ctx.reply(f"Only {len(succeeded)} succeeded prediction(s) available.")
+                return
+            prediction = succeeded[n]
+
+            url = unwrap_output(prediction.output)
+            try:
+                content, content_type = await download(
+                    url, max_bytes=MAX_OUTPUT_BYTES
                 )
-                data = BytesIO(response.content)
-                if data.getbuffer().nbytes > 25 * 1024 * 1024:
-                    await ctx.reply(f"File too large for Discord. URL:\n{url}")
-                    return
-                data.seek(0)
-                await ctx.reply(file=discord.File(data, f"output{ext}"))
+            except DownloadTooLarge:
+                await ctx.reply(f"File too large for Discord. URL:\n{url}")
+                return
+            content_type = content_type or ""
+            ext = os.path.splitext(urlparse(url).path)[1] or (
+                ".mp4" if "video" in content_type else
+                ".flac" if "audio" in content_type else
+                ".jpg"
+            )
+            try:
+                await reply_file(ctx, content, f"output{ext}", source_url=url)
+            except GenerationError as e:
+                await ctx.reply(str(e))
+
+    @commands.command()
+    async def find(self, ctx: commands.Context, *, words: str):
+        """Search the prompts of past outputs in this server.
+
+        Usage: /find cat sunglasses
+        Lists the best matches with links to where they were posted.
+        """
+        guild_id = ctx.guild.id if ctx.guild else None
+        try:
+            rows = await ledger.search(guild_id, words)
         except Exception as e:
             await ctx.reply(f"❌ An error occurred: {e}")
+            return
+        if not rows:
+            await ctx.reply("No matching prompts found.")
+            return
+        lines = []
+        for row in rows:
+            line = f"`/{row['command']}` {row['prompt'][:120]}"
+            if row["message_id"]:
+                line += (
+                    f" — https://discord.com/channels/{guild_id or '@me'}"
+                    f"/{row['channel_id']}/{row['message_id']}"
+                )
+            lines.append(line)
+        await ctx.reply("\n".join(lines)[:2000])
 
     @commands.command()
     async def help_bot(self, ctx: commands.Context):
         """Show help information for the bot commands."""
-        embed = discord.Embed(title="🤖 Bot Commands Help", color=0x0099FF)
-
-        embed.add_field(
-            name="/flux <text>",
-            value="Generate an image using Flux Fast\n• Example: `/flux a cat wearing sunglasses`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/grok <text>",
-            value="Generate or edit images using xAI Grok Imagine (2k, 16:9)\n• No attachment: text-to-image\n• Attach 1-3 images or reply with an image: edit mode\n• Example: `/grok a futuristic city at night`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/lbgrok <text>",
-            value="Generate or edit images using xAI Grok Imagine Quality (1k, 16:9)\n• No attachment: text-to-image\n• Attach 1-3 images or reply with an image: edit mode\n• Example: `/lbgrok a futuristic city at night`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/nana <text>",
-            value="Generate an image using Nano Banana 2 Lite\n• Attach up to 14 images or reply with images for reference\n• Example: `/nana a tropical sunset`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/bnana <text>",
-            value="Generate an image using Nano Banana 2 (full quality, Google/image search grounding on)\n• Attach up to 14 images or reply with images for reference\n• Example: `/bnana a tropical sunset`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/zimg <text>",
-            value="Generate an image using Z-Image Turbo (1920x1080)\n• Example: `/zimg a mountain landscape`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/pimg <text>",
-            value="Generate or edit images using P-Image\n• No attachment: text-to-image\n• Attach 1-5 images or reply with an image: edit mode\n• Example: `/pimg a cat wearing sunglasses` or `/pimg make the sky purple`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/qwen <text>",
-            value="Generate or edit images using Qwen Image\n• No attachment: text-to-image\n• Attach 1-3 images or reply with an image: edit mode\n• Example: `/qwen a futuristic city` or `/qwen remove the background`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/krea <text>",
-            value="Generate an image using Krea 2 Medium (16:9)\n• Attach up to 10 images or reply with images to use as style references\n• Example: `/krea a knight in a painterly anime style`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/ideo <text>",
-            value="Generate an image using Ideogram v4 Turbo (2560x1440, 16:9)\n• Example: `/ideo a surreal landscape with floating islands`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/blip [question]",
-            value="Caption or ask about an image (BLIP)\n• Attach or reply with an image\n• Example: `/blip` or `/blip what color is the car?`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/caption [question]",
-            value="Caption or ask about an image (Moondream2)\n• Attach or reply with an image\n• Example: `/caption what is in this photo?`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/seed <text>",
-            value="Generate a 5s video using Seedance 1 Pro Fast (480p)\n• Attach/reply with 1 image for first frame, 2 for first+last\n• Example: `/seed a dog running on the beach`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/pvid <text>",
-            value="Generate a video using P-Video (720p)\n• Attach 1 image for first frame, 2 for first+last\n• Example: `/pvid waves crashing on rocks`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/lpvid <text>",
-            value="Like /pvid but in draft mode (faster, lower quality)\n• Attach 1 image for first frame, 2 for first+last\n• Example: `/lpvid waves crashing on rocks`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/zpvid <text>",
-            value="Like /pvid but with prompt_upsampling disabled (raw prompt)\n• Attach 1 image for first frame, 2 for first+last\n• Example: `/zpvid waves crashing on rocks`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/wan <text>",
-            value="Generate a video using Wan 2.2 I2V Fast (480p, ~5s)\n• Image required: attach 1 for first frame, 2 for first+last\n• Example: `/wan the cat leaps off the table`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/ltx <text>",
-            value="Generate a video using LTX 2.5 Fast (6s @ 720p, with audio)\n• No attachment: text-to-video\n• Attach 1 image for first frame, 2 to interpolate first→last\n• Example: `/ltx a neon city street in the rain`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/continue [text]",
-            value="Continue a video and stitch it into one continuous stream (draft mode, same as /lpvid)\n• Reply to a bot video with `/continue` (reuses original prompt)\n• Or `/continue new prompt` to steer the continuation",
-            inline=False,
-        )
-        embed.add_field(
-            name="/mmaudio [text]",
-            value="Generate audio using MMAudio\n• Attach/reply with a video for video-to-audio\n• Example: `/mmaudio wind blowing through trees`",
-            inline=False,
-        )
-        embed.add_field(
-            name="/gimme [n]",
-            value="Re-post the Nth most recent Replicate output\n• Example: `/gimme` (latest) or `/gimme 2` (3rd latest)",
-            inline=False,
-        )
-        embed.add_field(
-            name="/log [n]",
-            value="Show the last N lines of the bot's systemd logs (default 50)\n• Example: `/log 100`",
-            inline=False,
-        )
-        embed.add_field(name="/help_bot", value="Show this help message", inline=False)
-        embed.add_field(name="/cost", value="Show approximate cost per run for each command", inline=False)
-
-        await ctx.reply(embed=embed)
+        embeds = []
+        for title, entries in registry.sections():
+            if not entries:
+                continue
+            embed = discord.Embed(title=title, color=0x0099FF)
+            for entry in entries:
+                embed.add_field(
+                    name=f"/{entry.name} {entry.usage}".rstrip(),
+                    value=entry.help_text(),
+                    inline=False,
+                )
+            embeds.append(embed)
+        await ctx.reply("🤖 **Bot Commands Help**", embeds=embeds)
 
     @commands.command()
     async def cost(self, ctx: commands.Context):
@@ -261,25 +202,9 @@ class Admin(commands.Cog):
             description="Based on default settings. Variable-rate models show the typical run cost.",
             color=0x0099FF,
         )
-        embed.add_field(name="/flux",    value="~$0.005  — prunaai/flux-fast (200 runs/$1)", inline=False)
-        embed.add_field(name="/grok",    value="~$0.02  — xai/grok-imagine-image (2k, 16:9)", inline=False)
-        embed.add_field(name="/lbgrok",  value="~$0.05 text-to-image | +$0.01 per input image  — xai/grok-imagine-image-quality (1k)", inline=False)
-        embed.add_field(name="/flux2",   value="$0.002/input MP + $0.015/output MP  — black-forest-labs/flux-2-klein-9b\nText-to-image (1MP out): ~$0.015 | Image-to-image: +$0.002/input MP per image (up to 5)", inline=False)
-        embed.add_field(name="/nana",    value="~$0.034/image  — google/nano-banana-2-lite", inline=False)
-        embed.add_field(name="/bnana",   value="$0.067 (1K) | $0.101 (2K) | $0.151 (4K) per image  — google/nano-banana-2", inline=False)
-        embed.add_field(name="/pimg",    value="~$0.005 text-to-image (prunaai/p-image) | ~$0.01 with images (prunaai/p-image-edit)", inline=False)
-        embed.add_field(name="/qwen",    value="~$0.025 text-to-image (qwen/qwen-image) | ~$0.03 with images (qwen/qwen-image-edit-plus)", inline=False)
-        embed.add_field(name="/zimg",    value="~$0.02  — prunaai/z-image-turbo (1920×1088, ~2MP output)", inline=False)
-        embed.add_field(name="/blip",    value="~$0.00022  — salesforce/blip", inline=False)
-        embed.add_field(name="/caption", value="~$0.0017  — lucataco/moondream2", inline=False)
-        embed.add_field(name="/seed",    value="~$0.075/run  — bytedance/seedance-1-pro-fast (5s @ 480p, $0.015/s)", inline=False)
-        embed.add_field(name="/pvid\n/zpvid", value="~$0.16/run  — prunaai/p-video (8s @ 720p, $0.02/s)", inline=False)
-        embed.add_field(name="/wan",     value="$0.05/video @ 480p  — wan-video/wan-2.2-i2v-fast (81 frames @ 16fps ≈ 5s)", inline=False)
-        embed.add_field(name="/ltx",     value="~$0.18/run  — lightricks/ltx-2.5-fast (6s @ 720p, $0.03/s)", inline=False)
-        embed.add_field(name="/lpvid\n/continue", value="~$0.04/run  — prunaai/p-video draft mode (8s @ 720p, $0.005/s)", inline=False)
-        embed.add_field(name="/krea",    value="$0.03/image text-to-image | $0.035 with style references  — krea/krea-2-medium", inline=False)
-        embed.add_field(name="/ideo",    value="$0.03/image  — ideogram-ai/ideogram-v4-turbo (2560x1440)", inline=False)
-        embed.add_field(name="/mmaudio", value="~$0.0053  — zsxkib/mmaudio", inline=False)
+        for entry in registry.COMMANDS:
+            if entry.price:
+                embed.add_field(name=f"/{entry.name}", value=entry.price, inline=False)
         await ctx.reply(embed=embed)
 
 
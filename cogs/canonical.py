@@ -0,0 +1,50 @@
+"""Canonical form of model inputs, shared by every key built from them.
+
+Input media is identified by content rather than by how it was sent: a data
+URI or staged file URL becomes the SHA-256 of its bytes, and a Discord CDN URL
+loses its expiring signature. Result cache keys, single-flight keys, media
+cache keys and ledger lineage all go through canonicalize().
+
+This module imports nothing from cogs, so any of them can use it.
+"""
+
+import base64
+import collections
+import hashlib
+from urllib.parse import urlparse, urlunparse
+
+from config.settings import settings
+
+_DISCORD_CDN_HOSTS = ("cdn.discordapp.com", "media.discordapp.net")
+
+# staged file URL -> sha256 hex of its bytes, recorded by cogs.staging on upload
+_staged: collections.OrderedDict[str, str] = collections.OrderedDict()
+
+
+def remember_staged(url: str, digest: str):
+    """Record the content hash behind a staged file URL."""
+    _staged[url] = digest
+    _staged.move_to_end(url)
+    while len(_staged) > settings.stage_cache_size:
+        _staged.popitem(last=False)
+
+
+def canonicalize(value):
+    """Return value with media identified by content, for use in keys."""
+    if isinstance(value, dict):
+        return {k: canonicalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(v) for v in value]
+    if not isinstance(value, str):
+        return value
+    if value.startswith("data:") and ";base64," in value:
+        data = base64.b64decode(value.split(";base64,", 1)[1])
+        return "sha256:" + hashlib.sha256(data).hexdigest()
+    digest = _staged.get(value)
+    if digest:
+        return "sha256:" + digest
+    parsed = urlparse(value)
+    if parsed.hostname in _DISCORD_CDN_HOSTS:
+        # attachment ids are stable; the ex/is/hm signature is not
+        return urlunparse(parsed._replace(query=""))
+    return value
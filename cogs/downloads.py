@@ -0,0 +1,104 @@
+"""Pooled, streaming HTTP downloads shared by every cog.
+
+One aiohttp session with per-host keep-alive serves all output and input
+fetches. Bodies are streamed in chunks and size-checked against the caller's
+limit -- from the response's Content-Length before any of the body is read,
+then again while streaming -- so an oversize file is rejected without pulling
+it into memory. download_spooled() streams into a MediaBuffer instead, so
+large bodies go to disk rather than memory.
+"""
+
+import asyncio
+
+import aiohttp
+
+from cogs.spool import MediaBuffer
+from config.settings import settings
+
+CHUNK_SIZE = 64 * 1024
+
+_session: aiohttp.ClientSession | None = None
+_semaphore: asyncio.Semaphore | None = None
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a download exceeds the caller's byte limit."""
+
+    def __init__(self, url: str, size: int | None, limit: int):
+        self.url = url
+        self.size = size
+        self.limit = limit
+        shown = f"{size / 1024 / 1024:.1f} MB" if size else "unknown size"
+        super().__init__(f"{url} is too large ({shown} > {limit / 1024 / 1024:.1f} MB)")
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared download session, creating it on first use."""
+    global _session, _semaphore
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings.download_concurrency * 2,
+            limit_per_host=settings.download_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+        _semaphore = asyncio.Semaphore(settings.download_concurrency)
+    return _session
+
+
+async def close_session():
+    """Close the shared session (called on bot shutdown)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _stream(url: str, max_bytes: int | None, timeout: int, sink) -> str | None:
+    """Stream a URL's body through `await sink(chunk)` and return its content type."""
+    session = get_session()
+    client_timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=timeout)
+    async with _semaphore:
+        async with session.get(url, timeout=client_timeout) as response:
+            response.raise_for_status()
+            declared = response.content_length
+            if max_bytes is not None and declared is not None and declared > max_bytes:
+                raise DownloadTooLarge(url, declared, max_bytes)
+            received = 0
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                received += len(chunk)
+                if max_bytes is not None and received > max_bytes:
+                    raise DownloadTooLarge(url, declared, max_bytes)
+                await sink(chunk)
+            return response.headers.get("Content-Type")
+
+
+async def download(
+    url: str, max_bytes: int | None = None, timeout: int = 120
+) -> tuple[bytes, str | None]:
+    """Stream a URL into memory and return (body, content_type).
+
+    Raises DownloadTooLarge as soon as the declared or streamed size passes
+    max_bytes, and aiohttp.ClientResponseError on HTTP errors.
+    """
+    buf = bytearray()
+
+    async def sink(chunk: bytes):
+        buf.extend(chunk)
+
+    content_type = await _stream(url, max_bytes, timeout, sink)
+    return bytes(buf), content_type
+
+
+async def download_spooled(
+    url: str, max_bytes: int | None = None, timeout: int = 120, suffix: str = ".bin"
+) -> tuple[MediaBuffer, str | None]:
+    """Like download(), but into a MediaBuffer that spills to disk when large."""
+    buf = MediaBuffer(suffix)
+    try:
+        content_type = await _stream(url, max_bytes, timeout, buf.write)
+    except BaseException:
+        buf.close()
+        raise
+    return buf, content_type
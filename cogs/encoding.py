@@ -0,0 +1,352 @@
+"""Encode strategies for fitting a stitched video under a size limit.
+
+fit() chooses how to bring a video under the limit from its duration, its
+input bitrate and settings.encode_time_budget:
+
+- copy: the input already fits, so it is used as is.
+- crf: one libx264 CRF pass with a VBV cap (-maxrate/-bufsize) at the size
+  budget's bitrate. Fast, and never much over budget.
+- two_pass: two-pass ABR at the size budget's bitrate. Slower, but it spends
+  the whole budget, so quality is best when the cap would bind.
+
+Each strategy proposes a plan per x264 preset, with a predicted output size and
+wall-clock time. The first plan, in preference order, that is expected to hit
+the target at its intended quality within the time budget wins. If none fits
+the budget, the fastest size-safe plan wins. Predictions are corrected from
+history: every encode appends its plan, predicted size and time, and achieved
+size and time to settings.encode_stats_path, and the speed per preset and the
+achieved size relative to each strategy's uncorrected size estimate is
+learned from the recent records.
+
+New strategies subclass EncodeStrategy and are added to STRATEGIES.
+"""
+
+import abc
+import json
+import os
+import statistics
+import threading
+import time
+
+from cogs import metrics, spool
+from cogs.ffmpeg import AUDIO_KBPS, QUIET, MediaInfo, probe, run_ffmpeg, unlink
+from cogs.spool import MediaBuffer
+from config.settings import settings
+
+MIN_VIDEO_KBPS = 300
+# Slowest (best quality per bit) first
+PRESETS = ("medium", "faster", "veryfast")
+# Encode seconds per second of 720p24 video, per pass, until history says otherwise
+DEFAULT_SPEED = {"medium": 0.6, "faster": 0.35, "veryfast": 0.2}
+CRF = 23
+# Uncapped CRF 23 output relative to the input bitrate (inputs are CRF 20 segments)
+DEFAULT_CRF_RATIO = 0.7
+# Records the learned corrections are taken from
+HISTORY = 200
+# Default re-encode target as a fraction of the limit (rate control is not exact)
+TARGET_FRACTION = 0.8
+
+
+class Job:
+    """A video to bring under a size limit."""
+
+    def __init__(self, src_path: str, info: MediaInfo, limit: int, target_bytes: int):
+        self.src_path = src_path
+        self.limit = limit
+        self.target_bytes = target_bytes
+        self.duration = info.duration
+        self.input_bytes = os.path.getsize(src_path)
+        self.input_kbps = self.input_bytes * 8 / self.duration / 1000
+        # leave ~5% headroom under the hard limit for container overhead
+        budget_bits = self.target_bytes * 8 * 0.95
+        self.video_kbps = int(budget_bits / self.duration / 1000) - AUDIO_KBPS
+
+
+class Plan:
+    def __init__(
+        self, strategy: "EncodeStrategy", preset: str | None,
+        predicted_bytes: int, predicted_seconds: float,
+        on_target: bool, size_safe: bool, basis_bytes: int | None = None,
+    ):
+        self.strategy = strategy
+        self.preset = preset
+        self.predicted_bytes = predicted_bytes
+        self.predicted_seconds = predicted_seconds
+        # expected to meet the target at the strategy's intended quality
+        self.on_target = on_target
+        # guaranteed (or close enough) to stay under the target either way
+        self.size_safe = size_safe
+        # the uncorrected size estimate Stats.size_ratio scales; None when the
+        # achieved size says nothing about it (e.g. a CRF encode held at its cap)
+        self.basis_bytes = basis_bytes
+
+    def __str__(self) -> str:
+        name = self.strategy.name + (f"/{self.preset}" if self.preset else "")
+        return (
+            f"{name} (predicted {self.predicted_bytes / 1024 / 1024:.1f} MB"
+            f" in {self.predicted_seconds:.0f}s)"
+        )
+
+
+class Stats:
+    """Corrections learned from recent encode records."""
+
+    def __init__(self, records: list[dict]):
+        self.records = records
+
+    def _matching(self, **fields) -> list[dict]:
+        return [r for r in self.records if all(r.get(k) == v for k, v in fields.items())]
+
+    def speed(self, preset: str) -> float:
+        """Encode seconds per second of video for one pass at `preset`."""
+        samples = [
+            r["seconds"] / r["duration"] / r["passes"]
+            for r in self._matching(preset=preset)
+            if r.get("duration")
+        ]
+        return statistics.median(samples) if samples else DEFAULT_SPEED[preset]
+
+    def size_ratio(self, strategy: str) -> float:
+        """Median achieved size over the uncorrected estimate (1.0 without history)."""
+        samples = [
+            r["achieved_bytes"] / r["basis_bytes"]
+            for r in self._matching(strategy=strategy)
+            if r.get("basis_bytes")
+        ]
+        return statistics.median(samples) if samples else 1.0
+
+
+class EncodeStrategy(abc.ABC):
+    name = ""
+    passes = 1
+
+    @abc.abstractmethod
+    def plans(self, job: Job, stats: Stats) -> list[Plan]:
+        """Return candidate plans for the job, in this strategy's preference order."""
+
+    @abc.abstractmethod
+    async def run(self, job: Job, plan: Plan, out_path: str, on_progress=None):
+        """Encode job.src_path to out_path according to plan.
+
+        on_progress, if given, is called with the fraction done (0..1).
+        """
+
+
+class StreamCopy(EncodeStrategy):
+    name = "copy"
+    passes = 0
+
+    def plans(self, job, stats):
+        fits = job.input_bytes <= job.limit
+        return [Plan(self, None, job.input_bytes, 0.0, fits, fits)]
+
+    async def run(self, job, plan, out_path, on_progress=None):
+        pass
+
+
+class CappedCRF(EncodeStrategy):
+    name = "crf"
+
+    def plans(self, job, stats):
+        cap_bytes = int((job.video_kbps + AUDIO_KBPS) * 1000 * job.duration / 8)
+        basis = int(job.input_bytes * DEFAULT_CRF_RATIO)
+        uncapped = int(basis * stats.size_ratio(self.name))
+        return [
+            Plan(
+                self, preset, min(uncapped, cap_bytes),
+                job.duration * stats.speed(preset),
+                on_target=uncapped <= job.target_bytes * 0.95,
+                size_safe=True,
+                # learn only from encodes the cap is not expected to bind
+                basis_bytes=basis if uncapped < cap_bytes else None,
+            )
+            for preset in PRESETS
+        ]
+
+    async def run(self, job, plan, out_path, on_progress=None):
+        with metrics.stage("encode_crf"):
+            await run_ffmpeg([
+                "ffmpeg", "-y", *QUIET, "-i", job.src_path,
+                "-c:v", "libx264", "-preset", plan.preset, "-crf", str(CRF),
+                "-maxrate", f"{job.video_kbps}k", "-bufsize", f"{job.video_kbps * 2}k",
+                "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", f"{AUDIO_KBPS}k",
+                "-movflags", "+faststart", out_path,
+            ], duration=job.duration, on_progress=on_progress)
+
+
+class TwoPassABR(EncodeStrategy):
+    name = "two_pass"
+    passes = 2
+
+    def plans(self, job, stats):
+        budget = int((job.video_kbps + AUDIO_KBPS) * 1000 * job.duration / 8)
+        predicted = int(budget * stats.size_ratio(self.name))
+        return [
+            Plan(
+                self, preset, predicted, 2 * job.duration * stats.speed(preset),
+                on_target=True, size_safe=True, basis_bytes=budget,
+            )
+            for preset in PRESETS
+        ]
+
+    async def run(self, job, plan, out_path, on_progress=None):
+        log_file = out_path + "-pass"
+        fs_path = out_path + ".fs.mp4"
+        try:
+            # The input is already normalized, so both passes see the same frames.
+            encode_common = [
+                "ffmpeg", "-y", *QUIET, "-i", job.src_path,
+                "-c:v", "libx264", "-preset", plan.preset, "-b:v", f"{job.video_kbps}k",
+                "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", f"{AUDIO_KBPS}k",
+            ]
+            # each pass is half the work
+            def half(offset):
+                return on_progress and (lambda done: on_progress(offset + done / 2))
+
+            with metrics.stage("encode_pass1"):
+                await run_ffmpeg(
+                    encode_common + ["-pass", "1", "-passlogfile", log_file, "-f", "null", os.devnull],
+                    duration=job.duration, on_progress=half(0),
+                )
+            with metrics.stage("encode_pass2"):
+                await run_ffmpeg(
+                    encode_common + ["-pass", "2", "-passlogfile", log_file, out_path],
+                    duration=job.duration, on_progress=half(0.5),
+                )
+
+            # Best-effort faststart remux (moov atom to front for progressive playback).
+            # Cheap stream copy; if it fails, fall back to the already-encoded file rather
+            # than discarding the expensive two-pass encode.
+            try:
+                with metrics.stage("remux"):
+                    await run_ffmpeg([
+                        "ffmpeg", "-y", *QUIET, "-i", out_path,
+                        "-c", "copy", "-movflags", "+faststart", fs_path,
+                    ])
+                os.replace(fs_path, out_path)
+            except Exception as e:
+                print(f"[encode] faststart remux skipped: {e}")
+        finally:
+            # ffmpeg writes "<passlogfile>-<stream_idx>.log" (+ ".mbtree")
+            unlink(fs_path, f"{log_file}-0.log", f"{log_file}-0.log.mbtree")
+
+
+STRATEGIES: list[EncodeStrategy] = [StreamCopy(), CappedCRF(), TwoPassABR()]
+TWO_PASS = STRATEGIES[-1]
+
+_records: list[dict] | None = None
+_lock = threading.Lock()
+
+
+def _load() -> list[dict]:
+    global _records
+    if _records is None:
+        _records = []
+        try:
+            with open(settings.encode_stats_path) as f:
+                for line in f:
+                    try:
+                        _records.append(json.loads(line))
+                    except ValueError:
+                        pass
+        except OSError:
+            pass
+        _records = _records[-HISTORY:]
+    return _records
+
+
+def _record(job: Job, plan: Plan, achieved_bytes: int, seconds: float):
+    entry = {
+        "strategy": plan.strategy.name,
+        "preset": plan.preset,
+        "passes": plan.strategy.passes,
+        "duration": job.duration,
+        "input_kbps": round(job.input_kbps),
+        "target_bytes": job.target_bytes,
+        "predicted_bytes": plan.predicted_bytes,
+        "basis_bytes": plan.basis_bytes,
+        "predicted_seconds": round(plan.predicted_seconds, 2),
+        "achieved_bytes": achieved_bytes,
+        "seconds": round(seconds, 2),
+        "at": time.time(),
+    }
+    print(
+        f"[encode] {plan.strategy.name}/{plan.preset}: {achieved_bytes / 1024 / 1024:.1f} MB"
+        f" in {seconds:.0f}s (predicted {plan.predicted_bytes / 1024 / 1024:.1f} MB"
+        f" in {plan.predicted_seconds:.0f}s)"
+    )
+    with _lock:
+        records = _load()
+        records.append(entry)
+        del records[:-HISTORY]
+        try:
+            os.makedirs(os.path.dirname(settings.encode_stats_path) or ".", exist_ok=True)
+            with open(settings.encode_stats_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"[encode] could not save stats: {e}")
+
+
+def choose(job: Job) -> Plan:
+    """Pick the plan for a job (see module docstring)."""
+    with _lock:
+        stats = Stats(list(_load()))
+    plans = [plan for strategy in STRATEGIES for plan in strategy.plans(job, stats)]
+    for plan in plans:
+        if plan.on_target and plan.predicted_seconds <= settings.encode_time_budget:
+            return plan
+    return min((p for p in plans if p.size_safe), key=lambda p: p.predicted_seconds)
+
+
+async def _encode(job: Job, plan: Plan, on_progress=None) -> MediaBuffer:
+    out_path = spool.temp_path(".mp4")
+    try:
+        start = time.monotonic()
+        await plan.strategy.run(job, plan, out_path, on_progress)
+        data = MediaBuffer.from_file(out_path, ".mp4")
+        _record(job, plan, data.size, time.monotonic() - start)
+        return data
+    finally:
+        unlink(out_path)
+
+
+async def fit(
+    src_path: str, limit: int, target_bytes: int | None = None, on_progress=None,
+) -> MediaBuffer:
+    """Return src_path's video as an mp4 MediaBuffer no larger than limit.
+
+    Inputs already under limit are moved into the buffer unchanged, so the
+    file at src_path is consumed; anything else is re-encoded to target_bytes
+    (default TARGET_FRACTION of limit) with the chosen strategy. Raises
+    ValueError if the video is too long to fit at acceptable quality, or if
+    it needs re-encoding but ffprobe reports no duration.
+    on_progress, if given, is called with the fraction of a re-encode done (0..1).
+    """
+    with metrics.stage("probe"):
+        info = await probe(src_path)
+    if target_bytes is None:
+        target_bytes = int(limit * TARGET_FRACTION)
+    if info.duration <= 0:
+        # some fragmented/streamed mp4s report no duration; without one no bitrate
+        # can be planned, so only an input that already fits can be used
+        if os.path.getsize(src_path) <= limit:
+            return MediaBuffer.from_file(src_path, ".mp4")
+        raise ValueError("Video has no readable duration, so it can't be re-encoded to fit")
+    job = Job(src_path, info, limit, target_bytes)
+    if job.input_bytes > limit and job.video_kbps < MIN_VIDEO_KBPS:
+        raise ValueError(
+            f"Video is too long ({job.duration:.0f}s) to fit in"
+            f" {limit / 1024 / 1024:.0f} MB."
+        )
+    plan = choose(job)
+    print(f"[encode] {job.duration:.0f}s @ {job.input_kbps:.0f} kbps -> {plan}")
+    if plan.strategy.passes == 0:
+        return MediaBuffer.from_file(src_path, ".mp4")
+    data = await _encode(job, plan, on_progress)
+    if data.size > limit and plan.strategy is not TWO_PASS:
+        # a CRF pass overshot its cap; redo it with the size-exact strategy
+        print(f"[encode] {plan.strategy.name} overshot ({data.size} bytes), retrying two-pass")
+        data.close()
+        retry = min(TWO_PASS.plans(job, Stats([])), key=lambda p: p.predicted_seconds)
+        data = await _encode(job, retry, on_progress)
+    return data
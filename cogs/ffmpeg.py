@@ -0,0 +1,209 @@
+"""Async ffmpeg/ffprobe process manager.
+
+Every ffmpeg and ffprobe process the bot starts goes through run_ffmpeg() or
+probe(). These run as asyncio subprocesses, not blocking worker threads, and
+share a machine-wide cap of settings.media_processes concurrent processes,
+which defaults to half the CPU count since x264 already uses several cores per
+encode. The scheduler's "ffmpeg" slots still decide whose job goes next; this
+cap keeps the machine from oversubscribing when several jobs run at once.
+
+A process that times out, or whose awaiting task is cancelled (the command
+failed, the bot is shutting down), is killed and reaped rather than left
+running.
+
+Given the input's duration, run_ffmpeg() adds `-progress pipe:1` and reports
+the fraction done to a callback, so status messages can show a percentage.
+
+probe() gets the duration, streams and codecs of a file from one JSON ffprobe
+call, cached per file (path, size and mtime).
+"""
+
+import asyncio
+import collections
+import json
+import os
+import subprocess
+import tempfile
+
+from config.settings import settings
+
+AUDIO_KBPS = 128
+QUIET = ["-hide_banner", "-loglevel", "error", "-nostats"]
+# Probe results kept, keyed by (path, size, mtime)
+PROBE_CACHE_SIZE = 256
+
+_semaphore: asyncio.Semaphore | None = None
+_probes: collections.OrderedDict[tuple, "MediaInfo"] = collections.OrderedDict()
+
+
+def _slots() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.media_processes)
+    return _semaphore
+
+
+async def _exec(
+    cmd: list[str], timeout: float, on_stdout_line=None, input: bytes | None = None,
+) -> tuple[bytes, bytes]:
+    """Run cmd under the process cap; return (stdout, stderr).
+
+    input, if given, is fed to the process's stdin. If on_stdout_line is given,
+    stdout is consumed line by line through it instead of being returned. The
+    process is killed on timeout or cancellation.
+    """
+    async with _slots():
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL if input is None else asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        async def read_stdout() -> bytes:
+            if on_stdout_line is None:
+                return await proc.stdout.read()
+            async for line in proc.stdout:
+                on_stdout_line(line.decode("utf-8", "replace").strip())
+            return b""
+
+        async def write_stdin():
+            if input is None:
+                return
+            try:
+                proc.stdin.write(input)
+                await proc.stdin.drain()
+                proc.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                # ffmpeg stopped reading; its exit status says whether that was an error
+                pass
+
+        try:
+            _, stdout, stderr, _ = await asyncio.wait_for(
+                asyncio.gather(write_stdin(), read_stdout(), proc.stderr.read(), proc.wait()),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            await _kill(proc)
+            raise subprocess.TimeoutExpired(cmd, timeout) from None
+        except BaseException:
+            await _kill(proc)
+            raise
+    if proc.returncode != 0:
+        tail = "\n".join(stderr.decode("utf-8", "replace").strip().splitlines()[-15:])
+        print(f"[ffmpeg] {os.path.basename(cmd[0])} exit {proc.returncode}:\n{tail}")
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return stdout, stderr
+
+
+async def _kill(proc: asyncio.subprocess.Process):
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await asyncio.shield(proc.wait())
+
+
+async def run_ffmpeg(
+    cmd: list[str], timeout: float = 300, duration: float | None = None, on_progress=None,
+    input: bytes | None = None,
+) -> bytes:
+    """Run an ffmpeg command and return its stdout.
+
+    input, if given, is piped to ffmpeg's stdin (use "-i pipe:0").
+    With duration (seconds of output) and on_progress, on_progress is called
+    with the fraction done (0..1) as ffmpeg reports it; stdout must not be the
+    command's output in that case. Raises subprocess.CalledProcessError (with
+    stderr attached, the tail printed to the log) on non-zero exit, and
+    subprocess.TimeoutExpired on timeout.
+    """
+    if on_progress is None or not duration:
+        stdout, _ = await _exec(cmd, timeout, input=input)
+        return stdout
+
+    def on_line(line: str):
+        key, _, value = line.partition("=")
+        # out_time_us is in microseconds; out_time_ms is too, despite its name
+        if key in ("out_time_us", "out_time_ms") and value.isdigit():
+            on_progress(min(int(value) / 1_000_000 / duration, 1.0))
+        elif key == "progress" and value == "end":
+            on_progress(1.0)
+
+    cmd = [cmd[0], "-progress", "pipe:1", *cmd[1:]]
+    await _exec(cmd, timeout, on_line, input)
+    return b""
+
+
+class MediaInfo:
+    """What ffprobe knows about a file: format and streams."""
+
+    def __init__(self, data: dict):
+        self.format = data.get("format", {})
+        self.streams = data.get("streams", [])
+
+    @property
+    def duration(self) -> float:
+        value = self.format.get("duration")
+        if value is None:
+            value = max((float(s.get("duration", 0)) for s in self.streams), default=0)
+        return float(value)
+
+    @property
+    def bit_rate(self) -> int:
+        return int(self.format.get("bit_rate") or 0)
+
+    def _first(self, codec_type: str) -> dict | None:
+        return next((s for s in self.streams if s.get("codec_type") == codec_type), None)
+
+    @property
+    def video(self) -> dict | None:
+        return self._first("video")
+
+    @property
+    def audio(self) -> dict | None:
+        return self._first("audio")
+
+    @property
+    def has_audio(self) -> bool:
+        return self.audio is not None
+
+
+async def probe(path: str) -> MediaInfo:
+    """Return the MediaInfo for a file from one (cached) JSON ffprobe call."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    info = _probes.get(key)
+    if info is not None:
+        _probes.move_to_end(key)
+        return info
+    stdout, _ = await _exec(
+        ["ffprobe", "-v", "error", "-print_format", "json",
+         "-show_format", "-show_streams", path],
+        timeout=30,
+    )
+    info = MediaInfo(json.loads(stdout or b"{}"))
+    _probes[key] = info
+    while len(_probes) > PROBE_CACHE_SIZE:
+        _probes.popitem(last=False)
+    return info
+
+
+def _write_temp(data: bytes, suffix: str) -> str:
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tf:
+        tf.write(data)
+        return tf.name
+
+
+async def write_temp(data: bytes, suffix: str = ".mp4") -> str:
+    """Write data to a new temp file (off the event loop) and return its path."""
+    return await asyncio.to_thread(_write_temp, data, suffix)
+
+
+def unlink(*paths: str):
+    """Remove files, ignoring ones that are already gone."""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,72 @@
+"""Fit outputs under the upload limit of the guild they are posted to.
+
+The limit comes from ctx.guild.filesize_limit: 10 MB normally, and 50 or
+100 MB in boosted guilds. Outputs under the limit are posted untouched. An
+oversize video is re-encoded to fit with the strategies in cogs.encoding. An
+oversize image is recompressed (see cogs.imaging), lowering the quality and
+then the resolution until it fits. Only outputs that can't be
+made to fit at all (audio, or a video too long for any sane bitrate) fall back
+to posting the URL.
+"""
+
+import os
+
+import discord
+from discord.ext import commands
+
+from cogs import encoding, imaging, metrics
+from cogs.progress import renderer
+from cogs.scheduler import scheduler
+from cogs.spool import MediaBuffer
+
+VIDEO_EXTS = (".mp4", ".mov", ".webm", ".mkv")
+
+
+def upload_limit(ctx: commands.Context) -> int:
+    """Return the largest file the bot may upload where ctx was invoked."""
+    if ctx.guild is not None:
+        return ctx.guild.filesize_limit
+    return discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+
+
+async def _fit_video(
+    ctx: commands.Context, data: bytes | MediaBuffer, limit: int, status_msg
+) -> MediaBuffer:
+    if not isinstance(data, MediaBuffer):
+        data = await MediaBuffer.from_bytes(data, ".mp4")
+    # encoding.fit only takes over its input file when that already fits, which it doesn't
+    src = await data.path()
+    async with scheduler.slot("ffmpeg", ctx, "ffmpeg", status_msg):
+        text = "🎬 Re-encoding to fit this server's upload limit..."
+
+        def on_progress(done: float):
+            if status_msg is not None:
+                renderer.update(status_msg, f"{text} {done:.0%}")
+
+        if status_msg is not None:
+            renderer.update(status_msg, text)
+        return await encoding.fit(src, limit, on_progress=on_progress)
+
+
+async def fit_to_limit(
+    ctx: commands.Context, data: bytes | MediaBuffer, filename: str, status_msg=None,
+) -> tuple[bytes | MediaBuffer, str]:
+    """Return (data, filename) fitted under the upload limit where ctx was invoked.
+
+    Data already under the limit is returned unchanged. Raises ValueError if
+    it can't be made to fit.
+    """
+    limit = upload_limit(ctx)
+    if len(data) <= limit:
+        return data, filename
+    base, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    print(f"[fit] {filename} is {len(data) / 1024 / 1024:.1f} MB, limit {limit / 1024 / 1024:.0f} MB")
+    with metrics.stage("fit"):
+        if ext in VIDEO_EXTS:
+            return await _fit_video(ctx, data, limit, status_msg), base + ".mp4"
+        if ext in imaging.IMAGE_EXTS:
+            if isinstance(data, MediaBuffer):
+                data = await data.read()
+            return await imaging.fit(data, filename, limit)
+    raise ValueError(f"{ext or 'file'} outputs can't be shrunk to fit")
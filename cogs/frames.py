@@ -0,0 +1,103 @@
+"""Last-frame extraction for /continue, without temp files and cached.
+
+The video goes to ffmpeg either as a path, for files already on disk such as
+stored segments and spooled buffers, or piped to stdin from memory. The JPEG is read back from
+stdout. Input seeking (-sseof) jumps to the keyframe before the final half
+second, so only that tail is decoded. Reversing those few frames makes the
+very last one come out first.
+
+A pipe can only be read front to back, so piping in from memory works only
+when the mp4's index (moov) comes before its media data (mdat). Otherwise the
+bytes are written to a temp file first.
+
+Frames are kept in a small LRU cache keyed by the attachment id, the file path,
+or the sha256 of the bytes. Concurrent extractions of the same video share one
+ffmpeg run, so several people continuing the same clip pay for it once.
+"""
+
+import collections
+import hashlib
+import struct
+
+from cogs import metrics, singleflight
+from cogs.ffmpeg import QUIET, run_ffmpeg, unlink, write_temp
+from cogs.spool import MediaBuffer
+
+# Extracted frames kept (~100-300 KB each)
+FRAME_CACHE_SIZE = 32
+# Seconds before the end to seek to; must cover at least one frame
+TAIL_SECONDS = 0.5
+
+_frames: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+
+
+def _moov_first(data: bytes) -> bool:
+    """Return True if an mp4's moov box comes before its mdat box."""
+    pos = 0
+    while pos + 8 <= len(data):
+        size, box = struct.unpack(">I4s", data[pos:pos + 8])
+        if box == b"moov":
+            return True
+        if box == b"mdat":
+            return False
+        if size == 1 and pos + 16 <= len(data):
+            size = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+        if size < 8:
+            return False
+        pos += size
+    return False
+
+
+def _command(source: str) -> list[str]:
+    return [
+        "ffmpeg", *QUIET, "-sseof", f"-{TAIL_SECONDS}", "-i", source,
+        "-vf", "reverse", "-frames:v", "1", "-q:v", "2",
+        "-c:v", "mjpeg", "-f", "image2pipe", "pipe:1",
+    ]
+
+
+async def _extract(video: bytes | str | MediaBuffer) -> bytes:
+    if isinstance(video, MediaBuffer):
+        source, data = video.ffmpeg_input()
+        video = source if data is None else data
+    with metrics.stage("extract_frame"):
+        if isinstance(video, str):
+            return await run_ffmpeg(_command(video), timeout=60)
+        if _moov_first(video):
+            return await run_ffmpeg(_command("pipe:0"), timeout=60, input=video)
+        path = await write_temp(video)
+        try:
+            return await run_ffmpeg(_command(path), timeout=60)
+        finally:
+            unlink(path)
+
+
+async def extract_last_frame(
+    video: bytes | str | MediaBuffer, key: str | None = None
+) -> bytes:
+    """Return the last frame of a video (bytes, a file path or a buffer) as JPEG bytes.
+
+    key identifies the video for the cache (e.g. "attachment:<id>"); it defaults
+    to the path, or to the sha256 of the bytes.
+    """
+    if key is None:
+        if isinstance(video, MediaBuffer):
+            source, data = video.ffmpeg_input()
+            key = source if data is None else hashlib.sha256(data).hexdigest()
+        elif isinstance(video, str):
+            key = video
+        else:
+            key = hashlib.sha256(video).hexdigest()
+    frame = _frames.get(key)
+    if frame is not None:
+        _frames.move_to_end(key)
+        return frame
+    frame = await singleflight.run(
+        singleflight.flight_key("extract_frame", key), lambda: _extract(video)
+    )
+    if not frame:
+        raise ValueError("ffmpeg returned no frame")
+    _frames[key] = frame
+    while len(_frames) > FRAME_CACHE_SIZE:
+        _frames.popitem(last=False)
+    return frame
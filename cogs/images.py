@@ -1,248 +1,48 @@
-import asyncio
-
-import replicate
 from discord.ext import commands
 
-from cogs.utils import get_attachments, to_data_uris, reply_with_file, run_image_model
-from cogs.error_log import log_error
-
-
-class Images(commands.Cog):
-    def __init__(self, bot: commands.Bot):
-        self.bot = bot
-
-    @commands.command()
-    async def flux(self, ctx: commands.Context, *, text: str):
-        """Generate an image using Flux AI.
-
-        Usage: /flux your image description here
-        """
-        await run_image_model(ctx, "prunaai/flux-fast", {
-            "seed": -1,
-            "prompt": text,
-            "guidance": 8,
-            "image_size": 1024,
-            "speed_mode": "Lightly Juiced 🍊 (more consistent)",
-            "aspect_ratio": "1:1",
-            "output_format": "jpg",
-            "output_quality": 80,
-            "num_inference_steps": 28,
-        }, "generated_image.jpg", "flux")
-
-    @commands.command()
-    async def flux2(self, ctx: commands.Context, *, text: str):
-        """Generate an image using FLUX.2 Klein 9B.
-
-        Usage: /flux2 your image description here
-        Attach 1-5 images for image-to-image, or reply to a message with images.
-        """
-        model_input = {
-            "prompt": text,
-            "aspect_ratio": "16:9",
-            "output_format": "jpg",
-            "output_quality": 95,
-            "output_megapixels": "1",
-            "disable_safety_checker": True,
-        }
-        attachments, embed_urls = await get_attachments(ctx, "image/")
-        if attachments or embed_urls:
-            model_input["images"] = await to_data_uris(attachments, embed_urls, limit=5)
-            model_input["aspect_ratio"] = "match_input_image"
-        await run_image_model(ctx, "black-forest-labs/flux-2-klein-9b", model_input, "generated_image.jpg", "flux2")
-
-    @commands.command()
-    async def nana(self, ctx: commands.Context, *, text: str):
-        """Generate an image using Nano Banana 2 Lite.
-
-        Usage: /nana your image description here
-        Attach up to 14 images to use as reference input, or reply to a message with images.
-        """
-        model_input = {
-            "prompt": text,
-            "aspect_ratio": "16:9",
-            "output_format": "jpg",
-        }
-        attachments, embed_urls = await get_attachments(ctx, "image/")
-        if attachments or embed_urls:
-            model_input["image_input"] = await to_data_uris(attachments, embed_urls, limit=14)
-        await run_image_model(ctx, "google/nano-banana-2-lite", model_input, "generated_image.jpg", "nana")
-
-    @commands.command()
-    async def bnana(self, ctx: commands.Context, *, text: str):
-        """Generate an image using Nano Banana 2 (full quality).
-
-        Usage: /bnana your image description here
-        Attach up to 14 images to use as reference input, or reply to a message with images.
-        """
-        model_input = {
-            "prompt": text,
-            "aspect_ratio": "16:9",
-            "resolution": "1K",
-            "output_format": "jpg",
-            "google_search": True,
-            "image_search": True,
-        }
-        attachments, embed_urls = await get_attachments(ctx, "image/")
-        if attachments or embed_urls:
-            model_input["image_input"] = await to_data_uris(attachments, embed_urls, limit=14)
-        await run_image_model(ctx, "google/nano-banana-2", model_input, "generated_image.jpg", "bnana")
+from cogs import registry
+from cogs.utils import get_attachments, to_inputs, run_image_model
 
-    @commands.command()
-    async def pimg(self, ctx: commands.Context, *, text: str):
-        """Generate or edit images using P-Image.
 
-        Usage: /pimg your prompt here (text-to-image)
-        Attach 1-5 images or reply to a message with an image to edit instead.
-        """
+async def run_image_command(ctx: commands.Context, command: registry.ModelCommand, text: str):
+    """Run a registry image command: route it, stage any attached images, and generate."""
+    routed = registry.route(command)
+    if routed is not command:
+        await ctx.reply(f"⚡ /{command.name} is slow right now, using /{routed.name} instead.")
+    command = routed
+    images = []
+    if command.images:
         attachments, embed_urls = await get_attachments(ctx, "image/")
         if attachments or embed_urls:
-            data_uris = await to_data_uris(attachments, embed_urls, limit=5)
-            await run_image_model(ctx, "prunaai/p-image-edit", {
-                "prompt": text,
-                "images": data_uris,
-                "aspect_ratio": "16:9",
-                "disable_safety_checker": True,
-            }, "generated_image.jpg", "pimg")
-        else:
-            await run_image_model(ctx, "prunaai/p-image", {
-                "prompt": text,
-                "aspect_ratio": "custom",
-                "width": 1440,
-                "height": 810,
-                "disable_safety_checker": True,
-            }, "generated_image.jpg", "pimg")
+            images = await to_inputs(
+                attachments, embed_urls, limit=command.max_images, max_side=command.max_input_side
+            )
+    model, model_input = command.build_input(text, images)
+    await run_image_model(
+        ctx, model, model_input, command.filename, command.name, cacheable=command.cacheable(model_input)
+    )
 
-    @commands.command()
-    async def qwen(self, ctx: commands.Context, *, text: str):
-        """Generate or edit images using Qwen Image.
 
-        Usage: /qwen your prompt here (text-to-image)
-        Attach 1-3 images or reply to a message with images to edit instead.
-        """
-        attachments, embed_urls = await get_attachments(ctx, "image/")
-        if attachments or embed_urls:
-            try:
-                async with ctx.typing():
-                    data_uris = await to_data_uris(attachments, embed_urls, limit=3)
-                    output = await asyncio.to_thread(
-                        replicate.run,
-                        "qwen/qwen-image-edit-plus",
-                        input={
-                            "image": data_uris,
-                            "prompt": text,
-                            "output_format": "jpg",
-                            "aspect_ratio": "match_input_image",
-                            "disable_safety_checker": True,
-                        },
-                    )
-                    urls = output if isinstance(output, list) else [output]
-                    if urls:
-                        await reply_with_file(ctx, str(urls[0]), "edited_image.jpg")
-                    else:
-                        await ctx.reply("No output returned.")
-            except Exception as e:
-                log_error("qwen", e, ctx, text)
-                await ctx.reply(f"An error occurred: {e}")
-        else:
-            await run_image_model(ctx, "qwen/qwen-image", {
-                "prompt": text,
-                "aspect_ratio": "16:9",
-                "output_format": "jpg",
-                "disable_safety_checker": True,
-            }, "generated_image.jpg", "qwen")
-
-    @commands.command()
-    async def grok(self, ctx: commands.Context, *, text: str):
-        """Generate or edit images using xAI Grok Imagine.
-
-        Usage: /grok your image description here (text-to-image)
-        Attach 1-3 images or reply to a message with images to edit instead.
-        """
-        attachments, embed_urls = await get_attachments(ctx, "image/")
-        if attachments or embed_urls:
-            data_uris = await to_data_uris(attachments, embed_urls, limit=3)
-            await run_image_model(ctx, "xai/grok-imagine-image", {
-                "prompt": text,
-                "image": data_uris[0] if len(data_uris) == 1 else data_uris,
-                "aspect_ratio": "auto",
-                "resolution": "2k",
-            }, "generated_image.jpg", "grok")
-        else:
-            await run_image_model(ctx, "xai/grok-imagine-image", {
-                "prompt": text,
-                "aspect_ratio": "16:9",
-                "resolution": "2k",
-            }, "generated_image.jpg", "grok")
-
-    @commands.command()
-    async def lbgrok(self, ctx: commands.Context, *, text: str):
-        """Generate or edit images using xAI Grok Imagine (Quality).
-
-        Usage: /lbgrok your image description here (text-to-image)
-        Attach 1-3 images or reply to a message with images to edit instead.
-        """
-        attachments, embed_urls = await get_attachments(ctx, "image/")
-        if attachments or embed_urls:
-            data_uris = await to_data_uris(attachments, embed_urls, limit=3)
-            await run_image_model(ctx, "xai/grok-imagine-image-quality", {
-                "prompt": text,
-                "image": data_uris[0] if len(data_uris) == 1 else data_uris,
-                "aspect_ratio": "auto",
-                "resolution": "1k",
-            }, "generated_image.jpg", "lbgrok")
-        else:
-            await run_image_model(ctx, "xai/grok-imagine-image-quality", {
-                "prompt": text,
-                "aspect_ratio": "16:9",
-                "resolution": "1k",
-            }, "generated_image.jpg", "lbgrok")
-
-    @commands.command()
-    async def krea(self, ctx: commands.Context, *, text: str):
-        """Generate an image using Krea 2 Medium.
-
-        Usage: /krea your image description here
-        Attach up to 10 images (or reply to a message with images) to use as
-        style references.
-        """
-        model_input = {
-            "prompt": text,
-            "aspect_ratio": "16:9",
-            "creativity": "raw",
-        }
-        attachments, embed_urls = await get_attachments(ctx, "image/")
-        if attachments or embed_urls:
-            model_input["style_reference_images"] = await to_data_uris(attachments, embed_urls, limit=10)
-        await run_image_model(ctx, "krea/krea-2-medium", model_input, "generated_image.jpg", "krea")
-
-    @commands.command()
-    async def ideo(self, ctx: commands.Context, *, text: str):
-        """Generate an image using Ideogram v4 Turbo.
-
-        Usage: /ideo your image description here
-        """
-        await run_image_model(ctx, "ideogram-ai/ideogram-v4-turbo", {
-            "prompt": text,
-            "resolution": "2560x1440",
-            "enable_copyright_detection": False,
-        }, "generated_image.jpg", "ideo")
+class Images(commands.Cog):
+    """Image commands, one per "image" entry in cogs.registry."""
 
-    @commands.command()
-    async def zimg(self, ctx: commands.Context, *, text: str):
-        """Generate an image using Z-Image Turbo.
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
 
-        Usage: /zimg your image description here
-        """
-        await run_image_model(ctx, "prunaai/z-image-turbo", {
-            "prompt": text,
-            "width": 1920,
-            "height": 1088,
-            "guidance_scale": 0,
-            "num_inference_steps": 8,
-            "output_format": "jpg",
-            "output_quality": 80,
-        }, "generated_image.jpg", "zimg")
+    flux = registry.model_command("flux", run_image_command)
+    flux2 = registry.model_command("flux2", run_image_command)
+    grok = registry.model_command("grok", run_image_command)
+    lbgrok = registry.model_command("lbgrok", run_image_command)
+    nana = registry.model_command("nana", run_image_command)
+    bnana = registry.model_command("bnana", run_image_command)
+    zimg = registry.model_command("zimg", run_image_command)
+    pimg = registry.model_command("pimg", run_image_command)
+    qwen = registry.model_command("qwen", run_image_command)
+    krea = registry.model_command("krea", run_image_command)
+    ideo = registry.model_command("ideo", run_image_command)
 
 
 async def setup(bot: commands.Bot):
-    await bot.add_cog(Images(bot))
+    cog = Images(bot)
+    registry.check_commands(cog, "image")
+    await bot.add_cog(cog)
@@ -0,0 +1,200 @@
+"""Image output post-processing in a worker process pool.
+
+Before an image is posted it is re-encoded to settings.image_format (WebP, or
+optimized progressive JPEG) at settings.image_quality. If the result is still
+over settings.image_target_kb, the quality steps down until it fits. Metadata
+(EXIF, XMP, text chunks) is dropped; only the ICC profile is kept, so colours
+survive. An output already in the configured format and under the target is
+posted as is rather than being compressed twice.
+
+Pillow work is CPU-bound and holds the GIL for most of an encode, so it runs in
+a small process pool (settings.image_workers) instead of on the event loop or
+in threads. Commands whose models can produce the configured format ask for
+it up front (see ModelCommand.output_formats).
+
+Attached input images go through the same pool before they are staged: each is
+downscaled to its command's max_input_side (a 12 MP phone photo is far more
+than a model working at ~1 MP or 720p can use) and re-encoded, with its EXIF
+orientation applied. Results are cached by attachment id.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from config.settings import settings
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+# Pillow format name and file extension per settings.image_format
+FORMATS = {"webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg")}
+# Lowest quality stepped down to when meeting the size target
+MIN_QUALITY = 60
+# Scales tried (after MIN_QUALITY) when an image must fit a hard limit
+SCALES = (0.75, 0.5, 0.35, 0.25)
+# Downscaled input images kept, keyed by (attachment id, max side)
+INPUT_CACHE_SIZE = 64
+# JPEG quality for downscaled inputs; they are model inputs, not outputs
+INPUT_QUALITY = 90
+
+_pool: concurrent.futures.ProcessPoolExecutor | None = None
+_inputs: collections.OrderedDict[tuple, tuple[bytes, str]] = collections.OrderedDict()
+
+
+def _executor() -> concurrent.futures.ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: don't fork the bot's event loop and threads into the workers
+        _pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=settings.image_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor(), fn, *args)
+
+
+def _encode(img: Image.Image, fmt: str, quality: int, icc: bytes | None) -> bytes:
+    out = BytesIO()
+    if fmt == "JPEG":
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.save(out, fmt, quality=quality, optimize=True, progressive=True, icc_profile=icc)
+    else:
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        img.save(out, fmt, quality=quality, method=4, icc_profile=icc)
+    return out.getvalue()
+
+
+def recompress(data: bytes, image_format: str, quality: int, target: int) -> tuple[bytes, str]:
+    """Re-encode an image (see module docstring). Returns (bytes, extension)."""
+    fmt, ext = FORMATS[image_format]
+    with Image.open(BytesIO(data)) as src:
+        if src.format == fmt and len(data) <= target and not src.info.get("exif"):
+            return data, ext
+        src.load()
+        icc = src.info.get("icc_profile")
+        img = src.copy()
+    out = _encode(img, fmt, quality, icc)
+    while len(out) > target and quality > MIN_QUALITY:
+        quality = max(quality - 10, MIN_QUALITY)
+        out = _encode(img, fmt, quality, icc)
+    return out, ext
+
+
+def shrink(data: bytes, image_format: str, limit: int) -> tuple[bytes, str]:
+    """Re-encode an image to no more than limit bytes, lowering quality, then scale.
+
+    Raises ValueError if even the smallest scale doesn't fit.
+    """
+    fmt, ext = FORMATS[image_format]
+    with Image.open(BytesIO(data)) as src:
+        src.load()
+        icc = src.info.get("icc_profile")
+        img = src.copy()
+    for scale in (1.0, *SCALES):
+        scaled = img
+        if scale < 1:
+            size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+            scaled = img.resize(size, Image.LANCZOS)
+        for quality in range(settings.image_quality, MIN_QUALITY - 1, -10):
+            out = _encode(scaled, fmt, quality, icc)
+            if len(out) <= limit:
+                return out, ext
+    raise ValueError("image can't be compressed under the upload limit")
+
+
+def downscale(data: bytes, max_side: int) -> tuple[bytes, str] | None:
+    """Shrink an image so its long side is at most max_side. Returns (bytes, content type).
+
+    Returns None if the image is already small enough. Images with
+    transparency become PNG, the rest JPEG; metadata is dropped.
+    """
+    with Image.open(BytesIO(data)) as src:
+        if max(src.size) <= max_side:
+            return None
+        img = ImageOps.exif_transpose(src)
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    out = BytesIO()
+    if "A" in img.getbands() or "transparency" in img.info:
+        img.convert("RGBA").save(out, "PNG", optimize=True)
+        return out.getvalue(), "image/png"
+    img.convert("RGB").save(out, "JPEG", quality=INPUT_QUALITY, optimize=True)
+    return out.getvalue(), "image/jpeg"
+
+
+def _rename(filename: str, ext: str) -> str:
+    return os.path.splitext(filename)[0] + ext
+
+
+async def optimize(data: bytes, filename: str) -> tuple[bytes, str]:
+    """Post-process an image output for posting. Returns (bytes, filename).
+
+    Non-images, and images Pillow can't read, are returned unchanged.
+    """
+    if os.path.splitext(filename)[1].lower() not in IMAGE_EXTS:
+        return data, filename
+    try:
+        out, ext = await _run(
+            recompress, data, settings.image_format, settings.image_quality,
+            settings.image_target_kb * 1024,
+        )
+    except (OSError, ValueError) as e:
+        print(f"[imaging] left {filename} as is: {e}")
+        return data, filename
+    if len(out) != len(data):
+        print(f"[imaging] {filename}: {len(data) // 1024} KB -> {len(out) // 1024} KB")
+    return out, _rename(filename, ext)
+
+
+async def fit(data: bytes, filename: str, limit: int) -> tuple[bytes, str]:
+    """Recompress an image to fit under limit bytes. Raises ValueError if it can't."""
+    out, ext = await _run(shrink, data, settings.image_format, limit)
+    return out, _rename(filename, ext)
+
+
+def cached_input(key, max_side: int) -> tuple[bytes, str] | None:
+    """Return a previously downscaled input (bytes, content type) for key, if cached."""
+    result = _inputs.get((key, max_side))
+    if result is not None:
+        _inputs.move_to_end((key, max_side))
+    return result
+
+
+async def prepare_input(
+    data: bytes, content_type: str | None, max_side: int, key=None
+) -> tuple[bytes, str | None]:
+    """Downscale an input image for a model. Returns (bytes, content type).
+
+    Images already within max_side, and images Pillow can't read, are
+    returned unchanged. With a key (an attachment id), the result is cached.
+    """
+    try:
+        result = await _run(downscale, data, max_side)
+    except (OSError, ValueError) as e:
+        print(f"[imaging] input left as is: {e}")
+        return data, content_type
+    if result is None:
+        result = (data, content_type)
+    else:
+        print(f"[imaging] input {len(data) // 1024} KB -> {len(result[0]) // 1024} KB (max {max_side}px)")
+    if key is not None:
+        _inputs[(key, max_side)] = result
+        while len(_inputs) > INPUT_CACHE_SIZE:
+            _inputs.popitem(last=False)
+    return result
+
+
+def shutdown():
+    """Stop the worker processes (called on bot shutdown)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
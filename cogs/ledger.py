@@ -0,0 +1,272 @@
+"""Local SQLite ledger of the predictions the bot runs and the messages it posts.
+
+Every prediction the bot creates is recorded with the command, user, guild,
+prompt, Replicate timings and output URL. Every output the bot posts is
+recorded with its message and attachment, joined to its prediction by output
+URL. /gimme reads recent posts from here, and /find searches prompts through
+an FTS5 index.
+
+Every output message also gets a lineage entry: the command, prompt and model
+inputs that produced it, the Replicate URL it came from, the local copy of
+the posted file (in cogs.media_cache) and its parent, the output it was a
+reply to. Follow-up commands such as /continue resolve what they reply to
+from here instead of fetching and parsing the reply chain.
+
+The database runs in WAL mode, so it can be inspected (or backed up) while
+the bot writes to it. The bot itself uses one connection, from worker threads,
+behind a lock.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import discord
+from discord.ext import commands
+
+from cogs.canonical import canonicalize
+from config.settings import settings
+
+# The command context being handled in the current task, set before each command
+current_ctx: contextvars.ContextVar[commands.Context | None] = contextvars.ContextVar(
+    "ledger_ctx", default=None
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id TEXT PRIMARY KEY,
+    command TEXT,
+    model TEXT,
+    user_id INTEGER,
+    guild_id INTEGER,
+    channel_id INTEGER,
+    prompt TEXT,
+    status TEXT,
+    created_at TEXT,
+    started_at TEXT,
+    completed_at TEXT,
+    predict_time REAL,
+    output_url TEXT,
+    recorded_at REAL
+);
+CREATE INDEX IF NOT EXISTS predictions_output ON predictions(output_url);
+CREATE TABLE IF NOT EXISTS posts (
+    message_id INTEGER PRIMARY KEY,
+    channel_id INTEGER,
+    guild_id INTEGER,
+    user_id INTEGER,
+    command TEXT,
+    output_url TEXT,
+    attachment_url TEXT,
+    filename TEXT,
+    size INTEGER,
+    posted_at REAL
+);
+CREATE INDEX IF NOT EXISTS posts_guild_time ON posts(guild_id, posted_at DESC);
+CREATE INDEX IF NOT EXISTS posts_output ON posts(output_url);
+CREATE TABLE IF NOT EXISTS lineage (
+    message_id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    command TEXT,
+    model TEXT,
+    prompt TEXT,
+    inputs TEXT,
+    source_url TEXT,
+    media_key TEXT,
+    file_path TEXT,
+    filename TEXT,
+    posted_at REAL
+);
+CREATE INDEX IF NOT EXISTS lineage_parent ON lineage(parent_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS prompts_fts USING fts5(
+    prompt, content='predictions', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS predictions_ai AFTER INSERT ON predictions BEGIN
+    INSERT INTO prompts_fts(rowid, prompt) VALUES (new.rowid, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS predictions_ad AFTER DELETE ON predictions BEGIN
+    INSERT INTO prompts_fts(prompts_fts, rowid, prompt) VALUES ('delete', old.rowid, old.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS predictions_au AFTER UPDATE OF prompt ON predictions BEGIN
+    INSERT INTO prompts_fts(prompts_fts, rowid, prompt) VALUES ('delete', old.rowid, old.prompt);
+    INSERT INTO prompts_fts(rowid, prompt) VALUES (new.rowid, new.prompt);
+END;
+"""
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        directory = os.path.dirname(settings.ledger_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(settings.ledger_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _conn = conn
+    return _conn
+
+
+def _execute(sql: str, params=()) -> list[sqlite3.Row]:
+    with _lock:
+        conn = _connect()
+        with conn:
+            return conn.execute(sql, params).fetchall()
+
+
+async def _run(sql: str, params=()) -> list[sqlite3.Row]:
+    if not settings.ledger_path:
+        return []
+    try:
+        return await asyncio.to_thread(_execute, sql, params)
+    except sqlite3.Error as e:
+        print(f"[ledger] {e}")
+        return []
+
+
+def _output_url(output) -> str | None:
+    if not output:
+        return None
+    if isinstance(output, list):
+        output = output[0]
+    return str(output)
+
+
+async def record_prediction(prediction, model: str, model_input: dict):
+    """Record a finished prediction for the command being handled."""
+    ctx = current_ctx.get()
+    await _run(
+        "INSERT OR REPLACE INTO predictions (id, command, model, user_id, guild_id, channel_id,"
+        " prompt, status, created_at, started_at, completed_at, predict_time, output_url,"
+        " recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            prediction.id,
+            ctx.command.qualified_name if ctx and ctx.command else None,
+            model,
+            ctx.author.id if ctx else None,
+            ctx.guild.id if ctx and ctx.guild else None,
+            ctx.channel.id if ctx else None,
+            str(model_input.get("prompt", "")),
+            prediction.status,
+            str(prediction.created_at) if prediction.created_at else None,
+            str(prediction.started_at) if prediction.started_at else None,
+            str(prediction.completed_at) if prediction.completed_at else None,
+            (prediction.metrics or {}).get("predict_time"),
+            _output_url(prediction.output),
+            time.time(),
+        ),
+    )
+
+
+async def record_post(ctx: commands.Context, message: discord.Message, output_url: str | None):
+    """Record that `message` posted the output downloaded from output_url."""
+    attachment = message.attachments[0] if message.attachments else None
+    await _run(
+        "INSERT OR REPLACE INTO posts (message_id, channel_id, guild_id, user_id, command,"
+        " output_url, attachment_url, filename, size, posted_at)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            message.id,
+            message.channel.id,
+            ctx.guild.id if ctx.guild else None,
+            ctx.author.id,
+            ctx.command.qualified_name if ctx.command else None,
+            output_url,
+            attachment.url if attachment else None,
+            attachment.filename if attachment else None,
+            attachment.size if attachment else None,
+            time.time(),
+        ),
+    )
+
+
+async def record_lineage(
+    ctx: commands.Context, message: discord.Message, model: str, model_input: dict | None,
+    source_url: str | None, media_key: str | None, file_path: str | None,
+):
+    """Record where output `message` came from (see module docstring).
+
+    Its parent is the message the command replied to, if that is an output too.
+    Media in model_input is stored by content hash, not as data URIs.
+    """
+    attachment = message.attachments[0] if message.attachments else None
+    reference = ctx.message.reference
+    await _run(
+        "INSERT OR REPLACE INTO lineage (message_id, parent_id, command, model, prompt, inputs,"
+        " source_url, media_key, file_path, filename, posted_at)"
+        " VALUES (?, (SELECT message_id FROM lineage WHERE message_id = ?),"
+        " ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            message.id,
+            reference.message_id if reference else None,
+            ctx.command.qualified_name if ctx.command else None,
+            model or None,
+            str(model_input.get("prompt", "")) if model_input else None,
+            json.dumps(canonicalize(model_input)) if model_input else None,
+            source_url,
+            media_key,
+            file_path,
+            attachment.filename if attachment else None,
+            time.time(),
+        ),
+    )
+
+
+async def lineage(message_id: int) -> sqlite3.Row | None:
+    """Return the lineage entry of an output message, or None if it isn't one."""
+    rows = await _run("SELECT * FROM lineage WHERE message_id = ?", (message_id,))
+    return rows[0] if rows else None
+
+
+async def recent_post(guild_id: int | None, n: int = 0) -> sqlite3.Row | None:
+    """Return the Nth most recent post in a guild (0 = latest), with its prompt."""
+    rows = await _run(
+        "SELECT posts.*, predictions.prompt FROM posts"
+        " LEFT JOIN predictions ON predictions.output_url = posts.output_url"
+        " WHERE posts.guild_id IS ? ORDER BY posts.posted_at DESC LIMIT 1 OFFSET ?",
+        (guild_id, n),
+    )
+    return rows[0] if rows else None
+
+
+async def count_posts(guild_id: int | None) -> int:
+    rows = await _run("SELECT COUNT(*) FROM posts WHERE guild_id IS ?", (guild_id,))
+    return rows[0][0] if rows else 0
+
+
+async def search(guild_id: int | None, words: str, limit: int = 10) -> list[sqlite3.Row]:
+    """Full-text (prefix) search of prompts in a guild, best matches first.
+
+    Each result is a prediction with the first message it was posted as, if any.
+    """
+    terms = ['"' + w.replace('"', '""') + '"*' for w in words.split()]
+    if not terms:
+        return []
+    return await _run(
+        "SELECT p.id, p.command, p.prompt, p.recorded_at, posts.message_id, posts.channel_id"
+        " FROM prompts_fts JOIN predictions p ON p.rowid = prompts_fts.rowid"
+        " LEFT JOIN posts ON posts.message_id = ("
+        "   SELECT message_id FROM posts WHERE output_url = p.output_url"
+        "   ORDER BY posted_at LIMIT 1)"
+        " WHERE prompts_fts MATCH ? AND p.guild_id IS ? AND p.status = 'succeeded'"
+        " ORDER BY rank LIMIT ?",
+        (" ".join(terms), guild_id, limit),
+    )
+
+
+def close():
+    """Close the database connection (called on bot shutdown)."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
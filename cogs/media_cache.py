@@ -0,0 +1,187 @@
+"""On-disk cache of input media (attachments and URLs the bot fetched).
+
+The same image or video is often fed to several commands in a row (/blip,
+then /caption, then a /pimg edit, then /wan). Every input fetch goes through
+here, so it is downloaded once. Entries are keyed by attachment id or by URL,
+with the expiring signature of Discord CDN URLs stripped. Each entry is a
+plain file with a normal extension, so ffmpeg and Pillow can open it directly,
+and has a JSON sidecar that records its content type and SHA-256. A file whose
+contents no longer match the hash is dropped and fetched again.
+
+The directory (settings.media_cache_dir) is kept under
+settings.media_cache_max_bytes by evicting the least recently used entries.
+Entries pinned by a running command are never evicted. Outputs the bot posts
+are stored too (put()), under their attachment's key, so follow-ups on them
+don't download them back from Discord.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from cogs import metrics, singleflight
+from cogs.canonical import canonicalize
+from cogs.spool import MediaBuffer
+from config.settings import settings
+
+_pinned: dict[str, int] = {}
+
+
+def url_key(url: str) -> str:
+    """Cache key for a URL."""
+    return "url:" + canonicalize(url)
+
+
+def attachment_key(attachment) -> str:
+    """Cache key for a discord.Attachment."""
+    return f"attachment:{attachment.id}"
+
+
+def _name(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _meta_path(name: str) -> str:
+    return os.path.join(settings.media_cache_dir, name + ".json")
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _remove(name: str, path: str | None = None):
+    for p in (path, _meta_path(name)):
+        if p is None:
+            continue
+        try:
+            os.unlink(p)
+        except OSError:
+            pass
+
+
+def _get(name: str) -> tuple[str, str | None] | None:
+    try:
+        with open(_meta_path(name)) as f:
+            meta = json.load(f)
+        path = os.path.join(settings.media_cache_dir, meta["file"])
+        if _hash_file(path) != meta["sha256"]:
+            print(f"[media_cache] {meta['file']} failed verification, dropping it")
+            _remove(name, path)
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    os.utime(path)
+    return path, meta.get("content_type")
+
+
+def _evict():
+    entries = []
+    total = 0
+    with os.scandir(settings.media_cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith((".json", ".tmp")):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.name, entry.path))
+            total += stat.st_size
+    entries.sort()
+    for _, size, filename, path in entries:
+        if total <= settings.media_cache_max_bytes:
+            break
+        name = os.path.splitext(filename)[0]
+        if name in _pinned:
+            continue
+        _remove(name, path)
+        total -= size
+
+
+def _put(name: str, data: bytes | str, content_type: str | None) -> str:
+    """Store bytes, or copy the file at path `data`, under name. Returns the entry's path."""
+    os.makedirs(settings.media_cache_dir, exist_ok=True)
+    ext = mimetypes.guess_extension((content_type or "").split(";")[0].strip()) or ".bin"
+    path = os.path.join(settings.media_cache_dir, name + ext)
+    tmp = path + ".tmp"
+    if isinstance(data, str):
+        shutil.copyfile(data, tmp)
+    else:
+        with open(tmp, "wb") as f:
+            f.write(data)
+    digest = _hash_file(tmp)
+    os.replace(tmp, path)
+    with open(_meta_path(name), "w") as f:
+        json.dump({"file": name + ext, "content_type": content_type, "sha256": digest}, f)
+    _evict()
+    return path
+
+
+async def _store(name: str, data: bytes | MediaBuffer, content_type: str | None) -> str:
+    if isinstance(data, MediaBuffer):
+        data = await data.path() if data.on_disk else await data.read()
+    return await asyncio.to_thread(_put, name, data, content_type)
+
+
+async def _fetch(key: str, load) -> tuple[str, str | None]:
+    name = _name(key)
+    hit = await asyncio.to_thread(_get, name)
+    if hit is not None:
+        metrics.media_cache.inc(result="hit")
+        return hit
+    metrics.media_cache.inc(result="miss")
+
+    async def fill() -> tuple[str, str | None]:
+        with metrics.stage("fetch"):
+            data, content_type = await load()
+        metrics.add_bytes("fetch", len(data))
+        return await _store(name, data, content_type), content_type
+
+    return await singleflight.run(singleflight.flight_key("media_cache", key), fill)
+
+
+async def get_path(key: str, load) -> tuple[str, str | None]:
+    """Return (path, content_type) for cached media, fetching it with `await load()` on a miss.
+
+    load returns (bytes or MediaBuffer, content_type). Pin the key while the
+    path is in use for longer than a moment.
+    """
+    return await _fetch(key, load)
+
+
+async def get_bytes(key: str, load) -> tuple[bytes, str | None]:
+    """Like get_path(), but return the media's bytes."""
+    path, content_type = await _fetch(key, load)
+    return await asyncio.to_thread(_read, path), content_type
+
+
+async def put(key: str, data: bytes | MediaBuffer, content_type: str | None) -> str | None:
+    """Store media the bot already has (e.g. an output it posted) under key. Returns its path."""
+    try:
+        return await _store(_name(key), data, content_type)
+    except OSError as e:
+        print(f"[media_cache] store failed: {e}")
+        return None
+
+
+@contextlib.contextmanager
+def pin(key: str):
+    """Keep key's entry from being evicted inside the block."""
+    name = _name(key)
+    _pinned[name] = _pinned.get(name, 0) + 1
+    try:
+        yield
+    finally:
+        _pinned[name] -= 1
+        if not _pinned[name]:
+            del _pinned[name]
@@ -0,0 +1,79 @@
+"""Resolve replied-to messages without a REST round trip where possible.
+
+Commands that act on a reply look the message up through resolve(), which
+tries, in order:
+
+1. the message Discord already resolved on the reference;
+2. the gateway message cache (the last messages the bot saw, in any channel);
+3. a bounded LRU of recent messages relevant to the bot: ones with
+   attachments or embeds, bot posts and command invocations. These outlive
+   the gateway cache, which every message in every channel passes through;
+4. a REST fetch, whose result goes into the LRU.
+
+Each lookup is counted in sloppy_message_lookups_total by where it was found
+(rest being the miss).
+"""
+
+import collections
+
+import discord
+from discord.ext import commands
+
+from cogs import metrics
+
+MAX_ENTRIES = 1000
+
+_recent: collections.OrderedDict[int, discord.Message] = collections.OrderedDict()
+
+
+def _remember(message: discord.Message):
+    _recent[message.id] = message
+    _recent.move_to_end(message.id)
+    while len(_recent) > MAX_ENTRIES:
+        _recent.popitem(last=False)
+
+
+def observe(message: discord.Message, prefix: str | list[str]):
+    """Keep a message seen on the gateway if a later command may reply to it."""
+    prefixes = (prefix,) if isinstance(prefix, str) else tuple(prefix)
+    if (
+        message.attachments
+        or message.embeds
+        or message.author.bot
+        or message.content.startswith(prefixes)
+    ):
+        _remember(message)
+    elif message.id in _recent:
+        # edited into something irrelevant; drop the stale copy
+        del _recent[message.id]
+
+
+def forget(message_id: int):
+    """Drop a deleted message."""
+    _recent.pop(message_id, None)
+
+
+async def resolve(ctx: commands.Context, reference: discord.MessageReference) -> discord.Message:
+    """Return the message a reference points to (see module docstring).
+
+    Raises discord.NotFound if it was deleted.
+    """
+    message_id = reference.message_id
+    if isinstance(reference.resolved, discord.Message):
+        metrics.message_lookups.inc(source="resolved")
+        return reference.resolved
+    message = discord.utils.get(ctx.bot.cached_messages, id=message_id)
+    if message is not None:
+        metrics.message_lookups.inc(source="gateway")
+        return message
+    message = _recent.get(message_id)
+    if message is not None:
+        _recent.move_to_end(message_id)
+        metrics.message_lookups.inc(source="recent")
+        return message
+    metrics.message_lookups.inc(source="rest")
+    channel = ctx.bot.get_channel(reference.channel_id) or ctx.channel
+    with metrics.stage("fetch_message"):
+        message = await channel.fetch_message(message_id)
+    _remember(message)
+    return message
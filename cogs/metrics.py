@@ -0,0 +1,186 @@
+"""Per-stage latency and throughput metrics in Prometheus text format.
+
+Code wraps each stage of a command in `with metrics.stage(name, model=...)`;
+its duration lands in the sloppy_stage_seconds histogram labelled by stage,
+command and model. Bytes moved by a stage go to sloppy_stage_bytes_total, and
+finished predictions are counted by status, with Replicate's own queue and
+predict times recorded as the "replicate_queue" and "predict" stages.
+
+The command label comes from a context variable set before every command is
+invoked, so helpers deep in the call chain (downloads, staging, ffmpeg, disk
+I/O in worker threads) are attributed without passing it around. Everything is
+served at /metrics on the built-in HTTP server.
+
+Stages: fetch (input attachments/URLs), resize (downscaling input images),
+encode (staging inputs), fetch_message (REST lookups of replied-to messages),
+queue (local scheduler wait), create, run (until the prediction is terminal),
+download, extract_frame, probe, normalize, join, encode_crf, encode_pass1,
+encode_pass2, remux (ffmpeg), fit (shrinking oversize outputs), upload
+(posting to Discord).
+"""
+
+import contextlib
+import contextvars
+import datetime
+import math
+import threading
+import time
+
+from aiohttp import web
+
+from cogs.server import app
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, math.inf)
+
+# Name of the command being handled in the current task (or worker thread)
+command: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_command", default="none")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> (per-bucket counts, sum, count)
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, n in zip(self.buckets, counts):
+                    le = 'le="+Inf"' if bound == math.inf else f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {n}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "sloppy_stage_seconds", "Time spent in each stage of a command.",
+    ("stage", "command", "model"),
+)
+stage_bytes = Counter(
+    "sloppy_stage_bytes_total", "Bytes moved by each stage of a command.",
+    ("stage", "command", "model"),
+)
+predictions = Counter(
+    "sloppy_predictions_total", "Finished Replicate predictions by status.",
+    ("command", "model", "status"),
+)
+commands_total = Counter(
+    "sloppy_commands_total", "Commands invoked.", ("command",),
+)
+message_lookups = Counter(
+    "sloppy_message_lookups_total",
+    "Replied-to message lookups by where the message was found (rest is a miss).",
+    ("source",),
+)
+media_cache = Counter(
+    "sloppy_media_cache_total", "Input media cache lookups by result.", ("result",),
+)
+
+_METRICS = (
+    stage_seconds, stage_bytes, predictions, commands_total, message_lookups, media_cache,
+)
+
+
+def observe(name: str, seconds: float, model: str = ""):
+    """Record one duration for stage `name` of the current command."""
+    stage_seconds.observe(seconds, stage=name, command=command.get(), model=model)
+
+
+@contextlib.contextmanager
+def stage(name: str, model: str = ""):
+    """Time the block as one observation of stage `name` for the current command."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, model)
+
+
+def add_bytes(name: str, size: int, model: str = ""):
+    """Count bytes moved by stage `name` for the current command."""
+    stage_bytes.inc(size, stage=name, command=command.get(), model=model)
+
+
+def _timestamp(value) -> float | None:
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def record_prediction(prediction, model: str):
+    """Count a finished prediction and record Replicate's queue and predict times."""
+    predictions.inc(command=command.get(), model=model, status=prediction.status)
+    created = _timestamp(prediction.created_at)
+    started = _timestamp(prediction.started_at)
+    if created is not None and started is not None:
+        observe("replicate_queue", max(started - created, 0.0), model)
+    predict_time = (prediction.metrics or {}).get("predict_time")
+    if predict_time is not None:
+        observe("predict", float(predict_time), model)
+
+
+def render() -> str:
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+app.router.add_get("/metrics", handle_metrics)
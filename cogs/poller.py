@@ -0,0 +1,169 @@
+"""Central poller for every in-flight Replicate prediction.
+
+Instead of each command running its own sleep/get loop, jobs register with the
+shared PredictionPoller and await a future. One background task refreshes
+whatever is due: when several jobs are due at once a single list call covers
+all the recent ones, and only the stragglers are fetched individually. Each job
+is polled at an interval picked from its kind and status -- image models are
+checked often, video and audio less so, and anything still "starting" (a cold
+boot) waits longest. When webhooks are enabled, notify() delivers updates as
+they arrive and polling drops to a slow fallback for missed events.
+"""
+
+import asyncio
+import collections
+import time
+from typing import Awaitable, Callable
+
+from cogs.predictions import TERMINAL_STATUSES, get_prediction, list_predictions
+from config.settings import settings
+
+# kind -> (interval while starting, interval while processing), in seconds
+POLL_INTERVALS = {
+    "image": (3.0, 1.0),
+    "audio": (8.0, 3.0),
+    "video": (10.0, 5.0),
+}
+
+# Use one list call instead of individual gets once this many jobs are due
+LIST_THRESHOLD = 3
+
+# Terminal webhook events kept for jobs that have not started waiting yet
+MAX_EARLY = 200
+
+OnUpdate = Callable[[object, int], Awaitable[None]]
+
+
+class _Job:
+    def __init__(self, prediction, kind: str, on_update: OnUpdate | None):
+        self.prediction = prediction
+        self.kind = kind
+        self.on_update = on_update
+        self.started = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.next_poll = 0.0
+        self.schedule()
+
+    def schedule(self):
+        starting, processing = POLL_INTERVALS.get(self.kind, POLL_INTERVALS["video"])
+        interval = starting if self.prediction.status == "starting" else processing
+        if settings.webhook_url:
+            interval = max(interval, settings.webhook_fallback_interval)
+        self.next_poll = time.monotonic() + interval
+
+
+class PredictionPoller:
+    def __init__(self):
+        self._jobs: dict[str, _Job] = {}
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._updates: set[asyncio.Task] = set()
+        self._early: collections.OrderedDict[str, object] = collections.OrderedDict()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def wait(self, prediction, kind: str = "video", on_update: OnUpdate | None = None):
+        """Wait for a prediction to reach a terminal status and return it.
+
+        on_update(prediction, elapsed_seconds) is scheduled after each refresh
+        that leaves the prediction still running.
+        """
+        if prediction.status in TERMINAL_STATUSES:
+            return prediction
+        early = self._early.pop(prediction.id, None)
+        if early is not None:
+            return early
+        job = _Job(prediction, kind, on_update)
+        self._jobs[prediction.id] = job
+        self._ensure_running()
+        self._wakeup.set()
+        try:
+            return await job.future
+        finally:
+            self._jobs.pop(prediction.id, None)
+
+    def notify(self, prediction):
+        """Apply a pushed update (e.g. from a webhook) to the matching job."""
+        job = self._jobs.get(prediction.id)
+        if job is not None:
+            self._update(job, prediction)
+        elif prediction.status in TERMINAL_STATUSES:
+            # The prediction finished before its command started waiting
+            self._early[prediction.id] = prediction
+            while len(self._early) > MAX_EARLY:
+                self._early.popitem(last=False)
+
+    async def _run(self):
+        while self._jobs:
+            now = time.monotonic()
+            due = [job for job in self._jobs.values() if job.next_poll <= now]
+            if due:
+                await self._refresh(due)
+            if not self._jobs:
+                break
+            delay = max(0.0, min(job.next_poll for job in self._jobs.values()) - time.monotonic())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refresh(self, due: list[_Job]):
+        remaining = {job.prediction.id: job for job in due}
+        if len(due) >= LIST_THRESHOLD:
+            try:
+                for prediction in await list_predictions():
+                    job = remaining.get(prediction.id)
+                    # A terminal state from the list is re-fetched so the final
+                    # prediction always carries its complete output.
+                    if job and prediction.status not in TERMINAL_STATUSES:
+                        del remaining[prediction.id]
+                        self._update(job, prediction)
+            except Exception as e:
+                print(f"[poller] list failed, falling back to gets: {e}")
+
+        semaphore = asyncio.Semaphore(settings.poll_concurrency)
+
+        async def fetch(job: _Job):
+            async with semaphore:
+                try:
+                    prediction = await get_prediction(job.prediction.id)
+                except asyncio.TimeoutError:
+                    print(f"[poller] {job.prediction.id} poll hung, retrying...")
+                    job.schedule()
+                    return
+                except Exception as e:
+                    print(f"[poller] {job.prediction.id} poll failed: {e}")
+                    job.schedule()
+                    return
+                self._update(job, prediction)
+
+        await asyncio.gather(*(fetch(job) for job in remaining.values()))
+
+    def _update(self, job: _Job, prediction):
+        job.prediction = prediction
+        if job.future.done():
+            return
+        if prediction.status in TERMINAL_STATUSES:
+            job.future.set_result(prediction)
+            return
+        job.schedule()
+        if job.on_update:
+            # Run the callback off the poll loop so a slow Discord edit never
+            # delays refreshing the other jobs.
+            elapsed = int(time.monotonic() - job.started)
+            task = asyncio.create_task(self._notify(job.on_update, prediction, elapsed))
+            self._updates.add(task)
+            task.add_done_callback(self._updates.discard)
+
+    @staticmethod
+    async def _notify(on_update: OnUpdate, prediction, elapsed: int):
+        try:
+            await on_update(prediction, elapsed)
+        except Exception as e:
+            print(f"[poller] status update failed: {e}")
+
+
+poller = PredictionPoller()
@@ -0,0 +1,118 @@
+"""Async Replicate prediction client shared by every cog.
+
+All Replicate API traffic goes through one replicate.Client backed by a pooled
+keep-alive httpx transport, so commands never block the event loop and
+concurrent jobs reuse the same TLS connections.
+"""
+
+import asyncio
+
+import httpx
+import replicate
+
+from cogs import ledger, metrics
+from config.settings import settings
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+WEBHOOK_EVENTS = ["start", "output", "completed"]
+
+_client: replicate.Client | None = None
+
+
+def get_client() -> replicate.Client:
+    """Return the shared async Replicate client, creating it on first use.
+
+    The client is async-only: its transport is an httpx.AsyncHTTPTransport, so
+    only the async_* methods may be called on it.
+    """
+    global _client
+    if _client is None:
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.replicate_max_connections,
+                max_keepalive_connections=settings.replicate_max_connections,
+                keepalive_expiry=60.0,
+            ),
+        )
+        _client = replicate.Client(
+            api_token=settings.replicate_api_token,
+            transport=transport,
+        )
+    return _client
+
+
+def _split_ref(ref: str) -> tuple[str | None, str | None]:
+    """Split a model reference into (model, version).
+
+    Accepts "owner/name" (latest version via the models endpoint),
+    "owner/name:version" or a bare version id.
+    """
+    if ":" in ref:
+        return None, ref.split(":", 1)[1]
+    if "/" in ref:
+        return ref, None
+    return None, ref
+
+
+async def create_prediction(ref: str, model_input: dict, wait: int | None = None, **params):
+    """Create a prediction without blocking the event loop.
+
+    With wait=N the API holds the request open for up to N seconds (max 60) and
+    returns the prediction in whatever state it reached; without it the
+    prediction is returned immediately in the "starting" state. When
+    settings.webhook_url is set, Replicate also posts progress to it.
+    """
+    client = get_client()
+    if wait:
+        params["wait"] = min(int(wait), 60)
+    if settings.webhook_url:
+        params.setdefault("webhook", settings.webhook_url)
+        params.setdefault("webhook_events_filter", WEBHOOK_EVENTS)
+    model, version = _split_ref(ref)
+    if model:
+        return await client.models.predictions.async_create(
+            model=model, input=model_input, **params
+        )
+    return await client.predictions.async_create(
+        version=version, input=model_input, **params
+    )
+
+
+async def get_prediction(prediction_id: str, timeout: float = 30.0):
+    """Fetch the current state of a prediction."""
+    return await asyncio.wait_for(
+        get_client().predictions.async_get(prediction_id), timeout=timeout
+    )
+
+
+async def list_predictions():
+    """Return the first page of the account's recent predictions."""
+    page = await get_client().predictions.async_list()
+    return page.results
+
+
+async def wait_for_prediction(prediction, kind: str = "image"):
+    """Wait for a prediction to reach a terminal status via the shared poller."""
+    from cogs.poller import poller
+    return await poller.wait(prediction, kind)
+
+
+async def run_prediction(ref: str, model_input: dict, wait: int | None = None, label: str = ""):
+    """Run a prediction to completion: wait synchronously, then fall back to polling.
+
+    The create call blocks (asynchronously) for up to `wait` seconds, which is
+    enough for most image models to finish in a single round trip. Anything
+    still running after that is polled until it finishes.
+    """
+    if wait is None:
+        wait = settings.replicate_sync_wait
+    model = ref.split(":", 1)[0]
+    with metrics.stage("create", model):
+        prediction = await create_prediction(ref, model_input, wait=wait)
+    if prediction.status not in TERMINAL_STATUSES:
+        print(f"[{label or ref}] still {prediction.status} after {wait}s, polling...")
+        with metrics.stage("run", model):
+            prediction = await wait_for_prediction(prediction)
+    metrics.record_prediction(prediction, model)
+    await ledger.record_prediction(prediction, model, model_input)
+    return prediction
@@ -0,0 +1,100 @@
+"""Coalesced, rate-limited status message rendering.
+
+Commands report progress with renderer.update(), which only records the
+latest desired text for the message. A per-channel worker applies it no more
+often than settings.status_edit_interval, so intermediate states are dropped
+instead of queueing up behind Discord's per-channel edit rate limit. Results
+and errors go through renderer.final() (or renderer.delete()), which skip the
+queue, discard any pending progress, and ignore later progress updates for
+that message.
+"""
+
+import asyncio
+import collections
+import time
+
+import discord
+
+from config.settings import settings
+
+# Remember this many finished messages so late progress updates are ignored
+MAX_CLOSED = 1000
+
+
+class ProgressRenderer:
+    def __init__(self):
+        # message id -> (message, latest desired text), in arrival order
+        self._pending: dict[int, tuple[discord.Message, str]] = {}
+        self._shown: dict[int, str] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._closed: collections.OrderedDict[int, None] = collections.OrderedDict()
+        self._next_edit: dict[int, float] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+
+    def update(self, message: discord.Message, content: str):
+        """Set the progress text for a status message; applied at the channel's cadence."""
+        if message.id in self._closed:
+            return
+        self._pending[message.id] = (message, content)
+        channel_id = message.channel.id
+        worker = self._workers.get(channel_id)
+        if worker is None or worker.done():
+            self._workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+
+    async def final(self, message: discord.Message, content: str):
+        """Edit a status message to its final text immediately."""
+        self._close(message.id)
+        await self._edit(message, content)
+        self._forget(message.id)
+
+    async def delete(self, message: discord.Message):
+        """Delete a status message, dropping any pending progress for it."""
+        self._close(message.id)
+        async with self._lock(message.id):
+            try:
+                await message.delete()
+            except discord.HTTPException as e:
+                print(f"[progress] delete failed: {e}")
+        self._forget(message.id)
+
+    def _close(self, message_id: int):
+        self._pending.pop(message_id, None)
+        self._closed[message_id] = None
+        while len(self._closed) > MAX_CLOSED:
+            self._closed.popitem(last=False)
+
+    def _forget(self, message_id: int):
+        self._shown.pop(message_id, None)
+        self._locks.pop(message_id, None)
+
+    def _lock(self, message_id: int) -> asyncio.Lock:
+        return self._locks.setdefault(message_id, asyncio.Lock())
+
+    async def _drain(self, channel_id: int):
+        while True:
+            delay = self._next_edit.get(channel_id, 0.0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            entry = next(
+                (mid for mid, (m, _) in self._pending.items() if m.channel.id == channel_id),
+                None,
+            )
+            if entry is None:
+                break
+            message, content = self._pending.pop(entry)
+            await self._edit(message, content)
+        self._workers.pop(channel_id, None)
+
+    async def _edit(self, message: discord.Message, content: str):
+        async with self._lock(message.id):
+            if self._shown.get(message.id) == content:
+                return
+            self._next_edit[message.channel.id] = time.monotonic() + settings.status_edit_interval
+            try:
+                await message.edit(content=content)
+                self._shown[message.id] = content
+            except discord.HTTPException as e:
+                print(f"[progress] edit failed: {e}")
+
+
+renderer = ProgressRenderer()
@@ -0,0 +1,570 @@
+"""Declarative registry of the bot's commands.
+
+Each ModelCommand declares a command's model, input template, where attached
+images go, price and help text. The image and video cogs build each of their
+commands from its entry, checking at load that none is missing, and /help_bot
+and /cost build their embeds from the same list. Commands that need custom
+code (/blip, /continue, /gimme, ...) are listed as HelpEntry so they still
+appear in those embeds, in the same order. /continue generates its clips from
+the /lpvid entry.
+
+A command may name a fallback command. When the primary's recent latency
+(queue wait plus run time, as observed for the last few jobs or by a job still
+waiting) exceeds its SLO, new requests are routed to the fallback until the
+slow samples age out of settings.latency_window.
+"""
+
+import collections
+import contextlib
+import re
+import statistics
+import time
+from dataclasses import dataclass, field
+
+from discord.ext import commands
+
+from config.settings import settings
+
+
+@dataclass(frozen=True, kw_only=True)
+class HelpEntry:
+    name: str
+    usage: str = "<text>"
+    description: str
+    details: tuple[str, ...] = ()
+    example: str = ""
+    price: str = ""
+    section: str = "other"          # /help_bot embed it is listed in; see SECTIONS
+
+    def help_text(self) -> str:
+        """Text for this command's /help_bot field."""
+        lines = [self.description] + [f"• {d}" for d in self.details]
+        if self.example:
+            lines.append(f"• Example: {self.example}")
+        return "\n".join(lines)
+
+
+@dataclass(frozen=True, kw_only=True)
+class ModelCommand(HelpEntry):
+    kind: str                       # "image" or "video"
+    model: str
+    template: dict
+    # input field for attached images (all of them, or the first frame for video)
+    images: str | None = None
+    max_images: int = 0
+    # long side (px) attached images are downscaled to before staging; about what
+    # the model works at, so larger inputs only cost upload and decode time
+    max_input_side: int = 2048
+    # video only: input field for a second image used as the last frame
+    last_frame: str | None = None
+    requires_image: bool = False
+    # pass a lone image as a string instead of a one-element list
+    single_image: bool = False
+    # model and input overrides used when images are attached (None removes a key)
+    edit_model: str | None = None
+    with_images: dict = field(default_factory=dict)
+    # cheaper output_format values the model accepts; settings.image_format is asked
+    # for when listed
+    output_formats: tuple[str, ...] = ()
+    filename: str = "generated_image.jpg"
+    status: str = "🎬 Generating video, this may take a few minutes..."
+    # input field the model takes a seed in; `--seed N` in the prompt sets it.
+    # Only seeded runs are deterministic, so only they use the result cache.
+    seed_input: str | None = None
+    fallback: str | None = None
+    slo: float | None = None        # seconds of queue + run time before falling back
+
+    def __post_init__(self):
+        object.__setattr__(self, "section", self.kind)
+
+    def build_input(self, text: str, images: list[str]) -> tuple[str, dict]:
+        """Return (model, model_input) for a prompt and its staged image inputs."""
+        model = self.model
+        seed = None
+        if self.seed_input:
+            text, seed = split_seed(text)
+        model_input = {"prompt": text, **self.template}
+        if seed is not None:
+            model_input[self.seed_input] = seed
+        if settings.image_format in self.output_formats:
+            model_input["output_format"] = settings.image_format
+        if images and self.last_frame:
+            model_input[self.images] = images[0]
+            if len(images) > 1:
+                model_input[self.last_frame] = images[1]
+        elif images:
+            model = self.edit_model or model
+            single = self.single_image and len(images) == 1
+            model_input[self.images] = images[0] if single else images
+            for key, value in self.with_images.items():
+                if value is None:
+                    model_input.pop(key, None)
+                else:
+                    model_input[key] = value
+        return model, model_input
+
+    def cacheable(self, model_input: dict) -> bool:
+        """Whether model_input pins a seed, so its output may come from the result cache."""
+        return self.seed_input is not None and model_input.get(self.seed_input, -1) >= 0
+
+    def docstring(self) -> str:
+        lines = [self.description, "", f"Usage: /{self.name} {self.usage}"]
+        return "\n".join(lines + list(self.details))
+
+
+_P_VIDEO = {
+    "duration": 8,
+    "resolution": "720p",
+    "aspect_ratio": "16:9",
+    "fps": 24,
+    "disable_safety_filter": True,
+    "prompt_upsampling": True,
+}
+
+_FRAMES = "Attach 1 image for first frame, 2 for first+last"
+_SEED = "Add `--seed N` for a repeatable result"
+
+_SEED_RE = re.compile(r"(?:^|\s)--seed[ =](\d+)(?=\s|$)")
+
+
+def split_seed(text: str) -> tuple[str, int | None]:
+    """Split a `--seed N` option off a prompt. Returns (prompt, seed or None)."""
+    match = _SEED_RE.search(text)
+    if match is None:
+        return text, None
+    return (text[:match.start()] + text[match.end():]).strip(), int(match.group(1))
+
+COMMANDS: list[HelpEntry] = [
+    ModelCommand(
+        name="flux", kind="image", model="prunaai/flux-fast",
+        template={
+            "seed": -1,
+            "guidance": 8,
+            "image_size": 1024,
+            "speed_mode": "Lightly Juiced 🍊 (more consistent)",
+            "aspect_ratio": "1:1",
+            "output_format": "jpg",
+            "output_quality": 80,
+            "num_inference_steps": 28,
+        },
+        output_formats=("webp",),
+        seed_input="seed",
+        description="Generate an image using Flux Fast",
+        details=(_SEED,),
+        example="`/flux a cat wearing sunglasses`",
+        price="~$0.005  — prunaai/flux-fast (200 runs/$1)",
+    ),
+    ModelCommand(
+        name="flux2", kind="image", model="black-forest-labs/flux-2-klein-9b",
+        template={
+            "aspect_ratio": "16:9",
+            "output_format": "jpg",
+            "output_quality": 95,
+            "output_megapixels": "1",
+            "disable_safety_checker": True,
+        },
+        images="images", max_images=5,
+        max_input_side=1440,
+        with_images={"aspect_ratio": "match_input_image"},
+        output_formats=("webp",),
+        description="Generate an image using FLUX.2 Klein 9B",
+        details=("Attach 1-5 images or reply with images for image-to-image",),
+        example="`/flux2 a lighthouse at dusk`",
+        price=(
+            "$0.002/input MP + $0.015/output MP  — black-forest-labs/flux-2-klein-9b\n"
+            "Text-to-image (1MP out): ~$0.015 | Image-to-image: +$0.002/input MP per image (up to 5)"
+        ),
+    ),
+    ModelCommand(
+        name="grok", kind="image", model="xai/grok-imagine-image",
+        template={"aspect_ratio": "16:9", "resolution": "2k"},
+        images="image", max_images=3, single_image=True,
+        with_images={"aspect_ratio": "auto"},
+        description="Generate or edit images using xAI Grok Imagine (2k, 16:9)",
+        details=(
+            "No attachment: text-to-image",
+            "Attach 1-3 images or reply with an image: edit mode",
+        ),
+        example="`/grok a futuristic city at night`",
+        price="~$0.02  — xai/grok-imagine-image (2k, 16:9)",
+    ),
+    ModelCommand(
+        name="lbgrok", kind="image", model="xai/grok-imagine-image-quality",
+        template={"aspect_ratio": "16:9", "resolution": "1k"},
+        images="image", max_images=3, single_image=True,
+        max_input_side=1024,
+        with_images={"aspect_ratio": "auto"},
+        description="Generate or edit images using xAI Grok Imagine Quality (1k, 16:9)",
+        details=(
+            "No attachment: text-to-image",
+            "Attach 1-3 images or reply with an image: edit mode",
+        ),
+        example="`/lbgrok a futuristic city at night`",
+        price="~$0.05 text-to-image | +$0.01 per input image  — xai/grok-imagine-image-quality (1k)",
+    ),
+    ModelCommand(
+        name="nana", kind="image", model="google/nano-banana-2-lite",
+        template={"aspect_ratio": "16:9", "output_format": "jpg"},
+        images="image_input", max_images=14,
+        max_input_side=1440,
+        description="Generate an image using Nano Banana 2 Lite",
+        details=("Attach up to 14 images or reply with images for reference",),
+        example="`/nana a tropical sunset`",
+        price="~$0.034/image  — google/nano-banana-2-lite",
+    ),
+    ModelCommand(
+        name="bnana", kind="image", model="google/nano-banana-2",
+        template={
+            "aspect_ratio": "16:9",
+            "resolution": "1K",
+            "output_format": "jpg",
+            "google_search": True,
+            "image_search": True,
+        },
+        images="image_input", max_images=14,
+        fallback="nana", slo=90,
+        description="Generate an image using Nano Banana 2 (full quality, Google/image search grounding on)",
+        details=(
+            "Attach up to 14 images or reply with images for reference",
+            "Falls back to /nana while Nano Banana 2 is slow",
+        ),
+        example="`/bnana a tropical sunset`",
+        price="$0.067 (1K) | $0.101 (2K) | $0.151 (4K) per image  — google/nano-banana-2",
+    ),
+    ModelCommand(
+        name="zimg", kind="image", model="prunaai/z-image-turbo",
+        template={
+            "width": 1920,
+            "height": 1088,
+            "guidance_scale": 0,
+            "num_inference_steps": 8,
+            "output_format": "jpg",
+            "output_quality": 80,
+        },
+        output_formats=("webp",),
+        seed_input="seed",
+        description="Generate an image using Z-Image Turbo (1920x1080)",
+        details=(_SEED,),
+        example="`/zimg a mountain landscape`",
+        price="~$0.02  — prunaai/z-image-turbo (1920×1088, ~2MP output)",
+    ),
+    ModelCommand(
+        name="pimg", kind="image", model="prunaai/p-image",
+        template={
+            "aspect_ratio": "custom",
+            "width": 1440,
+            "height": 810,
+            "disable_safety_checker": True,
+        },
+        images="images", max_images=5, edit_model="prunaai/p-image-edit",
+        max_input_side=1440,
+        with_images={"aspect_ratio": "16:9", "width": None, "height": None},
+        description="Generate or edit images using P-Image",
+        details=(
+            "No attachment: text-to-image",
+            "Attach 1-5 images or reply with an image: edit mode",
+        ),
+        example="`/pimg a cat wearing sunglasses` or `/pimg make the sky purple`",
+        price="~$0.005 text-to-image (prunaai/p-image) | ~$0.01 with images (prunaai/p-image-edit)",
+    ),
+    ModelCommand(
+        name="qwen", kind="image", model="qwen/qwen-image",
+        template={
+            "aspect_ratio": "16:9",
+            "output_format": "jpg",
+            "disable_safety_checker": True,
+        },
+        images="image", max_images=3, edit_model="qwen/qwen-image-edit-plus",
+        max_input_side=1440,
+        with_images={"aspect_ratio": "match_input_image"},
+        output_formats=("webp",),
+        seed_input="seed",
+        description="Generate or edit images using Qwen Image",
+        details=(
+            "No attachment: text-to-image",
+            "Attach 1-3 images or reply with an image: edit mode",
+            _SEED,
+        ),
+        example="`/qwen a futuristic city` or `/qwen remove the background`",
+        price="~$0.025 text-to-image (qwen/qwen-image) | ~$0.03 with images (qwen/qwen-image-edit-plus)",
+    ),
+    ModelCommand(
+        name="krea", kind="image", model="krea/krea-2-medium",
+        template={"aspect_ratio": "16:9", "creativity": "raw"},
+        images="style_reference_images", max_images=10,
+        max_input_side=1024,
+        description="Generate an image using Krea 2 Medium (16:9)",
+        details=("Attach up to 10 images or reply with images to use as style references",),
+        example="`/krea a knight in a painterly anime style`",
+        price="$0.03/image text-to-image | $0.035 with style references  — krea/krea-2-medium",
+    ),
+    ModelCommand(
+        name="ideo", kind="image", model="ideogram-ai/ideogram-v4-turbo",
+        template={"resolution": "2560x1440", "enable_copyright_detection": False},
+        description="Generate an image using Ideogram v4 Turbo (2560x1440, 16:9)",
+        example="`/ideo a surreal landscape with floating islands`",
+        price="$0.03/image  — ideogram-ai/ideogram-v4-turbo (2560x1440)",
+    ),
+    HelpEntry(
+        name="blip", usage="[question]", section="vision",
+        description="Caption or ask about an image (BLIP)",
+        details=("Attach or reply with an image",),
+        example="`/blip` or `/blip what color is the car?`",
+        price="~$0.00022  — salesforce/blip",
+    ),
+    HelpEntry(
+        name="caption", usage="[question]", section="vision",
+        description="Caption or ask about an image (Moondream2)",
+        details=("Attach or reply with an image",),
+        example="`/caption what is in this photo?`",
+        price="~$0.0017  — lucataco/moondream2",
+    ),
+    ModelCommand(
+        name="seed", kind="video", model="bytedance/seedance-1-pro-fast",
+        template={
+            "duration": 5,
+            "resolution": "480p",
+            "aspect_ratio": "16:9",
+            "fps": 24,
+        },
+        images="image", last_frame="last_frame_image",
+        max_input_side=854,
+        seed_input="seed",
+        description="Generate a 5s video using Seedance 1 Pro Fast (480p)",
+        details=(_FRAMES, _SEED),
+        example="`/seed a dog running on the beach`",
+        price="~$0.075/run  — bytedance/seedance-1-pro-fast (5s @ 480p, $0.015/s)",
+    ),
+    ModelCommand(
+        name="pvid", kind="video", model="prunaai/p-video",
+        template=_P_VIDEO,
+        images="image", last_frame="last_frame_image",
+        max_input_side=1280,
+        fallback="lpvid", slo=300,
+        description="Generate a video using P-Video (720p)",
+        details=(_FRAMES, "Falls back to draft mode (/lpvid) while P-Video is slow"),
+        example="`/pvid waves crashing on rocks`",
+        price="~$0.16/run  — prunaai/p-video (8s @ 720p, $0.02/s)",
+    ),
+    ModelCommand(
+        name="lpvid", kind="video", model="prunaai/p-video",
+        template={**_P_VIDEO, "draft": True},
+        images="image", last_frame="last_frame_image",
+        max_input_side=1280,
+        status="Generating video in draft mode, this may take a few minutes...",
+        description="Like /pvid but in draft mode (faster, lower quality)",
+        details=(_FRAMES,),
+        example="`/lpvid waves crashing on rocks`",
+        price="~$0.04/run  — prunaai/p-video draft mode (8s @ 720p, $0.005/s)",
+    ),
+    ModelCommand(
+        name="zpvid", kind="video", model="prunaai/p-video",
+        template={**_P_VIDEO, "prompt_upsampling": False},
+        images="image", last_frame="last_frame_image",
+        max_input_side=1280,
+        description="Like /pvid but with prompt_upsampling disabled (raw prompt)",
+        details=(_FRAMES,),
+        example="`/zpvid waves crashing on rocks`",
+        price="~$0.16/run  — prunaai/p-video (8s @ 720p, $0.02/s)",
+    ),
+    ModelCommand(
+        name="wan", kind="video", model="wan-video/wan-2.2-i2v-fast",
+        template={
+            "resolution": "480p",
+            "num_frames": 81,
+            "frames_per_second": 16,
+            "disable_safety_checker": True,
+        },
+        images="image", last_frame="last_image", requires_image=True,
+        max_input_side=854,
+        seed_input="seed",
+        description="Generate a video using Wan 2.2 I2V Fast (480p, ~5s)",
+        details=("Image required: attach 1 for first frame, 2 for first+last", _SEED),
+        example="`/wan the cat leaps off the table`",
+        price="$0.05/video @ 480p  — wan-video/wan-2.2-i2v-fast (81 frames @ 16fps ≈ 5s)",
+    ),
+    ModelCommand(
+        name="ltx", kind="video", model="lightricks/ltx-2.5-fast",
+        template={
+            "duration": 6,
+            "resolution": "720p",
+            "aspect_ratio": "16:9",
+            "fps": 25,
+            "generate_audio": True,
+        },
+        images="image", last_frame="last_frame_image",
+        max_input_side=1280,
+        description="Generate a video using LTX 2.5 Fast (6s @ 720p, with audio)",
+        details=(
+            "No attachment: text-to-video",
+            "Attach 1 image for first frame, 2 to interpolate first→last",
+        ),
+        example="`/ltx a neon city street in the rain`",
+        price="~$0.18/run  — lightricks/ltx-2.5-fast (6s @ 720p, $0.03/s)",
+    ),
+    HelpEntry(
+        name="continue", usage="[text]", section="video",
+        description="Continue a video and stitch it into one continuous stream (draft mode, same as /lpvid)",
+        details=(
+            "Reply to a bot video with `/continue` (reuses original prompt)",
+            "Or `/continue new prompt` to steer the continuation",
+        ),
+        price="~$0.04/run  — prunaai/p-video draft mode (8s @ 720p, $0.005/s)",
+    ),
+    HelpEntry(
+        name="mmaudio", usage="[text]", section="video",
+        description="Generate audio using MMAudio",
+        details=("Attach/reply with a video for video-to-audio",),
+        example="`/mmaudio wind blowing through trees`",
+        price="~$0.0053  — zsxkib/mmaudio",
+    ),
+    HelpEntry(
+        name="gimme", usage="[n]",
+        description="Re-post the Nth most recent output in this server",
+        example="`/gimme` (latest) or `/gimme 2` (3rd latest)",
+    ),
+    HelpEntry(
+        name="find", usage="<words>",
+        description="Search the prompts of past outputs in this server",
+        example="`/find cat sunglasses`",
+    ),
+    HelpEntry(
+        name="log", usage="[n]",
+        description="Show the last N lines of the bot's systemd logs (default 50)",
+        example="`/log 100`",
+    ),
+    HelpEntry(name="help_bot", usage="", description="Show this help message"),
+    HelpEntry(name="cost", usage="", description="Show approximate cost per run for each command"),
+]
+
+BY_NAME: dict[str, HelpEntry] = {c.name: c for c in COMMANDS}
+
+# /help_bot sends one embed per section, in this order
+SECTIONS = {
+    "image": "🖼️ Image commands",
+    "vision": "👁️ Vision commands",
+    "video": "🎬 Video commands",
+    "other": "⚙️ Other commands",
+}
+
+# Discord rejects an embed with more fields, or a message whose embeds hold more text
+MAX_EMBED_FIELDS = 25
+MAX_EMBEDS_CHARS = 6000
+
+
+def sections() -> list[tuple[str, list[HelpEntry]]]:
+    """Return (title, entries) for each /help_bot section, in COMMANDS order."""
+    return [
+        (title, [entry for entry in COMMANDS if entry.section == key])
+        for key, title in SECTIONS.items()
+    ]
+
+
+def _check_embed_limits():
+    unknown = [entry.name for entry in COMMANDS if entry.section not in SECTIONS]
+    if unknown:
+        raise ValueError(f"unknown help section for: {', '.join(unknown)}")
+    chars = 0
+    for title, entries in sections():
+        if len(entries) > MAX_EMBED_FIELDS:
+            raise ValueError(
+                f"{title!r} has {len(entries)} commands; an embed holds at most "
+                f"{MAX_EMBED_FIELDS} fields, split the section"
+            )
+        chars += len(title) + sum(
+            len(f"/{entry.name} {entry.usage}".rstrip()) + len(entry.help_text())
+            for entry in entries
+        )
+    if chars > MAX_EMBEDS_CHARS:
+        raise ValueError(f"/help_bot text is {chars} chars; Discord allows {MAX_EMBEDS_CHARS}")
+    priced = [entry for entry in COMMANDS if entry.price]
+    if len(priced) > MAX_EMBED_FIELDS:
+        raise ValueError(
+            f"/cost lists {len(priced)} commands; an embed holds at most {MAX_EMBED_FIELDS} fields"
+        )
+
+
+_check_embed_limits()
+
+
+class LatencyTracker:
+    """Recent queue + run latency per command, from finished and still-waiting jobs."""
+
+    def __init__(self, samples: int = 20):
+        self._samples: dict[str, collections.deque] = collections.defaultdict(
+            lambda: collections.deque(maxlen=samples)
+        )
+        self._active: dict[str, dict[object, float]] = collections.defaultdict(dict)
+
+    @contextlib.contextmanager
+    def measure(self, name: str):
+        """Time the block (queue wait and prediction) as one sample for `name`."""
+        token = object()
+        start = time.monotonic()
+        self._active[name][token] = start
+        try:
+            yield
+        finally:
+            del self._active[name][token]
+        self._samples[name].append((time.monotonic(), time.monotonic() - start))
+
+    def estimate(self, name: str) -> float | None:
+        """Return the current latency estimate in seconds, or None without enough data.
+
+        This is the median of recent samples, raised to the age of the oldest
+        job still in progress so a building queue is noticed before it drains.
+        """
+        now = time.monotonic()
+        recent = [
+            seconds for finished, seconds in self._samples[name]
+            if now - finished <= settings.latency_window
+        ]
+        candidates = []
+        if len(recent) >= settings.latency_min_samples:
+            candidates.append(statistics.median(recent))
+        active = self._active[name].values()
+        if active:
+            candidates.append(now - min(active))
+        return max(candidates) if candidates else None
+
+
+latency = LatencyTracker()
+
+
+def route(command: ModelCommand) -> ModelCommand:
+    """Return the command to dispatch: the fallback while the primary is over its SLO."""
+    slo = settings.latency_slos.get(command.name, command.slo)
+    if not settings.latency_routing or command.fallback is None or slo is None:
+        return command
+    estimate = latency.estimate(command.name)
+    if estimate is None or estimate <= slo:
+        return command
+    print(f"[registry] /{command.name} at ~{estimate:.0f}s (SLO {slo:.0f}s), routing to /{command.fallback}")
+    return BY_NAME[command.fallback]
+
+
+def model_command(name: str, handler) -> commands.Command:
+    """Build the command for registry entry `name`, to assign in a cog's class body.
+
+    handler(ctx, command, text) does the work; it receives the registry entry.
+    """
+    entry = BY_NAME[name]
+    if not isinstance(entry, ModelCommand):
+        raise TypeError(f"/{name} is not a model command")
+
+    async def callback(self, ctx: commands.Context, *, text: str):
+        await handler(ctx, entry, text)
+
+    callback.__doc__ = entry.docstring()
+    return commands.command(name=entry.name)(callback)
+
+
+def check_commands(cog: commands.Cog, kind: str):
+    """Raise if `cog` is missing a command for a registry entry of `kind`."""
+    have = {c.name for c in cog.get_commands()}
+    missing = [
+        entry.name for entry in COMMANDS
+        if isinstance(entry, ModelCommand) and entry.kind == kind and entry.name not in have
+    ]
+    if missing:
+        raise RuntimeError(f"{type(cog).__name__} has no command for: {', '.join(missing)}")
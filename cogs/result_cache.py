@@ -0,0 +1,130 @@
+"""Optional on-disk cache of model outputs for deterministic invocations.
+
+Entries are keyed by model plus the model_input in cogs.canonical form (keys
+sorted, input media identified by content). Output bytes live under
+settings.result_cache_dir with a JSON sidecar; the directory is kept under
+settings.result_cache_max_bytes by evicting least recently used entries, and
+anything older than settings.result_cache_ttl is treated as a miss.
+
+Disabled unless RESULT_CACHE=1. Registry commands only use the cache for
+runs with a pinned seed (`--seed N`), the only ones whose output is fixed by
+model_input, and RESULT_CACHE_EXCLUDE lists models that never use the cache.
+"""
+
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import time
+
+from cogs import spool
+from cogs.canonical import canonicalize
+from cogs.spool import MediaBuffer
+from config.settings import settings
+
+
+def cache_key(model: str, model_input: dict) -> str | None:
+    """Return the cache key for an invocation, or None if caching does not apply."""
+    if not settings.result_cache or model in settings.result_cache_exclude:
+        return None
+    canonical = json.dumps(
+        {"model": model, "input": canonicalize(model_input)},
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _paths(key: str) -> tuple[str, str]:
+    base = os.path.join(settings.result_cache_dir, key)
+    return base + ".bin", base + ".json"
+
+
+def _get(key: str) -> tuple[str, dict] | None:
+    """Copy a live entry into the spool. Returns (copy's path, metadata)."""
+    data_path, meta_path = _paths(key)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if time.time() - meta["created"] > settings.result_cache_ttl:
+            _remove(key)
+            return None
+        # a copy, so eviction can't pull the file from under an upload or encode
+        ext = mimetypes.guess_extension((meta.get("content_type") or "").split(";")[0].strip())
+        copy = spool.temp_path(ext or ".bin")
+        shutil.copyfile(data_path, copy)
+    except (OSError, ValueError, KeyError):
+        return None
+    now = time.time()
+    os.utime(data_path, (now, now))
+    return copy, meta
+
+
+def _remove(key: str):
+    for path in _paths(key):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _evict():
+    entries = []
+    total = 0
+    with os.scandir(settings.result_cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.name[:-4]))
+                total += stat.st_size
+    entries.sort()
+    for _, size, key in entries:
+        if total <= settings.result_cache_max_bytes:
+            break
+        _remove(key)
+        total -= size
+
+
+def _put(key: str, data: bytes | str, meta: dict):
+    """Store bytes, or copy the file at path `data`, under key."""
+    os.makedirs(settings.result_cache_dir, exist_ok=True)
+    data_path, meta_path = _paths(key)
+    tmp = data_path + ".tmp"
+    if isinstance(data, str):
+        shutil.copyfile(data, tmp)
+    else:
+        with open(tmp, "wb") as f:
+            f.write(data)
+    size = os.path.getsize(tmp)
+    os.replace(tmp, data_path)
+    with open(meta_path, "w") as f:
+        json.dump({**meta, "created": time.time(), "size": size}, f)
+    _evict()
+
+
+async def get(key: str | None) -> tuple[MediaBuffer, dict] | None:
+    """Return (output, metadata) for a cached result, or None on a miss.
+
+    The output is a spooled copy, so large (video) hits are never read into memory.
+    """
+    if key is None:
+        return None
+    hit = await asyncio.to_thread(_get, key)
+    if hit is None:
+        return None
+    print(f"[result_cache] hit {key[:12]}")
+    path, meta = hit
+    return MediaBuffer.from_file(path, os.path.splitext(path)[1]), meta
+
+
+async def put(key: str | None, data: bytes | MediaBuffer, **meta):
+    """Store output bytes for a key; metadata (e.g. the source url) is kept alongside."""
+    if key is None:
+        return
+    if isinstance(data, MediaBuffer):
+        data = await data.path() if data.on_disk else await data.read()
+    try:
+        await asyncio.to_thread(_put, key, data, meta)
+    except OSError as e:
+        print(f"[result_cache] store failed: {e}")
@@ -0,0 +1,170 @@
+"""Fair job scheduler between the cogs and Replicate/ffmpeg.
+
+Every model call and ffmpeg encode runs inside `scheduler.slot(...)`. A slot is
+granted when:
+
+- the resource (model slug, or "ffmpeg") is below its concurrency limit, and
+- the user has fewer than settings.user_concurrency jobs running in that lane.
+
+Lanes ("image", "video", "audio", "ffmpeg") are counted separately, so quick
+image requests never wait behind someone's long video jobs. When several jobs
+are eligible, the one from the guild and then the user with the fewest running
+jobs goes first. Ties go to the guild, and then the user, that was served least
+recently, so grants round-robin across guilds and users rather than across
+jobs: someone who queues ten jobs gets every other slot, not the next ten.
+Jobs from the same user go oldest first. Queued jobs see their position in
+their status message.
+"""
+
+import asyncio
+import collections
+import contextlib
+import itertools
+import time
+
+import discord
+from discord.ext import commands
+
+from cogs import metrics
+from cogs.progress import renderer
+from config.settings import settings
+
+
+class _Waiter:
+    def __init__(self, seq: int, resource: str, lane: str, user_id: int, guild_id: int):
+        self.seq = seq
+        self.resource = resource
+        self.lane = lane
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.position = 0
+        self.status_msg: discord.Message | None = None
+
+
+class JobScheduler:
+    def __init__(self):
+        self._queues: dict[str, list[_Waiter]] = collections.defaultdict(list)
+        self._running: collections.Counter[str] = collections.Counter()
+        self._user_running: collections.Counter[tuple[int, str]] = collections.Counter()
+        self._guild_running: collections.Counter[int] = collections.Counter()
+        # grant number each guild / (user, lane) was last granted a slot at; -1 if never
+        self._guild_served: dict[int, int] = {}
+        self._user_served: dict[tuple[int, str], int] = {}
+        self._seq = itertools.count()
+        self._grants = itertools.count()
+
+    @staticmethod
+    def _limit(resource: str) -> int:
+        if resource == "ffmpeg":
+            default = settings.ffmpeg_concurrency
+        else:
+            default = settings.model_concurrency
+        return settings.model_limits.get(resource, default)
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        resource: str,
+        ctx: commands.Context,
+        lane: str,
+        status_msg: discord.Message | None = None,
+    ):
+        """Hold a concurrency slot for `resource` while the block runs.
+
+        If the job has to queue, its position is shown in status_msg, or in a
+        temporary reply when the command has no status message of its own.
+        """
+        waiter = _Waiter(
+            next(self._seq), resource, lane, ctx.author.id,
+            ctx.guild.id if ctx.guild else 0,
+        )
+        self._queues[resource].append(waiter)
+        self._dispatch()
+        queued_at = time.perf_counter()
+        owned_msg = None
+        try:
+            if not waiter.future.done():
+                text = f"⏳ Queued (position {waiter.position})"
+                if status_msg is None:
+                    owned_msg = await ctx.reply(text)
+                    waiter.status_msg = owned_msg
+                else:
+                    waiter.status_msg = status_msg
+                    renderer.update(status_msg, text)
+                await waiter.future
+                if status_msg is not None:
+                    renderer.update(status_msg, "⏳ Starting...")
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(waiter)
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            if owned_msg is not None:
+                await renderer.delete(owned_msg)
+        metrics.observe("queue", time.perf_counter() - queued_at, resource)
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues[waiter.resource]
+        if waiter in queue:
+            queue.remove(waiter)
+        self._dispatch()
+
+    def _release(self, waiter: _Waiter):
+        self._running[waiter.resource] -= 1
+        self._user_running[(waiter.user_id, waiter.lane)] -= 1
+        self._guild_running[waiter.guild_id] -= 1
+        self._dispatch()
+
+    def _fair_key(self, waiter: _Waiter):
+        user = (waiter.user_id, waiter.lane)
+        return (
+            self._guild_running[waiter.guild_id],
+            self._guild_served.get(waiter.guild_id, -1),
+            self._user_running[user],
+            self._user_served.get(user, -1),
+            waiter.seq,
+        )
+
+    def _dispatch(self):
+        granted = True
+        while granted:
+            granted = False
+            for resource, queue in self._queues.items():
+                if not queue or self._running[resource] >= self._limit(resource):
+                    continue
+                eligible = [
+                    w for w in queue
+                    if self._user_running[(w.user_id, w.lane)] < settings.user_concurrency
+                ]
+                if not eligible:
+                    continue
+                waiter = min(eligible, key=self._fair_key)
+                queue.remove(waiter)
+                self._running[resource] += 1
+                self._user_running[(waiter.user_id, waiter.lane)] += 1
+                self._guild_running[waiter.guild_id] += 1
+                grant = next(self._grants)
+                self._guild_served[waiter.guild_id] = grant
+                self._user_served[(waiter.user_id, waiter.lane)] = grant
+                waiter.future.set_result(None)
+                granted = True
+        self._report_positions()
+
+    def _report_positions(self):
+        for queue in self._queues.values():
+            for position, waiter in enumerate(sorted(queue, key=self._fair_key), 1):
+                if waiter.position == position:
+                    continue
+                waiter.position = position
+                if waiter.status_msg is not None:
+                    renderer.update(waiter.status_msg, f"⏳ Queued (position {position})")
+
+
+scheduler = JobScheduler()
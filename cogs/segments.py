@@ -0,0 +1,88 @@
+"""On-disk store of normalized /continue segments, per continuation chain.
+
+Every clip in a /continue chain is normalized once (1280x720 @ 24fps, H.264 +
+stereo AAC with audio padded to the video length) and kept under
+settings.segment_dir. Each posted chain video gets a small manifest naming its
+segments, keyed by the Discord message id, so continuing it again only has to
+normalize the new clip and join everything by stream copy. Segments are shared
+between the manifests of a chain, so a chain of N continues stores N clips.
+
+Manifests older than settings.segment_ttl are dropped, along with segments no
+manifest references any more.
+"""
+
+import json
+import os
+import time
+import uuid
+
+from config.settings import settings
+
+
+def _manifest_path(message_id: int) -> str:
+    return os.path.join(settings.segment_dir, f"{message_id}.json")
+
+
+def new_segment_path() -> str:
+    """Return a fresh path in the store for a normalized segment."""
+    os.makedirs(settings.segment_dir, exist_ok=True)
+    return os.path.join(settings.segment_dir, f"{uuid.uuid4().hex}.mp4")
+
+
+def lookup(message_id: int) -> list[str] | None:
+    """Return the segment paths behind a posted chain video, or None if unknown."""
+    try:
+        with open(_manifest_path(message_id)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - manifest.get("created", 0) > settings.segment_ttl:
+        return None
+    paths = [os.path.join(settings.segment_dir, name) for name in manifest.get("segments", [])]
+    if not paths or not all(os.path.exists(p) for p in paths):
+        return None
+    return paths
+
+
+def save(message_id: int, paths: list[str]):
+    """Record the segments behind a posted chain video, then prune expired entries."""
+    os.makedirs(settings.segment_dir, exist_ok=True)
+    manifest = {"created": time.time(), "segments": [os.path.basename(p) for p in paths]}
+    with open(_manifest_path(message_id), "w") as f:
+        json.dump(manifest, f)
+    prune()
+
+
+def prune():
+    """Drop expired manifests and any segment no remaining manifest uses."""
+    now = time.time()
+    referenced = set()
+    segment_files = []
+    with os.scandir(settings.segment_dir) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.name.endswith(".mp4"):
+            segment_files.append(entry)
+            continue
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            with open(entry.path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        if now - manifest.get("created", 0) > settings.segment_ttl:
+            _unlink(entry.path)
+        else:
+            referenced.update(manifest.get("segments", []))
+    for entry in segment_files:
+        # leave fresh unreferenced segments alone: a /continue may still be using them
+        if entry.name not in referenced and now - entry.stat().st_mtime > 3600:
+            _unlink(entry.path)
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
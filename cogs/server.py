@@ -0,0 +1,32 @@
+"""Optional built-in HTTP server (Replicate webhooks, Prometheus metrics).
+
+Modules register their routes on `app` at import time; bot.py starts the
+server only when HTTP_PORT is set.
+"""
+
+from aiohttp import web
+
+from config.settings import settings
+
+app = web.Application()
+_runner: web.AppRunner | None = None
+
+
+async def start_server():
+    """Start serving `app` on settings.http_host:settings.http_port."""
+    global _runner
+    if _runner is not None:
+        return
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    site = web.TCPSite(_runner, settings.http_host, settings.http_port)
+    await site.start()
+    print(f"[server] listening on {settings.http_host}:{settings.http_port}")
+
+
+async def stop_server():
+    """Stop the server if it is running."""
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,54 @@
+"""Single-flight coalescing of identical in-flight requests.
+
+When several people run the exact same command on the same inputs within
+moments of each other, only the first one does the work (prediction, download,
+ffmpeg); the rest attach to its in-flight task and receive the same result,
+then each posts its own reply. Keys combine the command, the canonicalized
+inputs and the source message being replied to.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable
+
+from cogs.canonical import canonicalize
+
+_inflight: dict[str, asyncio.Task] = {}
+
+
+def flight_key(command: str, inputs, source_message_id: int | None = None) -> str:
+    """Build a single-flight key from a command name, its inputs and source message."""
+    canonical = json.dumps(
+        {"command": command, "inputs": canonicalize(inputs), "source": source_message_id},
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _finished(key: str):
+    def callback(task: asyncio.Task):
+        if _inflight.get(key) is task:
+            del _inflight[key]
+        if not task.cancelled():
+            # retrieved here in case every caller was cancelled
+            task.exception()
+    return callback
+
+
+async def run(key: str, work: Callable[[], Awaitable], on_join: Callable[[], None] | None = None):
+    """Run work() once per key; concurrent callers with the same key share its result.
+
+    The shared task is shielded, so one caller being cancelled never cancels
+    the work for the others. Exceptions propagate to every caller.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(work())
+        _inflight[key] = task
+        task.add_done_callback(_finished(key))
+    else:
+        print(f"[singleflight] joining in-flight {key[:12]}")
+        if on_join:
+            on_join()
+    return await asyncio.shield(task)
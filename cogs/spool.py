@@ -0,0 +1,203 @@
+"""Media buffers that spill to disk, under a global in-memory budget.
+
+A MediaBuffer holds one media file (a downloaded output, an attachment, an
+encoded stream). Small files stay in memory. A buffer spills to a file under
+settings.spool_dir once it grows past settings.spool_threshold, or once
+keeping it in memory would take the total held in memory by all buffers past
+settings.spool_memory_budget. A few large videos in flight therefore cost disk
+space, not RSS.
+
+A buffer can be handed on without copying:
+
+- to ffmpeg as a path (path(), spilling first if needed), or as a path or
+  stdin bytes (ffmpeg_input());
+- to Discord with file(), which streams from the spool file or wraps the
+  in-memory bytes.
+
+The spool file is deleted, and the buffer's share of the memory budget
+released, on close() or when the last reference to the buffer goes away. So a
+buffer shared between coalesced requests lives until every one of them is done
+with it.
+"""
+
+import asyncio
+import io
+import os
+import shutil
+import time
+import uuid
+import weakref
+
+import discord
+
+from config.settings import settings
+
+_in_memory = 0
+_swept = False
+
+
+class _Backing:
+    """What a buffer has to give back when it is released (kept apart for weakref.finalize)."""
+
+    def __init__(self):
+        self.reserved = 0
+        self.path: str | None = None
+
+
+def _release(backing: _Backing):
+    global _in_memory
+    _in_memory -= backing.reserved
+    backing.reserved = 0
+    if backing.path is not None:
+        try:
+            os.unlink(backing.path)
+        except OSError:
+            pass
+        backing.path = None
+
+
+def _reserve(backing: _Backing, size: int) -> bool:
+    """Count `size` more bytes against the memory budget, if they fit."""
+    global _in_memory
+    if (
+        backing.reserved + size > settings.spool_threshold
+        or _in_memory + size > settings.spool_memory_budget
+    ):
+        return False
+    backing.reserved += size
+    _in_memory += size
+    return True
+
+
+def _new_path(suffix: str) -> str:
+    global _swept
+    os.makedirs(settings.spool_dir, exist_ok=True)
+    if not _swept:
+        # files left behind by a previous run (crash, kill -9)
+        _swept = True
+        cutoff = time.time() - 3600
+        with os.scandir(settings.spool_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    try:
+                        os.unlink(entry.path)
+                    except OSError:
+                        pass
+    return os.path.join(settings.spool_dir, uuid.uuid4().hex + suffix)
+
+
+def _append(path: str, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+class MediaBuffer:
+    """One media file, in memory while small and spooled to disk otherwise."""
+
+    def __init__(self, suffix: str = ".bin"):
+        self.suffix = suffix
+        self.size = 0
+        self._chunks: list[bytes] = []
+        self._data: bytes | None = None
+        self._backing = _Backing()
+        self._finalizer = weakref.finalize(self, _release, self._backing)
+
+    @classmethod
+    async def from_bytes(cls, data: bytes, suffix: str = ".bin") -> "MediaBuffer":
+        """Wrap bytes already in memory (spilled if they don't fit the budget)."""
+        buf = cls(suffix)
+        await buf.write(data)
+        return buf
+
+    @classmethod
+    def from_file(cls, path: str, suffix: str = ".bin") -> "MediaBuffer":
+        """Take ownership of an existing file by moving it into the spool."""
+        buf = cls(suffix)
+        dst = _new_path(suffix)
+        try:
+            os.replace(path, dst)
+        except OSError:
+            # different filesystem
+            shutil.move(path, dst)
+        buf._backing.path = dst
+        buf.size = os.path.getsize(dst)
+        return buf
+
+    @property
+    def on_disk(self) -> bool:
+        return self._backing.path is not None
+
+    async def write(self, chunk: bytes):
+        """Append a chunk, spilling to disk when it no longer fits in memory."""
+        self.size += len(chunk)
+        if not self.on_disk and _reserve(self._backing, len(chunk)):
+            self._chunks.append(chunk)
+            return
+        if not self.on_disk:
+            await self._spill()
+        await asyncio.to_thread(_append, self._backing.path, chunk)
+
+    async def _spill(self):
+        global _in_memory
+        path = _new_path(self.suffix)
+        data = self._data if self._data is not None else b"".join(self._chunks)
+        await asyncio.to_thread(_append, path, data)
+        self._backing.path = path
+        self._chunks = []
+        self._data = None
+        _in_memory -= self._backing.reserved
+        self._backing.reserved = 0
+
+    def _bytes(self) -> bytes:
+        if self._data is None:
+            self._data = b"".join(self._chunks)
+            self._chunks = []
+        return self._data
+
+    async def path(self) -> str:
+        """Return a file path holding the contents, spilling to disk if needed."""
+        if not self.on_disk:
+            await self._spill()
+        return self._backing.path
+
+    def ffmpeg_input(self) -> tuple[str, bytes | None]:
+        """Return (ffmpeg -i argument, stdin bytes): the spool path, or "pipe:0" and the bytes."""
+        if self.on_disk:
+            return self._backing.path, None
+        return "pipe:0", self._bytes()
+
+    async def read(self) -> bytes:
+        """Return the contents as bytes (reads the spool file for spilled buffers)."""
+        if not self.on_disk:
+            return self._bytes()
+
+        def read_file():
+            with open(self._backing.path, "rb") as f:
+                return f.read()
+
+        return await asyncio.to_thread(read_file)
+
+    def file(self, filename: str) -> discord.File:
+        """Return a discord.File streaming the contents, without copying them."""
+        if self.on_disk:
+            return discord.File(self._backing.path, filename)
+        return discord.File(io.BytesIO(self._bytes()), filename)
+
+    def close(self):
+        """Delete the spool file and release the memory budget now."""
+        self._chunks = []
+        self._data = None
+        self._finalizer()
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def memory_in_use() -> int:
+    """Bytes currently held in memory by all buffers."""
+    return _in_memory
+
+
+def temp_path(suffix: str = ".mp4") -> str:
+    """Return a fresh path in the spool directory (for ffmpeg outputs)."""
+    return _new_path(suffix)
@@ -0,0 +1,113 @@
+"""Input staging: upload input media to Replicate file storage once, reuse the URL.
+
+Model inputs are uploaded through the files API and passed to predictions as a
+file URL instead of an inline base64 data URI (33% larger, and resent on every
+call). Uploaded URLs are cached in an LRU keyed by the SHA-256 of the bytes, so
+re-editing the same picture costs no upload at all. Entries are dropped before
+Replicate expires the underlying file.
+
+When staging is disabled, or an upload fails, inputs fall back to data URIs.
+"""
+
+import asyncio
+import base64
+import collections
+import datetime
+import hashlib
+import time
+from io import BytesIO
+
+from cogs.canonical import remember_staged
+from cogs.predictions import get_client
+from config.settings import settings
+
+# Treat a cached file as gone this many seconds before Replicate's expiry, so a
+# URL never expires between being handed out and the model fetching it.
+EXPIRY_MARGIN = 15 * 60
+
+# sha256 hex -> (url, expires_at epoch seconds or None)
+_cache: collections.OrderedDict[str, tuple[str, float | None]] = collections.OrderedDict()
+_pending: dict[str, asyncio.Task] = {}
+
+
+def to_data_uri(data: bytes, content_type: str) -> str:
+    """Encode bytes as a base64 data URI."""
+    b64 = base64.b64encode(data).decode("utf-8")
+    return f"data:{content_type};base64,{b64}"
+
+
+def _parse_expiry(expires_at: str | None) -> float | None:
+    if not expires_at:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(expires_at).timestamp()
+    except ValueError:
+        return None
+
+
+def _lookup(digest: str) -> str | None:
+    entry = _cache.get(digest)
+    if entry is None:
+        return None
+    url, expires = entry
+    if expires is not None and expires - time.time() < EXPIRY_MARGIN:
+        del _cache[digest]
+        return None
+    _cache.move_to_end(digest)
+    return url
+
+
+def _remember(digest: str, url: str, expires: float | None):
+    _cache[digest] = (url, expires)
+    _cache.move_to_end(digest)
+    now = time.time()
+    for key in [k for k, (_, exp) in _cache.items() if exp is not None and exp - now < EXPIRY_MARGIN]:
+        del _cache[key]
+    while len(_cache) > settings.stage_cache_size:
+        _cache.popitem(last=False)
+
+
+async def _upload(digest: str, data: bytes, content_type: str, filename: str) -> str:
+    file = await get_client().files.async_create(
+        BytesIO(data),
+        filename=filename,
+        content_type=content_type,
+        metadata={"sha256": digest},
+    )
+    url = file.urls["get"]
+    _remember(digest, url, _parse_expiry(file.expires_at))
+    remember_staged(url, digest)
+    print(f"[staging] uploaded {len(data)} bytes as {file.id}")
+    return url
+
+
+def _upload_done(digest: str):
+    def callback(task: asyncio.Task):
+        _pending.pop(digest, None)
+        if not task.cancelled():
+            # mark the exception retrieved; waiters have already fallen back
+            task.exception()
+    return callback
+
+
+async def stage_bytes(data: bytes, content_type: str, filename: str | None = None) -> str:
+    """Return a model-input URL for the given bytes, uploading them at most once."""
+    if not settings.stage_inputs:
+        return to_data_uri(data, content_type)
+    digest = hashlib.sha256(data).hexdigest()
+    url = _lookup(digest)
+    if url is not None:
+        return url
+    # Identical inputs staged concurrently share one upload
+    task = _pending.get(digest)
+    if task is None:
+        task = asyncio.create_task(
+            _upload(digest, data, content_type, filename or f"input-{digest[:12]}")
+        )
+        _pending[digest] = task
+        task.add_done_callback(_upload_done(digest))
+    try:
+        return await asyncio.shield(task)
+    except Exception as e:
+        print(f"[staging] upload failed, sending inline: {e}")
+        return to_data_uri(data, content_type)
@@ -1,18 +1,53 @@
 import asyncio
-import base64
+import mimetypes
+import os
+import time
+from urllib.parse import urlparse
 
 import discord
-import replicate
-import requests
 from discord.ext import commands
 from io import BytesIO
 
+from cogs import (
+    imaging, ledger, media_cache, messages, metrics, registry, result_cache, singleflight,
+)
+from cogs.downloads import DownloadTooLarge, download, download_spooled
+from cogs.fit import fit_to_limit, upload_limit
+from cogs.poller import poller
+from cogs.predictions import run_prediction
+from cogs.progress import renderer
+from cogs.scheduler import scheduler
+from cogs.spool import MediaBuffer
+from cogs.staging import stage_bytes
+from config.settings import settings
+
+# Largest model output downloaded; anything over the guild's upload limit is
+# fitted under it before posting (see cogs.fit)
+MAX_OUTPUT_BYTES = 200 * 1024 * 1024
+
+
+class GenerationError(Exception):
+    """A generation could not produce a postable result; the message is shown to the user."""
+
+
+def _lineage_source(entry, media_type: str) -> str | None:
+    """An output's Replicate URL from its lineage entry, if still valid and of media_type."""
+    if entry is None or not entry["source_url"]:
+        return None
+    if time.time() - entry["posted_at"] > settings.output_url_ttl:
+        return None
+    content_type = mimetypes.guess_type(entry["filename"] or "")[0] or ""
+    return entry["source_url"] if content_type.startswith(media_type) else None
+
 
 async def get_attachments(ctx: commands.Context, media_type: str = "image/") -> tuple[list, list]:
     """Get media attachments from the message or its reply, including embeds.
 
     Returns (attachments, embed_urls) where attachments are discord.Attachment
-    objects and embed_urls are URL strings from embeds.
+    objects and embed_urls are URL strings from embeds. A reply to one of the
+    bot's own outputs returns the original Replicate output URL instead of the
+    Discord attachment, while that URL is still valid; it comes from the
+    output's lineage entry, without looking the message up.
     """
     attachments = [
         a for a in ctx.message.attachments
@@ -20,7 +55,10 @@ async def get_attachments(ctx: commands.Context, media_type: str = "image/") ->
     ]
     embed_urls = []
     if not attachments and ctx.message.reference:
-        ref = await ctx.channel.fetch_message(ctx.message.reference.message_id)
+        source = _lineage_source(await ledger.lineage(ctx.message.reference.message_id), media_type)
+        if source:
+            return [], [source]
+        ref = await messages.resolve(ctx, ctx.message.reference)
         attachments = [
             a for a in ref.attachments
             if a.content_type and a.content_type.startswith(media_type)
@@ -41,30 +79,126 @@ async def get_attachments(ctx: commands.Context, media_type: str = "image/") ->
     return attachments, embed_urls
 
 
-async def attachment_to_data_uri(attachment: discord.Attachment) -> str:
-    """Convert a discord attachment to a base64 data URI."""
-    img_bytes = await attachment.read()
-    b64 = base64.b64encode(img_bytes).decode("utf-8")
-    return f"data:{attachment.content_type};base64,{b64}"
+def is_passthrough_url(url: str) -> bool:
+    """Return True if the model can fetch this URL itself (a known public host)."""
+    if not settings.url_passthrough:
+        return False
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme == "https" and any(
+        host == h or host.endswith("." + h) for h in settings.passthrough_hosts
+    )
+
+
+def _oversize(attachment: discord.Attachment, max_side: int | None) -> bool:
+    """Return True if an image attachment is larger than max_side (as Discord reports its size)."""
+    if not max_side or not settings.input_downscale or not attachment.width:
+        return False
+    return max(attachment.width, attachment.height or 0) > max_side
+
+
+async def _read_attachment(attachment: discord.Attachment) -> tuple[bytes, str | None]:
+    return await attachment.read(), attachment.content_type
 
 
-def url_to_data_uri(url: str, default_type: str = "image/jpeg", timeout: int = 30) -> str:
-    """Download a URL and convert to a base64 data URI."""
-    response = requests.get(url, timeout=timeout)
-    b64 = base64.b64encode(response.content).decode("utf-8")
-    ct = response.headers.get("Content-Type", default_type)
-    return f"data:{ct};base64,{b64}"
+async def attachment_to_input(attachment: discord.Attachment, max_side: int | None = None) -> str:
+    """Return a model input for a discord attachment.
+
+    An image larger than max_side is downscaled first (see cogs.imaging) and
+    staged. Otherwise the CDN URL is passed straight through when allowed, or
+    the bytes are read (through cogs.media_cache) and staged.
+    """
+    oversize = _oversize(attachment, max_side)
+    if not oversize and is_passthrough_url(attachment.url):
+        return attachment.url
+    content_type, filename = attachment.content_type, attachment.filename
+    cached = imaging.cached_input(attachment.id, max_side) if oversize else None
+    if cached is not None:
+        data, content_type = cached
+    else:
+        data, _ = await media_cache.get_bytes(
+            media_cache.attachment_key(attachment), lambda: _read_attachment(attachment)
+        )
+        if oversize:
+            with metrics.stage("resize"):
+                data, content_type = await imaging.prepare_input(
+                    data, content_type, max_side, key=attachment.id
+                )
+    if content_type != attachment.content_type:
+        filename = os.path.splitext(filename)[0] + (mimetypes.guess_extension(content_type) or "")
+    with metrics.stage("encode"):
+        return await stage_bytes(data, content_type, filename)
+
 
+async def url_to_input(
+    url: str, default_type: str = "image/jpeg", timeout: int = 30, max_side: int | None = None,
+) -> str:
+    """Return a model input for a URL: the URL itself if passthrough allows, else download and stage it.
 
-async def to_data_uris(attachments: list, embed_urls: list, limit: int = 5, default_type: str = "image/jpeg") -> list[str]:
-    """Convert attachments and/or embed URLs to data URIs."""
-    data_uris = []
-    if embed_urls:
-        for url in embed_urls[:limit]:
-            data_uris.append(url_to_data_uri(url, default_type))
-    for a in attachments[:limit]:
-        data_uris.append(await attachment_to_data_uri(a))
-    return data_uris
+    Downloads go through cogs.media_cache; images are downscaled to max_side.
+    """
+    if is_passthrough_url(url):
+        return url
+    body, content_type = await media_cache.get_bytes(
+        media_cache.url_key(url), lambda: download(url, timeout=timeout)
+    )
+    content_type = content_type or default_type
+    if max_side and settings.input_downscale and content_type.startswith("image/"):
+        with metrics.stage("resize"):
+            body, content_type = await imaging.prepare_input(body, content_type, max_side)
+    with metrics.stage("encode"):
+        return await stage_bytes(body, content_type)
+
+
+async def gather_inputs(
+    sources: list, default_type: str = "image/jpeg", max_side: int | None = None,
+) -> list[str]:
+    """Stage attachments and/or URLs as model inputs concurrently, keeping their order.
+
+    Images are downscaled to max_side (the command's max_input_side) on the way.
+
+    At most settings.input_concurrency inputs are fetched at once, and each one
+    gets settings.input_timeout seconds before the whole batch fails.
+    """
+    semaphore = asyncio.Semaphore(settings.input_concurrency)
+    timeout = settings.input_timeout
+
+    async def prepare(index: int, source) -> str:
+        async with semaphore:
+            if isinstance(source, str):
+                coro = url_to_input(source, default_type, timeout=timeout, max_side=max_side)
+            else:
+                coro = attachment_to_input(source, max_side)
+            try:
+                return await asyncio.wait_for(coro, timeout=timeout)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(
+                    f"Timed out fetching input #{index + 1} after {timeout}s"
+                ) from None
+
+    return list(await asyncio.gather(*(prepare(i, s) for i, s in enumerate(sources))))
+
+
+async def to_inputs(
+    attachments: list, embed_urls: list, limit: int = 5, default_type: str = "image/jpeg",
+    max_side: int | None = None,
+) -> list[str]:
+    """Stage attachments and/or embed URLs as model input URLs."""
+    return await gather_inputs(embed_urls[:limit] + attachments[:limit], default_type, max_side)
+
+
+async def to_frame_inputs(
+    attachments: list, embed_urls: list, max_side: int | None = None,
+) -> tuple[str | None, str | None]:
+    """Return (first_frame, last_frame) inputs for the image-to-video commands.
+
+    The first attachment (or embed) is the first frame; a second attachment is
+    the last frame. Both are fetched in parallel.
+    """
+    inputs = await gather_inputs(attachments[:2] or embed_urls[:1], max_side=max_side)
+    first = inputs[0] if inputs else None
+    last = inputs[1] if len(inputs) > 1 else None
+    return first, last
 
 
 def unwrap_output(output):
@@ -74,59 +208,166 @@ def unwrap_output(output):
     return str(output)
 
 
-async def reply_with_file(ctx: commands.Context, url, filename: str, status_msg=None):
-    """Download a URL and reply with it as a Discord file. Returns True on success."""
-    url = unwrap_output(url)
-    response = requests.get(url, timeout=30)
-    data = BytesIO(response.content)
-    if data.getbuffer().nbytes > 25 * 1024 * 1024:
-        msg = f"File too large for Discord. URL:\n{url}"
-        if status_msg:
-            await status_msg.edit(content=msg)
+async def fetch_output(
+    url: str, max_bytes: int | None = MAX_OUTPUT_BYTES, timeout: int = 120, model: str = ""
+) -> tuple[bytes, str | None]:
+    """Download a model output, raising GenerationError if it is too large to fetch."""
+    try:
+        with metrics.stage("download", model):
+            body, content_type = await download(url, max_bytes=max_bytes, timeout=timeout)
+    except DownloadTooLarge:
+        raise GenerationError(f"❌ Output too large to download. URL:\n{url}") from None
+    metrics.add_bytes("download", len(body), model)
+    return body, content_type
+
+
+async def fetch_media(
+    url: str, max_bytes: int | None = MAX_OUTPUT_BYTES, timeout: int = 120, model: str = "",
+    suffix: str = ".bin",
+) -> tuple[MediaBuffer, str | None]:
+    """fetch_output() into a MediaBuffer, for outputs (videos) that may be large."""
+    try:
+        with metrics.stage("download", model):
+            buf, content_type = await download_spooled(
+                url, max_bytes=max_bytes, timeout=timeout, suffix=suffix
+            )
+    except DownloadTooLarge:
+        raise GenerationError(f"❌ Output too large to download. URL:\n{url}") from None
+    metrics.add_bytes("download", buf.size, model)
+    return buf, content_type
+
+
+async def _prepare_upload(
+    ctx: commands.Context, data: bytes | MediaBuffer, filename: str, model: str, status_msg,
+) -> tuple[bytes | MediaBuffer, str]:
+    if isinstance(data, bytes):
+        with metrics.stage("optimize", model):
+            data, filename = await imaging.optimize(data, filename)
+    return await fit_to_limit(ctx, data, filename, status_msg)
+
+
+async def reply_file(
+    ctx: commands.Context, data: bytes | MediaBuffer, filename: str, model: str = "",
+    source_url: str | None = None, status_msg=None, model_input: dict | None = None,
+    flight: str | None = None,
+) -> discord.Message:
+    """Reply with bytes (or a MediaBuffer) as a Discord file, timed as the "upload" stage.
+
+    Images are post-processed first (see cogs.imaging). Files over the guild's
+    upload limit are re-encoded or recompressed to fit (progress shown in
+    status_msg, if given); GenerationError is raised, with source_url, if that
+    isn't possible. With source_url (the model output the bytes came from), the
+    post is recorded in the ledger.
+
+    The posted file is kept in cogs.media_cache and its lineage (model_input,
+    source_url, parent output) recorded, so follow-ups resolve it locally.
+
+    With flight (the single-flight key of the work that produced data), callers
+    coalesced on that work share one post-processing run per upload limit.
+    """
+    try:
+        if flight is None:
+            data, filename = await _prepare_upload(ctx, data, filename, model, status_msg)
         else:
-            await ctx.reply(msg)
-        return False
-    data.seek(0)
-    await ctx.reply(file=discord.File(data, filename))
-    return True
-
-
-async def poll_prediction(prediction, label: str, status_msg, emoji: str):
-    """Poll a Replicate prediction until it completes, updating the status message."""
-    elapsed = 0
-    while prediction.status not in ("succeeded", "failed", "canceled"):
-        await asyncio.sleep(5)
-        elapsed += 5
-        try:
-            prediction = await asyncio.wait_for(
-                asyncio.to_thread(replicate.predictions.get, prediction.id),
-                timeout=30.0,
+            data, filename = await singleflight.run(
+                f"{flight}:upload:{upload_limit(ctx)}",
+                lambda: _prepare_upload(ctx, data, filename, model, status_msg),
             )
-        except asyncio.TimeoutError:
-            print(f"[{label}] {elapsed}s - poll hung, retrying...")
-            continue
+    except ValueError as e:
+        url = f" URL:\n{source_url}" if source_url else ""
+        raise GenerationError(f"❌ File too large for Discord: {e}.{url}") from None
+    if isinstance(data, MediaBuffer):
+        file = data.file(filename)
+    else:
+        file = discord.File(BytesIO(data), filename)
+    with metrics.stage("upload", model):
+        message = await ctx.reply(file=file)
+    metrics.add_bytes("upload", len(data), model)
+    if source_url:
+        await ledger.record_post(ctx, message, source_url)
+    media_key = file_path = None
+    if message.attachments:
+        media_key = media_cache.attachment_key(message.attachments[0])
+        file_path = await media_cache.put(media_key, data, mimetypes.guess_type(filename)[0])
+    await ledger.record_lineage(ctx, message, model, model_input, source_url, media_key, file_path)
+    return message
+
+
+async def poll_prediction(prediction, label: str, status_msg, emoji: str, kind: str = "video"):
+    """Wait for a Replicate prediction via the shared poller, updating the status message."""
+
+    async def on_update(prediction, elapsed: int):
         print(f"[{label}] {elapsed}s - status: {prediction.status}")
-        await status_msg.edit(
-            content=f"{emoji} Generating... ({elapsed}s, status: {prediction.status})"
+        renderer.update(
+            status_msg, f"{emoji} Generating... ({elapsed}s, status: {prediction.status})"
         )
-    return prediction
 
+    return await poller.wait(prediction, kind, on_update)
+
+
+async def generate_image(
+    ctx: commands.Context, model: str, model_input: dict, cmd_name: str,
+    cache_key: str | None = None,
+) -> tuple[bytes, str]:
+    """Run a Replicate image model and download its output. Returns (image_bytes, url).
+
+    Raises GenerationError when the prediction fails or its output can't be posted.
+    With a cache_key, the downloaded bytes are also stored in the result cache.
+    """
+    with registry.latency.measure(cmd_name):
+        async with scheduler.slot(model, ctx, "image"):
+            output = await run_prediction(model, model_input, label=cmd_name)
+    if output.status == "failed":
+        raise GenerationError(f"❌ Generation failed: {output.error or 'Unknown error'}")
+    if not output.output:
+        raise GenerationError(f"❌ No output returned. Status: {output.status}")
+    url = unwrap_output(output.output)
+    body, content_type = await fetch_output(url, timeout=30, model=model)
+    await result_cache.put(cache_key, body, url=url, content_type=content_type)
+    return body, url
+
+
+def source_message_id(ctx: commands.Context) -> int | None:
+    """Return the id of the message the command replies to, if any."""
+    return ctx.message.reference.message_id if ctx.message.reference else None
 
-async def run_image_model(ctx: commands.Context, model: str, model_input: dict, filename: str, cmd_name: str):
-    """Run a Replicate image model with wait=True, handle the result, and reply."""
+
+def prediction_flight(ctx: commands.Context, label: str, model: str, model_input: dict) -> str:
+    """Return the single-flight key for running model on model_input as command `label`."""
+    return singleflight.flight_key(
+        label, {"model": model, "input": model_input}, source_message_id(ctx)
+    )
+
+
+async def run_image_model(
+    ctx: commands.Context, model: str, model_input: dict, filename: str, cmd_name: str,
+    cacheable: bool = True,
+):
+    """Run a Replicate image model (sync wait, then polling), handle the result, and reply.
+
+    Pass cacheable=False when the output is not determined by model_input
+    (e.g. a random seed) so the result cache is bypassed. Identical requests
+    already in flight share one prediction.
+    """
     try:
+        key = result_cache.cache_key(model, model_input) if cacheable else None
+        cached = await result_cache.get(key)
+        if cached is not None:
+            # read back: images are small, and bytes go through imaging.optimize
+            body = await cached[0].read()
+            await reply_file(ctx, body, filename, model, model_input=model_input)
+            return
+        flight = prediction_flight(ctx, cmd_name, model, model_input)
         async with ctx.typing():
-            output = replicate.models.predictions.create(
-                model=model,
-                input=model_input,
-                wait=True,
+            body, url = await singleflight.run(
+                flight, lambda: generate_image(ctx, model, model_input, cmd_name, key)
             )
-            if output.status == "failed":
-                await ctx.reply(f"❌ Generation failed: {output.error or 'Unknown error'}")
-            elif output.output:
-                await reply_with_file(ctx, output.output, filename)
-            else:
-                await ctx.reply(f"❌ No output returned. Status: {output.status}")
+            await reply_file(
+                ctx, body, filename, model, source_url=url, model_input=model_input,
+                flight=flight,
+            )
+    except GenerationError as e:
+        await ctx.reply(str(e))
     except Exception as e:
         from cogs.error_log import log_error
         log_error(cmd_name, e, ctx, model_input.get("prompt", ""))
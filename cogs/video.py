@@ -1,307 +1,344 @@
 import asyncio
-import base64
-import glob
 import os
 import subprocess
-import tempfile
 
 import discord
-import replicate
-import requests
 from discord.ext import commands
-from io import BytesIO
 
 from cogs.utils import (
+    MAX_OUTPUT_BYTES,
+    GenerationError,
+    fetch_media,
+    reply_file,
+    prediction_flight,
     get_attachments,
-    attachment_to_data_uri,
-    url_to_data_uri,
+    attachment_to_input,
+    url_to_input,
     unwrap_output,
     poll_prediction,
+    to_frame_inputs,
 )
+from cogs import (
+    encoding, fit, frames, ledger, media_cache, messages, metrics, registry, result_cache,
+    segments, singleflight, spool,
+)
+from cogs.downloads import download_spooled
 from cogs.error_log import log_error
+from cogs.ffmpeg import AUDIO_KBPS, QUIET, probe, run_ffmpeg, unlink
+from cogs.predictions import create_prediction
+from cogs.progress import renderer
+from cogs.scheduler import scheduler
+from cogs.spool import MediaBuffer
+from cogs.staging import stage_bytes
 
 
-def _run_ffmpeg(cmd: list[str], timeout: int = 300):
-    """Run an ffmpeg command, printing the real error (tail of stderr) to the log on failure.
+# /continue generates each new clip as this command would (P-Video draft mode)
+CONTINUE_WITH = registry.BY_NAME["lpvid"]
+
+# Every /continue segment is normalized to this so segments can be joined by stream copy.
+SEGMENT_VF = (
+    "scale=1280:720:force_original_aspect_ratio=decrease,"
+    "pad=1280:720:(ow-iw)/2:(oh-ih)/2,setsar=1,fps=24,format=yuv420p"
+)
+# Pin sample format too (not just rate/layout) so every segment's audio is identical.
+AUDIO_FORMAT = "aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo"
 
-    Raises subprocess.CalledProcessError (with stderr attached) on non-zero exit.
-    """
-    result = subprocess.run(cmd, capture_output=True, timeout=timeout)
-    if result.returncode != 0:
-        stderr = result.stderr.decode("utf-8", "replace").strip()
-        tail = "\n".join(stderr.splitlines()[-15:])
-        print(f"[ffmpeg] exit {result.returncode}:\n{tail}")
-        raise subprocess.CalledProcessError(
-            result.returncode, cmd, output=result.stdout, stderr=result.stderr
-        )
-    return result
 
+async def normalize_segment(src_path: str, dst_path: str, on_progress=None):
+    """Re-encode a clip into the common segment format so segments join by stream copy.
 
-def extract_last_frame(video_bytes: bytes) -> bytes:
-    """Extract the last frame of a video as JPEG bytes using ffmpeg."""
-    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as vf:
-        vf.write(video_bytes)
-        video_path = vf.name
-    frame_path = video_path + ".jpg"
+    Video is scaled/padded to 1280x720 @ 24fps H.264 with fixed encoder settings.
+    Audio is resampled to 44.1kHz stereo AAC and padded to the video length; a
+    clip without audio gets silence, so joined segments stay in sync.
+    on_progress, if given, is called with the fraction done (0..1).
+    """
+    with metrics.stage("probe"):
+        info = await probe(src_path)
+    cmd = ["ffmpeg", "-y", *QUIET, "-i", src_path]
+    if info.has_audio:
+        audio_map = "0:a:0"
+    else:
+        cmd += ["-f", "lavfi", "-i", "anullsrc=channel_layout=stereo:sample_rate=44100"]
+        audio_map = "1:a"
+    cmd += [
+        "-map", "0:v:0", "-map", audio_map,
+        "-vf", SEGMENT_VF, "-af", f"{AUDIO_FORMAT},apad", "-shortest",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-profile:v", "high",
+        "-g", "48", "-video_track_timescale", "12288",
+        "-c:a", "aac", "-b:a", f"{AUDIO_KBPS}k",
+        "-movflags", "+faststart", dst_path,
+    ]
+    with metrics.stage("normalize"):
+        await run_ffmpeg(cmd, duration=info.duration, on_progress=on_progress)
+
+
+async def normalize_buffer(buf: MediaBuffer, dst_path: str, on_progress=None) -> str:
+    """normalize_segment() for a MediaBuffer (spooled to disk first if needed). Returns dst_path."""
+    await normalize_segment(await buf.path(), dst_path, on_progress)
+    return dst_path
+
+
+async def join_segments(paths: list[str], out_path: str):
+    """Join normalized segments into one mp4 by stream copy (no re-encode)."""
+    list_path = out_path + ".txt"
+    with open(list_path, "w") as f:
+        for path in paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
     try:
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-sseof",
-                "-1",
-                "-i",
-                video_path,
-                "-update",
-                "1",
-                "-frames:v",
-                "1",
-                "-q:v",
-                "2",
-                frame_path,
-                "-y",
-            ],
-            check=True,
-            capture_output=True,
-            timeout=60,
-        )
-        with open(frame_path, "rb") as f:
-            return f.read()
+        with metrics.stage("join"):
+            await run_ffmpeg([
+                "ffmpeg", "-y", *QUIET, "-f", "concat", "-safe", "0", "-i", list_path,
+                "-c", "copy", "-movflags", "+faststart", out_path,
+            ])
     finally:
-        for p in (video_path, frame_path):
-            try:
-                os.unlink(p)
-            except OSError:
-                pass
+        unlink(list_path)
 
 
-def get_video_duration(path: str) -> float:
-    """Return a video's duration in seconds using ffprobe."""
-    result = subprocess.run(
-        ["ffprobe", "-v", "quiet", "-show_entries", "format=duration",
-         "-of", "default=noprint_wrappers=1:nokey=1", path],
-        capture_output=True, text=True, timeout=30,
-    )
-    return float(result.stdout.strip())
-
+async def stitch(paths: list[str], limit: int, on_progress=None) -> MediaBuffer:
+    """Join normalized segments by stream copy, re-encoding only if the result exceeds limit.
 
-def has_audio(path: str) -> bool:
-    """Return True if the file has at least one audio stream."""
-    result = subprocess.run(
-        ["ffprobe", "-v", "quiet", "-select_streams", "a", "-show_entries",
-         "stream=index", "-of", "csv=p=0", path],
-        capture_output=True, text=True, timeout=30,
-    )
-    return bool(result.stdout.strip())
+    Returns the mp4 as a (spooled) MediaBuffer. Raises ValueError if a re-encode is needed and the
+    stream is too long to fit. See cogs.encoding for how the
+    re-encode is chosen; on_progress reports its fraction done.
+    """
+    out_path = spool.temp_path(".mp4")
+    try:
+        await join_segments(paths, out_path)
+        return await encoding.fit(out_path, limit, on_progress=on_progress)
+    finally:
+        unlink(out_path)
 
 
-def concat_and_fit(prev_bytes: bytes, new_bytes: bytes, target_mb: int = 8) -> bytes:
-    """Concatenate two clips into one continuous stream re-encoded to fit target_mb.
+def _progress(status_msg, text: str):
+    """An on_progress callback showing `text` with a percentage in status_msg."""
+    return lambda done: renderer.update(status_msg, f"{text} {done:.0%}")
 
-    Both inputs are normalized to 1280x720 @ 24fps before joining, so a 480p prior
-    clip and a 720p new clip stitch cleanly. Audio is preserved: each segment keeps
-    its own audio, and any segment lacking an audio track is backfilled with silence
-    so the streams stay aligned. Two-pass libx264 targets a byte budget derived from
-    the combined duration. Returns mp4 bytes.
 
-    Raises ValueError if the combined stream is too long to fit at acceptable quality.
-    """
-    MIN_VIDEO_KBPS = 300
-    AUDIO_KBPS = 128
-    paths: list[str] = []
-    out_path = None
-    fs_path = None
-    log_file = None
-    try:
-        for data in (prev_bytes, new_bytes):
-            tf = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False)
-            tf.write(data)
-            tf.close()
-            paths.append(tf.name)
-        prev_path, new_path = paths
-
-        durs = [get_video_duration(prev_path), get_video_duration(new_path)]
-        auds = [has_audio(prev_path), has_audio(new_path)]
-        duration = sum(durs)
-        # leave ~5% headroom under the hard limit for container overhead
-        budget_bits = target_mb * 1024 * 1024 * 8 * 0.95
-        video_kbps = int(budget_bits / duration / 1000) - AUDIO_KBPS
-        if video_kbps < MIN_VIDEO_KBPS:
-            raise ValueError(
-                f"Stream is too long ({duration:.0f}s) to fit in {target_mb} MB. "
-                f"Start a fresh clip with /pvid."
-            )
+async def generate_video(
+    ctx: commands.Context, model: str, model_input: dict, status_msg, label: str,
+    max_bytes: int | None = MAX_OUTPUT_BYTES, cache_key: str | None = None,
+) -> tuple[MediaBuffer, str]:
+    """Run a Replicate video model with polling and return (video, url).
 
-        out_tf = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False)
-        out_path = out_tf.name
-        out_tf.close()
-        fs_path = out_path + ".fs.mp4"
-        log_file = out_path + "-pass"
+    The video is downloaded into a MediaBuffer, so large outputs go to disk.
 
-        norm = (
-            "scale=1280:720:force_original_aspect_ratio=decrease,"
-            "pad=1280:720:(ow-iw)/2:(oh-ih)/2,setsar=1,fps=24"
-        )
-        # Pin sample format too (not just rate/layout) so the concat filter gets
-        # identical audio params on stricter ffmpeg builds (e.g. 4.4).
-        afmt = "aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo"
-
-        quiet = ["-hide_banner", "-loglevel", "error", "-nostats"]
-
-        # Each segment keeps its own audio; a segment with no audio track is backfilled
-        # with silence from a lavfi anullsrc input, only added when actually needed (an
-        # unused input can break older ffmpeg).
-        need_silence = not all(auds)
-        base = ["ffmpeg", "-y", *quiet, "-i", prev_path, "-i", new_path]
-        if need_silence:
-            base += ["-f", "lavfi", "-i",
-                     "anullsrc=channel_layout=stereo:sample_rate=44100"]
-
-        # Concatenate video and audio on SEPARATE concat filters. A single interleaved
-        # concat (v=1:a=1) pads each segment's video to match longer audio, which both
-        # changes the video frame count and makes it differ between the -f null pass 1
-        # and the real pass 2 — crashing libx264's two-pass ("more frames" / "Incomplete
-        # MB-tree stats file"). Separate concats keep the video timeline audio-independent
-        # and deterministic across both passes.
-        vparts = [
-            f"[0:v]{norm}[v0]", f"[1:v]{norm}[v1]",
-            "[v0][v1]concat=n=2:v=1:a=0[outv]",
-        ]
-        aparts = []
-        for i in range(2):
-            if auds[i]:
-                aparts.append(f"[{i}:a]{afmt}[a{i}]")
-            else:
-                aparts.append(
-                    f"[2:a]atrim=0:{durs[i]:.3f},asetpts=PTS-STARTPTS,{afmt}[a{i}]"
-                )
-        aparts.append("[a0][a1]concat=n=2:v=0:a=1[outa]")
-        full_graph = ";".join(vparts + aparts)
-
-        # Both passes run the identical filtergraph so the video frame count matches.
-        encode_common = base + [
-            "-filter_complex", full_graph, "-map", "[outv]", "-map", "[outa]",
-            "-c:v", "libx264", "-b:v", f"{video_kbps}k", "-pix_fmt", "yuv420p",
-            "-c:a", "aac", "-b:a", f"{AUDIO_KBPS}k",
-        ]
-        _run_ffmpeg(
-            encode_common + ["-pass", "1", "-passlogfile", log_file, "-f", "null", os.devnull]
-        )
-        _run_ffmpeg(
-            encode_common + ["-pass", "2", "-passlogfile", log_file, out_path]
-        )
+    Raises GenerationError when the prediction fails or its output is larger
+    than max_bytes (the URL is included in the message instead).
+    """
+    with registry.latency.measure(label):
+        async with scheduler.slot(model, ctx, "video", status_msg):
+            with metrics.stage("create", model):
+                prediction = await create_prediction(model, model_input)
+            print(f"[{label}] Prediction created: {prediction.id}")
+            with metrics.stage("run", model):
+                prediction = await poll_prediction(prediction, label, status_msg, "🎬")
+    metrics.record_prediction(prediction, model)
+    await ledger.record_prediction(prediction, model, model_input)
+    if prediction.status == "failed":
+        raise GenerationError(f"❌ Generation failed: {prediction.error or 'Unknown error'}")
+    if not prediction.output:
+        raise GenerationError(f"❌ No output returned. Status: {prediction.status}")
+    renderer.update(status_msg, "Downloading...")
+    url = unwrap_output(prediction.output)
+    content, _ = await fetch_media(url, max_bytes=max_bytes, model=model, suffix=".mp4")
+    await result_cache.put(cache_key, content, url=url, content_type="video/mp4")
+    return content, url
 
-        # Best-effort faststart remux (moov atom to front for progressive playback).
-        # Cheap stream copy; if it fails, fall back to the already-encoded file rather
-        # than discarding the expensive two-pass encode.
-        try:
-            _run_ffmpeg([
-                "ffmpeg", "-y", *quiet, "-i", out_path,
-                "-c", "copy", "-movflags", "+faststart", fs_path,
-            ])
-            os.replace(fs_path, out_path)
-        except Exception as e:
-            print(f"[ffmpeg] faststart remux skipped: {e}")
 
-        with open(out_path, "rb") as f:
-            return f.read()
-    finally:
-        cleanup = list(paths)
-        if out_path:
-            cleanup.append(out_path)
-            cleanup.append(fs_path)
-        if log_file:
-            # ffmpeg writes "<passlogfile>-<stream_idx>.log" (+ ".mbtree"), so glob the prefix
-            cleanup += glob.glob(f"{log_file}*.log") + glob.glob(f"{log_file}*.log.mbtree")
-        for p in cleanup:
-            try:
-                os.unlink(p)
-            except OSError:
-                pass
+def _on_join(status_msg):
+    return lambda: renderer.update(
+        status_msg, "🔁 Identical request already running, sharing its result..."
+    )
 
 
 async def predict_video_bytes(
-    ctx: commands.Context, model: str, model_input: dict, status_msg, label: str
+    ctx: commands.Context, model: str, model_input: dict, status_msg, label: str,
+    max_bytes: int | None = MAX_OUTPUT_BYTES, cache_key: str | None = None,
 ):
-    """Run a Replicate video model with polling and return (video_bytes, url), or None on failure."""
-    prediction = await asyncio.to_thread(
-        replicate.models.predictions.create,
-        model=model,
-        input=model_input,
-    )
-    print(f"[{label}] Prediction created: {prediction.id}")
-    prediction = await poll_prediction(prediction, label, status_msg, "🎬")
-    if prediction.status == "failed":
-        await status_msg.edit(
-            content=f"❌ Generation failed: {prediction.error or 'Unknown error'}"
-        )
-        return None
-    if not prediction.output:
-        await status_msg.edit(
-            content=f"❌ No output returned. Status: {prediction.status}"
+    """Run a Replicate video model and return (video, url), or None on failure.
+
+    Failures are reported in status_msg. Identical requests already in flight
+    share one prediction.
+    """
+    try:
+        return await singleflight.run(
+            prediction_flight(ctx, label, model, model_input),
+            lambda: generate_video(
+                ctx, model, model_input, status_msg, label, max_bytes, cache_key
+            ),
+            on_join=_on_join(status_msg),
         )
+    except GenerationError as e:
+        await renderer.final(status_msg, str(e))
         return None
-    await status_msg.edit(content="Downloading...")
-    url = unwrap_output(prediction.output)
-    video_response = await asyncio.to_thread(requests.get, url, timeout=(10, 120))
-    return video_response.content, url
 
 
 async def run_video_model(
-    ctx: commands.Context, model: str, model_input: dict, status_msg, label: str
+    ctx: commands.Context, model: str, model_input: dict, status_msg, label: str,
+    cacheable: bool = True,
 ):
-    """Run a Replicate video model with polling and reply with the video."""
-    result = await predict_video_bytes(ctx, model, model_input, status_msg, label)
-    if result is None:
+    """Run a Replicate video model with polling and reply with the video.
+
+    Identical deterministic invocations are answered from the result cache.
+    Videos over the guild's upload limit are re-encoded to fit, once per limit
+    for identical requests sharing the prediction.
+    """
+    key = result_cache.cache_key(model, model_input) if cacheable else None
+    cached = await result_cache.get(key)
+    if cached is not None:
+        content, url, flight = cached[0], None, None
+    else:
+        flight = prediction_flight(ctx, label, model, model_input)
+        result = await predict_video_bytes(
+            ctx, model, model_input, status_msg, label, cache_key=key
+        )
+        if result is None:
+            return
+        content, url = result
+        renderer.update(status_msg, "Uploading...")
+    try:
+        await reply_file(
+            ctx, content, "video.mp4", model, source_url=url, status_msg=status_msg,
+            model_input=model_input,
+            flight=flight,
+        )
+    except GenerationError as e:
+        await renderer.final(status_msg, str(e))
         return
-    content, url = result
-    video_data = BytesIO(content)
-    if video_data.getbuffer().nbytes > 25 * 1024 * 1024:
-        await status_msg.edit(content=f"❌ File too large for Discord. URL:\n{url}")
+    await renderer.delete(status_msg)
+
+
+def _video_attachment(message: discord.Message) -> discord.Attachment | None:
+    return next(
+        (a for a in message.attachments if a.content_type and a.content_type.startswith("video/")),
+        None,
+    )
+
+
+async def _download_replied_video(ctx: commands.Context) -> tuple[MediaBuffer, str | None]:
+    """Download the video of the message ctx replies to (on a media cache miss)."""
+    ref_msg = await messages.resolve(ctx, ctx.message.reference)
+    attachment = _video_attachment(ref_msg)
+    if attachment is None:
+        raise GenerationError("❌ The replied-to message has no video.")
+    return await download_spooled(attachment.url, suffix=".mp4")
+
+
+async def _original_prompt(ctx: commands.Context, ref_msg: discord.Message) -> str:
+    """Return the prompt of the command ref_msg answered, for outputs without a lineage entry."""
+    if not ref_msg.reference:
+        return ""
+    try:
+        original = await messages.resolve(ctx, ref_msg.reference)
+    except discord.NotFound:
+        return ""
+    original_ctx = await ctx.bot.get_context(original)
+    if original_ctx.command is None:
+        return ""
+    return original_ctx.view.read_rest().strip()
+
+
+async def continue_stream(
+    ctx: commands.Context, ref_id: int, video_key: str, prompt: str, status_msg,
+) -> tuple[MediaBuffer, list[str], dict]:
+    """Extend a video with a new P-Video clip seeded from its last frame and stitch both.
+
+    If ref_id is a chain video the bot posted, its normalized segments are
+    reused from the segment store; otherwise the video (video_key in
+    cogs.media_cache, downloaded from the replied-to message on a miss) is
+    normalized as the chain's first segment. Only the new clip is encoded,
+    and the segments are joined by stream copy.
+
+    Videos are kept in files or MediaBuffers throughout, so large ones stay on disk.
+    Returns (combined mp4, the chain's segment paths, the new clip's model
+    input); raises GenerationError if it can't be produced.
+    """
+    renderer.update(status_msg, "🎬 Extracting last frame...")
+    chain = segments.lookup(ref_id)
+    if chain is None:
+        with media_cache.pin(video_key):
+            previous, _ = await media_cache.get_path(
+                video_key, lambda: _download_replied_video(ctx)
+            )
+            return await _continue_from(ctx, previous, video_key, None, prompt, status_msg)
+    return await _continue_from(ctx, chain[-1], chain[-1], chain, prompt, status_msg)
+
+
+async def _continue_from(
+    ctx: commands.Context, previous: str, frame_key: str, chain: list[str] | None,
+    prompt: str, status_msg,
+) -> tuple[MediaBuffer, list[str], dict]:
+    """continue_stream() once the previous video is a file (a cache entry or the last segment)."""
+    try:
+        frame_bytes = await frames.extract_last_frame(previous, key=frame_key)
+    except ValueError as e:
+        raise GenerationError(f"❌ Couldn't extract the last frame: {e}") from None
+    first_frame = await stage_bytes(frame_bytes, "image/jpeg", "frame.jpg")
+
+    model, model_input = CONTINUE_WITH.build_input(prompt, [first_frame])
+    renderer.update(status_msg, f"🎬 Continuing with prompt: {prompt[:100]}")
+    new_clip, _ = await generate_video(ctx, model, model_input, status_msg, "continue")
+
+    try:
+        async with scheduler.slot("ffmpeg", ctx, "ffmpeg", status_msg):
+            if chain is None:
+                text = "🎬 Normalizing previous clip..."
+                renderer.update(status_msg, text)
+                first_segment = segments.new_segment_path()
+                await normalize_segment(previous, first_segment, _progress(status_msg, text))
+                chain = [first_segment]
+            text = "🎬 Normalizing new clip..."
+            renderer.update(status_msg, text)
+            new_segment = await normalize_buffer(
+                new_clip, segments.new_segment_path(), _progress(status_msg, text)
+            )
+            chain = chain + [new_segment]
+            renderer.update(status_msg, "🎬 Stitching clips into one stream...")
+            combined = await stitch(
+                chain, fit.upload_limit(ctx),
+                on_progress=_progress(status_msg, "🎬 Re-encoding to fit Discord..."),
+            )
+    except ValueError as e:
+        raise GenerationError(f"❌ {e} Start a fresh clip with /pvid.") from None
+    return combined, chain, model_input
+
+
+async def run_video_command(ctx: commands.Context, command: registry.ModelCommand, text: str):
+    """Run a registry video command: route it, stage first/last frames, and generate."""
+    attachments, embed_urls = await get_attachments(ctx, "image/")
+    if command.requires_image and not attachments and not embed_urls:
+        await ctx.reply(
+            f"❌ /{command.name} is image-to-video: attach an image or reply to a message with one."
+        )
         return
-    video_data.seek(0)
-    await status_msg.edit(content="Uploading...")
-    await ctx.reply(file=discord.File(video_data, "video.mp4"))
-    await status_msg.delete()
+    routed = registry.route(command)
+    status = routed.status
+    if routed is not command:
+        status = f"⚡ /{command.name} is slow right now, using /{routed.name} instead. {status}"
+    status_msg = await ctx.reply(status)
+    try:
+        first, last = await to_frame_inputs(attachments, embed_urls, routed.max_input_side)
+        model, model_input = routed.build_input(text, [i for i in (first, last) if i])
+        await run_video_model(
+            ctx, model, model_input, status_msg, routed.name, cacheable=routed.cacheable(model_input)
+        )
+    except Exception as e:
+        log_error(command.name, e, ctx, text)
+        await renderer.final(status_msg, f"❌ An error occurred: {e}")
 
 
 class Video(commands.Cog):
+    """Video commands: one per "video" entry in cogs.registry, plus /continue and /mmaudio."""
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    @commands.command()
-    async def seed(self, ctx: commands.Context, *, text: str):
-        """Generate a video using Seedance 1 Pro Fast.
-
-        Usage: /seed prompt (text-to-video)
-        Usage: /seed prompt + 1 image (image-to-video, first frame)
-        Usage: /seed prompt + 2 images (first + last frame)
-        """
-        status_msg = await ctx.reply(
-            "🎬 Generating video, this may take a few minutes..."
-        )
-        try:
-            model_input = {
-                "prompt": text,
-                "duration": 5,
-                "resolution": "480p",
-                "aspect_ratio": "16:9",
-                "fps": 24,
-            }
-            attachments, embed_urls = await get_attachments(ctx, "image/")
-            if attachments:
-                model_input["image"] = await attachment_to_data_uri(attachments[0])
-            elif embed_urls:
-                model_input["image"] = url_to_data_uri(embed_urls[0])
-            if len(attachments) >= 2:
-                model_input["last_frame_image"] = await attachment_to_data_uri(
-                    attachments[1]
-                )
-            await run_video_model(
-                ctx, "bytedance/seedance-1-pro-fast", model_input, status_msg, "seed"
-            )
-        except Exception as e:
-            log_error("seed", e, ctx, text)
-            await status_msg.edit(content=f"❌ An error occurred: {e}")
+    seed = registry.model_command("seed", run_video_command)
+    pvid = registry.model_command("pvid", run_video_command)
+    lpvid = registry.model_command("lpvid", run_video_command)
+    zpvid = registry.model_command("zpvid", run_video_command)
+    wan = registry.model_command("wan", run_video_command)
+    ltx = registry.model_command("ltx", run_video_command)
 
     @commands.command(name="continue")
     async def continue_(self, ctx: commands.Context, *, text: str = ""):
@@ -322,259 +359,57 @@ class Video(commands.Cog):
             "🎬 Continuing video, this may take a few minutes..."
         )
         try:
-            ref_msg = await ctx.channel.fetch_message(ctx.message.reference.message_id)
-            video_attachments = [
-                a
-                for a in ref_msg.attachments
-                if a.content_type and a.content_type.startswith("video/")
-            ]
-            if not video_attachments:
-                await status_msg.edit(content="❌ The replied-to message has no video.")
-                return
-            await status_msg.edit(content="🎬 Extracting last frame...")
-            video_bytes = await video_attachments[0].read()
-            frame_bytes = await asyncio.to_thread(extract_last_frame, video_bytes)
-            b64 = base64.b64encode(frame_bytes).decode("utf-8")
-            first_frame = f"data:image/jpeg;base64,{b64}"
-
+            ref_id = ctx.message.reference.message_id
             prompt = text.strip()
-            if not prompt and ref_msg.reference:
-                try:
-                    original = await ctx.channel.fetch_message(
-                        ref_msg.reference.message_id
-                    )
-                    content = original.content.strip()
-                    for prefix in ("/lpvid ", "/pvid ", "/zpvid ", "/seed ", "/continue "):
-                        if content.startswith(prefix):
-                            prompt = content[len(prefix) :].strip()
-                            break
-                except discord.NotFound:
-                    pass
+            entry = await ledger.lineage(ref_id)
+            if entry is not None:
+                # an output the bot posted: everything is known locally
+                if entry["media_key"] is None or not (entry["filename"] or "").endswith(
+                    fit.VIDEO_EXTS
+                ):
+                    await renderer.final(status_msg, "❌ The replied-to message has no video.")
+                    return
+                video_key = entry["media_key"]
+                prompt = prompt or entry["prompt"] or ""
+            else:
+                ref_msg = await messages.resolve(ctx, ctx.message.reference)
+                attachment = _video_attachment(ref_msg)
+                if attachment is None:
+                    await renderer.final(status_msg, "❌ The replied-to message has no video.")
+                    return
+                video_key = media_cache.attachment_key(attachment)
+                prompt = prompt or await _original_prompt(ctx, ref_msg)
             if not prompt:
-                await status_msg.edit(
-                    content="❌ Couldn't find original prompt. Provide one with /continue <prompt>."
+                await renderer.final(
+                    status_msg, "❌ Couldn't find original prompt. Provide one with /continue <prompt>."
                 )
                 return
 
-            model_input = {
-                "prompt": prompt,
-                "duration": 8,
-                "resolution": "720p",
-                "aspect_ratio": "16:9",
-                "fps": 24,
-                "disable_safety_filter": True,
-                "prompt_upsampling": True,
-                "draft": True,
-                "image": first_frame,
-            }
-            await status_msg.edit(content=f"🎬 Continuing with prompt: {prompt[:100]}")
-            result = await predict_video_bytes(
-                ctx, "prunaai/p-video", model_input, status_msg, "continue"
-            )
-            if result is None:
-                return
-            new_bytes, _ = result
-
-            await status_msg.edit(content="🎬 Stitching clips into one stream...")
+            flight = singleflight.flight_key("continue", {"prompt": prompt}, ref_id)
             try:
-                combined = await asyncio.to_thread(concat_and_fit, video_bytes, new_bytes)
-            except ValueError as e:
-                await status_msg.edit(content=f"❌ {e}")
-                return
-            video_data = BytesIO(combined)
-            if video_data.getbuffer().nbytes > 10 * 1024 * 1024:
-                await status_msg.edit(content="❌ Combined stream too large for Discord.")
+                combined, chain, model_input = await singleflight.run(
+                    flight,
+                    lambda: continue_stream(ctx, ref_id, video_key, prompt, status_msg),
+                    on_join=_on_join(status_msg),
+                )
+            except GenerationError as e:
+                await renderer.final(status_msg, str(e))
                 return
-            video_data.seek(0)
-            await status_msg.edit(content="Uploading...")
-            await ctx.reply(file=discord.File(video_data, "video.mp4"))
-            await status_msg.delete()
+            renderer.update(status_msg, "Uploading...")
+            message = await reply_file(
+                ctx, combined, "video.mp4", CONTINUE_WITH.model, model_input=model_input,
+                flight=flight,
+            )
+            await asyncio.to_thread(segments.save, message.id, chain)
+            await renderer.delete(status_msg)
         except subprocess.CalledProcessError as e:
             log_error("continue", e, ctx, text)
             stderr = e.stderr.decode("utf-8", "replace").strip() if e.stderr else str(e)
             tail = "\n".join(stderr.splitlines()[-12:])
-            await status_msg.edit(content=f"❌ ffmpeg failed:\n```\n{tail[-1800:]}\n```")
+            await renderer.final(status_msg, f"❌ ffmpeg failed:\n```\n{tail[-1800:]}\n```")
         except Exception as e:
             log_error("continue", e, ctx, text)
-            await status_msg.edit(content=f"❌ An error occurred: {e}")
-
-    @commands.command()
-    async def pvid(self, ctx: commands.Context, *, text: str):
-        """Generate a video using P-Video (prunaai/p-video).
-
-        Usage: /pvid prompt (text-to-video)
-        Usage: /pvid prompt + 1 image (image-to-video, first frame)
-        Usage: /pvid prompt + 2 images (first + last frame)
-        """
-        status_msg = await ctx.reply(
-            "🎬 Generating video, this may take a few minutes..."
-        )
-        try:
-            model_input = {
-                "prompt": text,
-                "duration": 8,
-                "resolution": "720p",
-                "aspect_ratio": "16:9",
-                "fps": 24,
-                "disable_safety_filter": True,
-                "prompt_upsampling": True,
-            }
-            attachments, embed_urls = await get_attachments(ctx, "image/")
-            if attachments:
-                model_input["image"] = await attachment_to_data_uri(attachments[0])
-            elif embed_urls:
-                model_input["image"] = url_to_data_uri(embed_urls[0])
-            if len(attachments) >= 2:
-                model_input["last_frame_image"] = await attachment_to_data_uri(attachments[1])
-            await run_video_model(
-                ctx, "prunaai/p-video", model_input, status_msg, "pvid"
-            )
-        except Exception as e:
-            log_error("pvid", e, ctx, text)
-            await status_msg.edit(content=f"❌ An error occurred: {e}")
-
-    @commands.command()
-    async def lpvid(self, ctx: commands.Context, *, text: str):
-        """Generate a video using P-Video in draft mode (faster, lower quality).
-
-        Usage: /lpvid prompt (text-to-video)
-        Usage: /lpvid prompt + 1 image (image-to-video, first frame)
-        Usage: /lpvid prompt + 2 images (first + last frame)
-        """
-        status_msg = await ctx.reply(
-            "Generating video in draft mode, this may take a few minutes..."
-        )
-        try:
-            model_input = {
-                "prompt": text,
-                "duration": 8,
-                "resolution": "720p",
-                "aspect_ratio": "16:9",
-                "fps": 24,
-                "disable_safety_filter": True,
-                "prompt_upsampling": True,
-                "draft": True,
-            }
-            attachments, embed_urls = await get_attachments(ctx, "image/")
-            if attachments:
-                model_input["image"] = await attachment_to_data_uri(attachments[0])
-            elif embed_urls:
-                model_input["image"] = url_to_data_uri(embed_urls[0])
-            if len(attachments) >= 2:
-                model_input["last_frame_image"] = await attachment_to_data_uri(attachments[1])
-            await run_video_model(
-                ctx, "prunaai/p-video", model_input, status_msg, "lpvid"
-            )
-        except Exception as e:
-            log_error("lpvid", e, ctx, text)
-            await status_msg.edit(content=f"An error occurred: {e}")
-
-    @commands.command()
-    async def zpvid(self, ctx: commands.Context, *, text: str):
-        """Generate a video using P-Video with prompt_upsampling disabled.
-
-        Usage: /zpvid prompt (text-to-video, raw prompt, no auto-enhance)
-        Usage: /zpvid prompt + 1 image (image-to-video, first frame)
-        Usage: /zpvid prompt + 2 images (first + last frame)
-        """
-        status_msg = await ctx.reply(
-            "🎬 Generating video, this may take a few minutes..."
-        )
-        try:
-            model_input = {
-                "prompt": text,
-                "duration": 8,
-                "resolution": "720p",
-                "aspect_ratio": "16:9",
-                "fps": 24,
-                "prompt_upsampling": False,
-                "disable_safety_filter": True,
-            }
-            attachments, embed_urls = await get_attachments(ctx, "image/")
-            if attachments:
-                model_input["image"] = await attachment_to_data_uri(attachments[0])
-            elif embed_urls:
-                model_input["image"] = url_to_data_uri(embed_urls[0])
-            if len(attachments) >= 2:
-                model_input["last_frame_image"] = await attachment_to_data_uri(attachments[1])
-            await run_video_model(
-                ctx, "prunaai/p-video", model_input, status_msg, "zpvid"
-            )
-        except Exception as e:
-            log_error("zpvid", e, ctx, text)
-            await status_msg.edit(content=f"❌ An error occurred: {e}")
-
-    @commands.command()
-    async def wan(self, ctx: commands.Context, *, text: str):
-        """Generate a video using Wan 2.2 I2V Fast (image-to-video).
-
-        Usage: /wan prompt + 1 image (first frame)
-        Usage: /wan prompt + 2 images (first + last frame)
-        Requires an image: attach one or reply to a message with one.
-        """
-        attachments, embed_urls = await get_attachments(ctx, "image/")
-        if not attachments and not embed_urls:
-            await ctx.reply(
-                "❌ /wan is image-to-video: attach an image or reply to a message with one."
-            )
-            return
-        status_msg = await ctx.reply(
-            "🎬 Generating video, this may take a few minutes..."
-        )
-        try:
-            model_input = {
-                "prompt": text,
-                "resolution": "480p",
-                "num_frames": 81,
-                "frames_per_second": 16,
-                "disable_safety_checker": True,
-            }
-            if attachments:
-                model_input["image"] = await attachment_to_data_uri(attachments[0])
-            elif embed_urls:
-                model_input["image"] = url_to_data_uri(embed_urls[0])
-            if len(attachments) >= 2:
-                model_input["last_image"] = await attachment_to_data_uri(attachments[1])
-            await run_video_model(
-                ctx, "wan-video/wan-2.2-i2v-fast", model_input, status_msg, "wan"
-            )
-        except Exception as e:
-            log_error("wan", e, ctx, text)
-            await status_msg.edit(content=f"❌ An error occurred: {e}")
-
-    @commands.command()
-    async def ltx(self, ctx: commands.Context, *, text: str):
-        """Generate a video using LTX 2.5 Fast (6s @ 720p, with audio).
-
-        Usage: /ltx prompt (text-to-video)
-        Usage: /ltx prompt + 1 image (image-to-video, first frame)
-        Usage: /ltx prompt + 2 images (interpolates first -> last frame)
-        """
-        status_msg = await ctx.reply(
-            "🎬 Generating video, this may take a few minutes..."
-        )
-        try:
-            model_input = {
-                "prompt": text,
-                "duration": 6,
-                "resolution": "720p",
-                "aspect_ratio": "16:9",
-                "fps": 25,
-                "generate_audio": True,
-            }
-            attachments, embed_urls = await get_attachments(ctx, "image/")
-            if attachments:
-                model_input["image"] = await attachment_to_data_uri(attachments[0])
-            elif embed_urls:
-                model_input["image"] = url_to_data_uri(embed_urls[0])
-            if len(attachments) >= 2:
-                model_input["last_frame_image"] = await attachment_to_data_uri(attachments[1])
-            await run_video_model(
-                ctx, "lightricks/ltx-2.5-fast", model_input, status_msg, "ltx"
-            )
-        except Exception as e:
-            log_error("ltx", e, ctx, text)
-            await status_msg.edit(content=f"❌ An error occurred: {e}")
+            await renderer.final(status_msg, f"❌ An error occurred: {e}")
 
     @commands.command()
     async def mmaudio(self, ctx: commands.Context, *, text: str = ""):
@@ -594,46 +429,53 @@ class Video(commands.Cog):
             }
             attachments, embed_urls = await get_attachments(ctx, "video/")
             if attachments:
-                model_input["video"] = await attachment_to_data_uri(attachments[0])
+                model_input["video"] = await attachment_to_input(attachments[0])
             elif embed_urls:
-                model_input["video"] = url_to_data_uri(
+                model_input["video"] = await url_to_input(
                     embed_urls[0], default_type="video/mp4", timeout=60
                 )
-            prediction = await asyncio.to_thread(
-                replicate.predictions.create,
-                version="62871fb59889b2d7c13777f08deb3b36bdff88f7e1d53a50ad7694548a41b484",
-                input=model_input,
-            )
-            print(f"[mmaudio] Prediction created: {prediction.id}")
-            prediction = await poll_prediction(prediction, "mmaudio", status_msg, "🎵")
+            async with scheduler.slot("zsxkib/mmaudio", ctx, "audio", status_msg):
+                with metrics.stage("create", "zsxkib/mmaudio"):
+                    prediction = await create_prediction(
+                        "zsxkib/mmaudio:62871fb59889b2d7c13777f08deb3b36bdff88f7e1d53a50ad7694548a41b484",
+                        model_input,
+                    )
+                print(f"[mmaudio] Prediction created: {prediction.id}")
+                with metrics.stage("run", "zsxkib/mmaudio"):
+                    prediction = await poll_prediction(
+                        prediction, "mmaudio", status_msg, "🎵", kind="audio"
+                    )
+            metrics.record_prediction(prediction, "zsxkib/mmaudio")
+            await ledger.record_prediction(prediction, "zsxkib/mmaudio", model_input)
             if prediction.status == "failed":
-                await status_msg.edit(
-                    content=f"❌ Generation failed: {prediction.error or 'Unknown error'}"
+                await renderer.final(
+                    status_msg, f"❌ Generation failed: {prediction.error or 'Unknown error'}"
                 )
             elif prediction.output:
-                await status_msg.edit(content="Downloading...")
-                audio_response = await asyncio.to_thread(
-                    requests.get, unwrap_output(prediction.output), timeout=(10, 120)
-                )
-                audio_data = BytesIO(audio_response.content)
-                if audio_data.getbuffer().nbytes > 25 * 1024 * 1024:
-                    await status_msg.edit(
-                        content=f"❌ File too large for Discord. URL:\n{prediction.output}"
+                renderer.update(status_msg, "Downloading...")
+                url = unwrap_output(prediction.output)
+                filename = "video.mp4" if "video" in model_input else "audio.flac"
+                try:
+                    content, _ = await fetch_media(url, model="zsxkib/mmaudio")
+                    renderer.update(status_msg, "Uploading...")
+                    await reply_file(
+                        ctx, content, filename, "zsxkib/mmaudio",
+                        source_url=url, status_msg=status_msg, model_input=model_input,
                     )
+                except GenerationError as e:
+                    await renderer.final(status_msg, str(e))
                     return
-                audio_data.seek(0)
-                await status_msg.edit(content="Uploading...")
-                filename = "video.mp4" if attachments else "audio.flac"
-                await ctx.reply(file=discord.File(audio_data, filename))
-                await status_msg.delete()
+                await renderer.delete(status_msg)
             else:
-                await status_msg.edit(
-                    content=f"❌ No output returned. Status: {prediction.status}"
+                await renderer.final(
+                    status_msg, f"❌ No output returned. Status: {prediction.status}"
                 )
         except Exception as e:
             log_error("mmaudio", e, ctx, text)
-            await status_msg.edit(content=f"❌ An error occurred: {e}")
+            await renderer.final(status_msg, f"❌ An error occurred: {e}")
 
 
 async def setup(bot: commands.Bot):
-    await bot.add_cog(Video(bot))
+    cog = Video(bot)
+    registry.check_commands(cog, "video")
+    await bot.add_cog(cog)
@@ -1,10 +1,9 @@
-import asyncio
-
-import replicate
 from discord.ext import commands
 
-from cogs.utils import get_attachments, attachment_to_data_uri, url_to_data_uri
+from cogs.utils import get_attachments, attachment_to_input, url_to_input
 from cogs.error_log import log_error
+from cogs.predictions import run_prediction
+from cogs.scheduler import scheduler
 
 
 class Vision(commands.Cog):
@@ -26,20 +25,25 @@ class Vision(commands.Cog):
                 return
             async with ctx.typing():
                 if attachments:
-                    data_uri = await attachment_to_data_uri(attachments[0])
+                    image = await attachment_to_input(attachments[0])
                 else:
-                    data_uri = url_to_data_uri(embed_urls[0])
-                model_input = {"image": data_uri}
+                    image = await url_to_input(embed_urls[0])
+                model_input = {"image": image}
                 if text:
                     model_input["task"] = "visual_question_answering"
                     model_input["question"] = text
                 else:
                     model_input["task"] = "image_captioning"
-                output = await asyncio.to_thread(
-                    replicate.run,
-                    "salesforce/blip:2e1dddc8621f72155f24cf2e0adbde548458d3cab9f00c0139eea840d0ac4746",
-                    input=model_input,
-                )
+                async with scheduler.slot("salesforce/blip", ctx, "image"):
+                    prediction = await run_prediction(
+                        "salesforce/blip:2e1dddc8621f72155f24cf2e0adbde548458d3cab9f00c0139eea840d0ac4746",
+                        model_input,
+                        label="blip",
+                    )
+                if prediction.status == "failed":
+                    await ctx.reply(f"❌ Generation failed: {prediction.error or 'Unknown error'}")
+                    return
+                output = prediction.output or ""
                 result = output if isinstance(output, str) else "".join(output)
                 if result:
                     await ctx.reply(result[:2000])
@@ -64,18 +68,22 @@ class Vision(commands.Cog):
                 return
             async with ctx.typing():
                 if attachments:
-                    data_uri = await attachment_to_data_uri(attachments[0])
+                    image = await attachment_to_input(attachments[0])
                 else:
-                    data_uri = url_to_data_uri(embed_urls[0])
-                output = await asyncio.to_thread(
-                    replicate.run,
-                    "lucataco/moondream2:72ccb656353c348c1385df54b237eeb7bfa874bf11486cf0b9473e691b662d31",
-                    input={
-                        "image": data_uri,
-                        "prompt": text,
-                    },
-                )
-                result = "".join(output)
+                    image = await url_to_input(embed_urls[0])
+                async with scheduler.slot("lucataco/moondream2", ctx, "image"):
+                    prediction = await run_prediction(
+                        "lucataco/moondream2:72ccb656353c348c1385df54b237eeb7bfa874bf11486cf0b9473e691b662d31",
+                        {
+                            "image": image,
+                            "prompt": text,
+                        },
+                        label="caption",
+                    )
+                if prediction.status == "failed":
+                    await ctx.reply(f"❌ Generation failed: {prediction.error or 'Unknown error'}")
+                    return
+                result = "".join(prediction.output or [])
                 if result:
                     await ctx.reply(result[:2000])
                 else:
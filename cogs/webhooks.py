@@ -0,0 +1,79 @@
+"""Replicate webhook receiver.
+
+When WEBHOOK_URL is set, every prediction is created with a webhook for its
+start, output and completed events. Replicate POSTs those to
+/webhooks/replicate on the built-in server; each request's signature is
+verified and the prediction is handed to the shared poller, which wakes the
+command waiting on it immediately. Polling then only runs at a slow fallback
+interval to catch missed events.
+
+To exercise it offline, set HTTP_PORT and REPLICATE_WEBHOOK_SECRET to any
+"whsec_<base64>" key and POST a recorded payload signed with it to the local
+server; tests/test_webhooks.py does the same against a recorded payload.
+"""
+
+import json
+
+import replicate
+from aiohttp import web
+from replicate.prediction import Prediction
+from replicate.webhook import WebhookSigningSecret, WebhookValidationError
+
+from cogs.poller import poller
+from cogs.predictions import get_client
+from cogs.server import app
+from config.settings import settings
+
+WEBHOOK_PATH = "/webhooks/replicate"
+
+# Reject signed requests older than this (replay protection)
+TIMESTAMP_TOLERANCE = 5 * 60
+
+_secret: WebhookSigningSecret | None = None
+
+
+async def load_secret():
+    """Load the signing secret from settings, or fetch the account default.
+
+    Called whenever the server runs, so the receiver also works when only
+    REPLICATE_WEBHOOK_SECRET is set. Without WEBHOOK_URL a failed fetch only
+    leaves the receiver disabled (503) rather than stopping the bot.
+    """
+    global _secret
+    if settings.webhook_secret:
+        _secret = WebhookSigningSecret(key=settings.webhook_secret)
+        return
+    try:
+        _secret = await get_client().webhooks.default.async_secret()
+    except Exception as e:
+        if settings.webhook_url:
+            raise
+        print(f"[webhook] no signing secret, receiver disabled: {e}")
+
+
+async def handle_webhook(request: web.Request) -> web.Response:
+    if _secret is None:
+        return web.Response(status=503, text="webhook secret not loaded")
+    body = await request.text()
+    try:
+        replicate.webhooks.validate(
+            headers=dict(request.headers),
+            body=body,
+            secret=_secret,
+            tolerance=TIMESTAMP_TOLERANCE,
+        )
+    except (WebhookValidationError, ValueError) as e:
+        # malformed timestamp/signature headers raise ValueError (binascii.Error
+        # included) from inside validate(); treat them as a bad signature
+        print(f"[webhook] rejected: {e}")
+        return web.Response(status=401, text="invalid signature")
+    try:
+        prediction = Prediction(**json.loads(body))
+    except Exception as e:
+        print(f"[webhook] bad payload: {e}")
+        return web.Response(status=400, text="bad payload")
+    poller.notify(prediction)
+    return web.Response(text="ok")
+
+
+app.router.add_post(WEBHOOK_PATH, handle_webhook)
@@ -4,6 +4,9 @@ import os
 from dotenv import load_dotenv
 from pathlib import Path
 
+# Output formats cogs.imaging can re-encode images to (keys of imaging.FORMATS)
+IMAGE_FORMATS = ("webp", "jpeg")
+
 
 class Settings:
     """Application settings loaded from environment variables."""
@@ -12,6 +15,105 @@ class Settings:
         self.discord_token = os.getenv("DISCORD_BOT_TOKEN")
         self.replicate_api_token = os.getenv("REPLICATE_API_TOKEN")
         self.command_prefix = os.getenv("COMMAND_PREFIX", "/")
+        # Seconds a prediction create call may block (Prefer: wait) before polling
+        self.replicate_sync_wait = int(os.getenv("REPLICATE_SYNC_WAIT", "60"))
+        self.replicate_max_connections = int(os.getenv("REPLICATE_MAX_CONNECTIONS", "20"))
+        # Max individual prediction refreshes the central poller runs at once
+        self.poll_concurrency = int(os.getenv("POLL_CONCURRENCY", "8"))
+        # Minimum seconds between status-message edits in one channel
+        self.status_edit_interval = float(os.getenv("STATUS_EDIT_INTERVAL", "2"))
+        # Scheduler: concurrent jobs per model (overridable per slug or "ffmpeg" via
+        # MODEL_LIMITS="prunaai/p-video=2,ffmpeg=1") and per user in each lane
+        self.model_concurrency = int(os.getenv("MODEL_CONCURRENCY", "4"))
+        self.ffmpeg_concurrency = int(os.getenv("FFMPEG_CONCURRENCY", "2"))
+        self.user_concurrency = int(os.getenv("USER_CONCURRENCY", "2"))
+        self.model_limits = {
+            key.strip(): int(value)
+            for key, _, value in (
+                item.partition("=") for item in os.getenv("MODEL_LIMITS", "").split(",")
+            )
+            if key.strip() and value.strip()
+        }
+        # Machine-wide cap on concurrent ffmpeg/ffprobe processes (default: half the CPUs)
+        self.media_processes = int(
+            os.getenv("MEDIA_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2)))
+        )
+        # Route commands with a declared fallback (e.g. /pvid -> /lpvid) to it while their
+        # recent queue + run latency exceeds the SLO; LATENCY_SLOS="pvid=240" overrides
+        # the registry's SLOs, in seconds
+        self.latency_routing = os.getenv("LATENCY_ROUTING", "1") != "0"
+        self.latency_slos = {
+            key.strip(): float(value)
+            for key, _, value in (
+                item.partition("=") for item in os.getenv("LATENCY_SLOS", "").split(",")
+            )
+            if key.strip() and value.strip()
+        }
+        self.latency_window = int(os.getenv("LATENCY_WINDOW", "900"))
+        self.latency_min_samples = int(os.getenv("LATENCY_MIN_SAMPLES", "3"))
+        # Optional on-disk cache of deterministic model outputs
+        self.result_cache = os.getenv("RESULT_CACHE", "0") == "1"
+        self.result_cache_dir = os.getenv("RESULT_CACHE_DIR", ".cache/results")
+        self.result_cache_max_bytes = int(os.getenv("RESULT_CACHE_MAX_MB", "1024")) * 1024 * 1024
+        self.result_cache_ttl = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+        self.result_cache_exclude = {
+            m.strip() for m in os.getenv("RESULT_CACHE_EXCLUDE", "").split(",") if m.strip()
+        }
+        # Normalized /continue segments kept per chain so continuing only encodes the new clip
+        self.segment_dir = os.getenv("SEGMENT_DIR", ".cache/segments")
+        self.segment_ttl = int(os.getenv("SEGMENT_TTL", str(3 * 24 * 3600)))
+        # Wall-clock budget (seconds) for re-encoding a /continue chain, and where encode
+        # predictions vs results are kept to tune strategy selection
+        self.encode_time_budget = float(os.getenv("ENCODE_TIME_BUDGET", "60"))
+        self.encode_stats_path = os.getenv("ENCODE_STATS_PATH", ".cache/encode_stats.jsonl")
+        # Media buffers spill to SPOOL_DIR above SPOOL_THRESHOLD_MB each, or when all
+        # buffers together would hold more than SPOOL_MEMORY_MB in memory
+        self.spool_dir = os.getenv("SPOOL_DIR", ".cache/spool")
+        self.spool_threshold = int(os.getenv("SPOOL_THRESHOLD_MB", "4")) * 1024 * 1024
+        self.spool_memory_budget = int(os.getenv("SPOOL_MEMORY_MB", "64")) * 1024 * 1024
+        # Attached images larger than a command's max_input_side are downscaled before staging
+        self.input_downscale = os.getenv("INPUT_DOWNSCALE", "1") != "0"
+        # Fetched input media (attachments, URLs) kept on disk, least recently used evicted
+        self.media_cache_dir = os.getenv("MEDIA_CACHE_DIR", ".cache/media")
+        self.media_cache_max_bytes = int(os.getenv("MEDIA_CACHE_MAX_MB", "1024")) * 1024 * 1024
+        # Image outputs are re-encoded to IMAGE_FORMAT (see IMAGE_FORMATS) at IMAGE_QUALITY,
+        # stepping quality down to stay under IMAGE_TARGET_KB, in IMAGE_WORKERS processes
+        self.image_format = os.getenv("IMAGE_FORMAT", "webp").lower()
+        self.image_quality = int(os.getenv("IMAGE_QUALITY", "85"))
+        self.image_target_kb = int(os.getenv("IMAGE_TARGET_KB", "2048"))
+        self.image_workers = int(os.getenv("IMAGE_WORKERS", "2"))
+        # SQLite ledger of predictions and posted outputs (/gimme, /find); empty disables it
+        self.ledger_path = os.getenv("LEDGER_PATH", "data/ledger.sqlite3")
+        # Built-in HTTP server (webhooks, /metrics); disabled unless HTTP_PORT is set
+        self.http_host = os.getenv("HTTP_HOST", "127.0.0.1")
+        self.http_port = int(os.getenv("HTTP_PORT", "0"))
+        # Public URL Replicate should POST prediction events to (routes to /webhooks/replicate)
+        self.webhook_url = os.getenv("WEBHOOK_URL")
+        self.webhook_secret = os.getenv("REPLICATE_WEBHOOK_SECRET")
+        # Poll interval used only as a fallback for missed webhook events
+        self.webhook_fallback_interval = float(os.getenv("WEBHOOK_FALLBACK_INTERVAL", "30"))
+        # Simultaneous media downloads, and keep-alive connections per host
+        self.download_concurrency = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+        self.download_per_host = int(os.getenv("DOWNLOAD_PER_HOST", "4"))
+        # Parallel fetches per command when gathering reference images, and per-input timeout
+        self.input_concurrency = int(os.getenv("INPUT_CONCURRENCY", "6"))
+        self.input_timeout = int(os.getenv("INPUT_TIMEOUT", "30"))
+        # Upload inputs to Replicate file storage (cached by content hash) instead of data URIs
+        self.stage_inputs = os.getenv("STAGE_INPUTS", "1") != "0"
+        self.stage_cache_size = int(os.getenv("STAGE_CACHE_SIZE", "512"))
+        # Hand URLs on these hosts straight to the model instead of re-uploading them
+        self.url_passthrough = os.getenv("URL_PASSTHROUGH", "1") != "0"
+        self.passthrough_hosts = [
+            h.strip().lower()
+            for h in os.getenv(
+                "PASSTHROUGH_HOSTS",
+                "cdn.discordapp.com,media.discordapp.net,replicate.delivery",
+            ).split(",")
+            if h.strip()
+        ]
+        # How long a posted output's Replicate URL (its ledger lineage source_url) is reused
+        # for follow-up commands
+        self.output_url_ttl = int(os.getenv("OUTPUT_URL_TTL", "3000"))
 
     @property
     def is_configured(self) -> bool:
@@ -25,6 +127,11 @@ class Settings:
                 "DISCORD_BOT_TOKEN environment variable is required. "
                 "Please create a .env file or set the environment variable."
             )
+        if self.image_format not in IMAGE_FORMATS:
+            raise ValueError(
+                f"IMAGE_FORMAT must be one of {', '.join(IMAGE_FORMATS)}, "
+                f"not {self.image_format!r}."
+            )
 
 
 # Load environment variables from .env file if it exists
@@ -0,0 +1,82 @@
+"""Signature checks of the Replicate webhook receiver, against a recorded payload."""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from replicate.webhook import WebhookSigningSecret
+
+from cogs import webhooks
+from cogs.poller import poller
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "replicate_webhook.json")
+KEY = base64.b64encode(b"offline-test-signing-key").decode()
+
+
+@pytest.fixture
+def payload() -> str:
+    with open(FIXTURE, encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(webhooks, "_secret", WebhookSigningSecret(key=f"whsec_{KEY}"))
+
+
+def sign(body: str, webhook_id: str = "msg_1", timestamp: int | None = None) -> dict:
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    content = f"{webhook_id}.{timestamp}.{body}".encode()
+    digest = hmac.new(base64.b64decode(KEY), content, hashlib.sha256).digest()
+    return {
+        "webhook-id": webhook_id,
+        "webhook-timestamp": str(timestamp),
+        "webhook-signature": "v1," + base64.b64encode(digest).decode(),
+    }
+
+
+def post(body: str, headers: dict) -> int:
+    async def go():
+        app = web.Application()
+        app.router.add_post(webhooks.WEBHOOK_PATH, webhooks.handle_webhook)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.post(webhooks.WEBHOOK_PATH, data=body, headers=headers)
+            return resp.status
+
+    return asyncio.run(go())
+
+
+def test_signed_payload_reaches_poller(payload):
+    assert post(payload, sign(payload)) == 200
+    assert poller._early.pop("ufawqhfynnddngldkgtslldrkq").status == "succeeded"
+
+
+def test_tampered_body_rejected(payload):
+    headers = sign(payload)
+    assert post(payload.replace("succeeded", "failed"), headers) == 401
+
+
+def test_stale_timestamp_rejected(payload):
+    stale = int(time.time()) - webhooks.TIMESTAMP_TOLERANCE - 60
+    assert post(payload, sign(payload, timestamp=stale)) == 401
+
+
+@pytest.mark.parametrize("header, value", [
+    ("webhook-timestamp", "not-a-number"),
+    ("webhook-signature", "v1,!!!"),
+    ("webhook-signature", "v1"),
+])
+def test_malformed_headers_rejected(payload, header, value):
+    headers = {**sign(payload), header: value}
+    assert post(payload, headers) == 401
+
+
+def test_no_secret_is_unavailable(payload, monkeypatch):
+    monkeypatch.setattr(webhooks, "_secret", None)
+    assert post(payload, sign(payload)) == 503